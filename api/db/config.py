@@ -23,6 +23,42 @@ class Settings(BaseConfig):
     postgres_db: str = os.environ.get('POSTGRES_DB')
     postgres_db_tests: str = os.environ.get('POSTGRES_DB_TESTS')
     db_echo_log: bool = True if os.environ.get('DEBUG') == 'True' else False
+    db_pool_size: int = int(os.environ.get('DB_POOL_SIZE', 10))
+    db_max_overflow: int = int(os.environ.get('DB_MAX_OVERFLOW', 50))
+    db_pool_warmup: int = int(os.environ.get('DB_POOL_WARMUP', 5))
+    redis_url: str = os.environ.get('REDIS_URL', os.environ.get('CELERY_BROKER_URL', 'redis://redis:6379'))
+    customer_import_batch_size: int = int(os.environ.get('CUSTOMER_IMPORT_BATCH_SIZE', 10000))
+    customer_import_max_errors: int = int(os.environ.get('CUSTOMER_IMPORT_MAX_ERRORS', 1000))
+    export_batch_size: int = int(os.environ.get('EXPORT_BATCH_SIZE', 10000))
+    audience_estimate_sample_rows: int = int(os.environ.get('AUDIENCE_ESTIMATE_SAMPLE_ROWS', 10000))
+    audience_index_rebuild_interval: float = float(os.environ.get('AUDIENCE_INDEX_REBUILD_INTERVAL', 300))
+    sender_pool_size: int = int(os.environ.get('SENDER_POOL_SIZE', 100))
+    sender_pool_warmup: int = int(os.environ.get('SENDER_POOL_WARMUP', 10))
+    sender_connect_timeout: float = float(os.environ.get('SENDER_CONNECT_TIMEOUT', 3))
+    sender_read_timeout: float = float(os.environ.get('SENDER_READ_TIMEOUT', 10))
+    sender_total_timeout: float = float(os.environ.get('SENDER_TOTAL_TIMEOUT', 15))
+    sender_keepalive_timeout: float = float(os.environ.get('SENDER_KEEPALIVE_TIMEOUT', 30))
+    sender_dns_cache_ttl: int = int(os.environ.get('SENDER_DNS_CACHE_TTL', 300))
+    sender_concurrency: int = int(os.environ.get('SENDER_CONCURRENCY', 50))
+    sender_chunk_size: int = int(os.environ.get('SENDER_CHUNK_SIZE', 1000))
+    sender_status_flush_size: int = int(os.environ.get('SENDER_STATUS_FLUSH_SIZE', 500))
+    sender_status_flush_interval: float = float(os.environ.get('SENDER_STATUS_FLUSH_INTERVAL', 0.5))
+    sender_lease_ttl: float = float(os.environ.get('SENDER_LEASE_TTL', 60))
+    sender_bulk_threshold: int = int(os.environ.get('SENDER_BULK_THRESHOLD', 100000))
+    sender_scan_interval: float = float(os.environ.get('SENDER_SCAN_INTERVAL', 900))
+    sender_start_horizon: float = float(os.environ.get('SENDER_START_HORIZON', 86400))
+    sender_broker_connect_timeout: float = float(os.environ.get('SENDER_BROKER_CONNECT_TIMEOUT', 2))
+    sender_max_tries: int = int(os.environ.get('SENDER_MAX_TRIES', 3))
+    sender_retry_base_delay: float = float(os.environ.get('SENDER_RETRY_BASE_DELAY', 0.5))
+    sender_retry_max_delay: float = float(os.environ.get('SENDER_RETRY_MAX_DELAY', 10))
+    sender_breaker_failure_threshold: int = int(os.environ.get('SENDER_BREAKER_FAILURE_THRESHOLD', 20))
+    sender_breaker_failure_window: float = float(os.environ.get('SENDER_BREAKER_FAILURE_WINDOW', 30))
+    sender_breaker_reset_timeout: float = float(os.environ.get('SENDER_BREAKER_RESET_TIMEOUT', 60))
+    sender_breaker_state_ttl: float = float(os.environ.get('SENDER_BREAKER_STATE_TTL', 1))
+    sender_rate_limit: float = float(os.environ.get('SENDER_RATE_LIMIT', 0))
+    sender_rate_burst: float | None = float(os.environ.get('SENDER_RATE_BURST', 0)) or None
+    sender_rate_batch: int = int(os.environ.get('SENDER_RATE_BATCH', 10))
+    sender_expected_latency: float = float(os.environ.get('SENDER_EXPECTED_LATENCY', 0.1))
 
     class Config:
         env_file = '.env'
@@ -1,3 +1,8 @@
+class EntityAlreadyExists(Exception):
+    """Raised when entity with the same unique fields is already in database."""
+    pass
+
+
 class EntityDoesNotExist(Exception):
     """Raised when entity was not found in database."""
     pass
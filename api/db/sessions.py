@@ -2,6 +2,7 @@ from typing import Generator
 
 from asyncio import current_task
 from fastapi import Depends
+from redis import asyncio as aioredis
 from sqlalchemy.ext.asyncio import create_async_engine, async_scoped_session
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import Session, SQLModel, create_engine
@@ -18,6 +19,13 @@ async_engine = create_async_engine(
     url=settings.async_database_url,
     echo=settings.db_echo_log,
     future=True,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+)
+
+async_redis = aioredis.from_url(
+    settings.redis_url,
+    decode_responses=True,
 )
 
 async_session = async_scoped_session(
@@ -6,7 +6,7 @@ from db.errors import (
     WrongDatetimeError,
 )
 from db.sample_data import add_sample_data
-from db.sessions import engine
+from db.sessions import async_engine, engine
 from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from prometheus_client import CollectorRegistry, make_asgi_app, multiprocess
@@ -20,7 +20,9 @@ from routers import (
     users,
     web,
 )
+from services.audience_index import audience_index
 from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette import status
 from starlette.responses import JSONResponse
 from utils.logging import log_request_info
@@ -76,6 +78,12 @@ async def init_tables():
     add_sample_data()
 
 
+@app.on_event("startup")
+async def build_audience_index():
+    async with AsyncSession(async_engine) as async_session:
+        await audience_index.build(async_session)
+
+
 @app.exception_handler(PhoneCodeError)
 async def phone_code_exception_handler(request: Request, exc: PhoneCodeError):
     return JSONResponse(
@@ -1,21 +1,34 @@
-from sqlalchemy import select
+from sqlalchemy import column, insert, select, update
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from db.errors import EntityDoesNotExist
+from db.errors import EntityAlreadyExists, EntityDoesNotExist
+
+UNIQUE_VIOLATION = '23505'
 
 
 class BaseRepository:
+    # Relationships of the repository's model its Read schema serializes, other ones are not loaded.
+    load_plan: tuple[str, ...] = ()
+
     def __init__(self, session: AsyncSession):
         self.session = session
 
-    async def _get_instance(self, model, model_id: int):
+    def _load_options(self, model) -> list:
+        if model is not getattr(self, 'model', None):
+            return []
+        return [selectinload(getattr(model, relationship)) for relationship in self.load_plan]
+
+    async def _get_instance(self, model, model_id: int, load_all: bool = False):
         query = select(model).where(model.id == model_id)
-        result = await self.session.scalars(query.options(selectinload('*')))
+        options = [selectinload('*')] if load_all else self._load_options(model)
+        result = await self.session.scalars(query.options(*options))
         return result.first()
 
     async def get_list(self, query):
-        results = await self.session.exec(query.options(selectinload('*')))
+        results = await self.session.exec(query.options(*self._load_options(getattr(self, 'model', None))))
         try:
             return results.scalars().all()
         except AttributeError:
@@ -39,10 +52,59 @@ class BaseRepository:
 
         return result
 
-    async def _create_not_unique(self, model, model_create):
+    async def _returning(self, model, statement, **extra_columns) -> Row:
+        """Run INSERT/UPDATE ... RETURNING and commit, returns the row as (instance, *extra_columns).
+
+        The instance is loaded from the returned row with the load plan of the model,
+        EntityDoesNotExist is raised if no row is affected and EntityAlreadyExists if a unique
+        constraint is violated.
+        """
+        query = (
+            select(model, *(column(name) for name in extra_columns))
+            .from_statement(
+                statement.returning(
+                    *model.__table__.c,
+                    *(value.label(name) for name, value in extra_columns.items()),
+                )
+            )
+            .options(*self._load_options(model))
+            .execution_options(populate_existing=True)
+        )
+        try:
+            results = await self.session.execute(query)
+        except IntegrityError as err:
+            await self.session.rollback()
+            if getattr(err.orig, 'sqlstate', None) == UNIQUE_VIOLATION:
+                raise EntityAlreadyExists from err
+            raise
+        if (row := results.first()) is None:
+            raise EntityDoesNotExist
+        await self._commit_returned()
+        return row
+
+    async def _commit_returned(self) -> None:
+        # the returned values are current, so instances are not expired to be loaded again
+        sync_session = self.session.sync_session
+        expire_on_commit, sync_session.expire_on_commit = sync_session.expire_on_commit, False
+        try:
+            await self.session.commit()
+        finally:
+            sync_session.expire_on_commit = expire_on_commit
+
+    async def _update_returning(self, model, model_id: int, values: dict, **extra_columns) -> Row:
+        return await self._returning(
+            model,
+            update(model).where(model.id == model_id).values(**values),
+            **extra_columns,
+        )
+
+    async def _create_not_unique(self, model, model_create, **values):
         new_item = model.from_orm(model_create)
-        await self._add_to_db(new_item)
-        return await self._get_instance(model, new_item.id)
+        row = await self._returning(
+            model,
+            insert(model).values({**new_item.dict(exclude={'id'}), **values}),
+        )
+        return row[0]
 
     async def list(self, model, limit: int = 50, offset: int = 0):
         query = select(model).order_by(model.id).offset(offset).limit(limit)
@@ -55,20 +117,18 @@ class BaseRepository:
             raise EntityDoesNotExist
 
     async def update(self, model, model_id: int, model_update):
-        if item := await self._get_instance(model, model_id):
-            item_dict = model_update.dict(
-                exclude_unset=True,
-                exclude={'id'},
-            )
-            for key, value in item_dict.items():
-                setattr(item, key, value)
-            await self._add_to_db(item)
-            return await self._get_instance(model, model_id)
-        else:
-            raise EntityDoesNotExist
+        item_dict = model_update.dict(
+            exclude_unset=True,
+            exclude={'id'},
+        )
+        if not item_dict:
+            return await self.get(model, model_id)
+        row = await self._update_returning(model, model_id, item_dict)
+        return row[0]
 
     async def delete(self, model, model_id: int) -> None:
-        if item := await self._get_instance(model, model_id):
+        # the unit of work has to see every related row to unlink it
+        if item := await self._get_instance(model, model_id, load_all=True):
             await self.session.delete(item)
             await self.session.commit()
         else:
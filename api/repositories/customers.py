@@ -1,26 +1,112 @@
 import re
 from typing import Optional
 
-from sqlalchemy.orm import selectinload
+from sqlalchemy import ARRAY, Integer, String, and_, case, cast, exists, func, literal_column, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import Select, column, table
 from sqlmodel import select
 
-from db.errors import EntityDoesNotExist, PhoneError
+from db.errors import EntityAlreadyExists, EntityDoesNotExist, PhoneError
 from repositories.base import BaseRepository
 from schemas.phone_codes import PhoneCode, PhoneCodeCreate, PhoneCodeRead
 from schemas.timezones import Timezone, TimezoneCreate, TimezoneRead
-from schemas.tags import Tag, TagCreate, TagRead
+from schemas.tags import TAG_SEPARATOR, Tag, TagCreate, TagRead
 from schemas.customers import Customer, CustomerCreate, CustomerRead, CustomerUpdate
+from schemas.link_schemas import CustomerTag
+from services.audience_index import audience_index
 from services.sender.metrics import customers_total_created
 
 
+PHONE_PATTERN = '^[0-9]{7}$'
+COUNTRY_CODE_PATTERN = '^[0-9]{1,3}$'
+# Characters trimmed from the values of imported rows, as by str.strip().
+WHITESPACE = ' \t\n\r\f\v'
+
+# Staging table of the bulk import, created once per connection and emptied before every batch.
+# Rows are copied as they are in the file, they are checked and resolved to ids by staged_customers().
+customers_import = table(
+    'customers_import',
+    column('line', Integer),
+    column('country_code', String),
+    column('phone_code', String),
+    column('phone', String),
+    column('timezone', String),
+    column('tags', String),
+)
+create_customers_import = text(
+    'CREATE TEMPORARY TABLE IF NOT EXISTS customers_import ('
+    'line integer, country_code varchar, phone_code varchar, phone varchar, timezone varchar, tags varchar)'
+)
+
+
+def audience_query(tag_ids: list[int], phone_code_ids: list[int] | None = None):
+    """Customers having any of the tags and, if phone codes are given, one of the phone codes.
+
+    Selects (id, msisdn, timezone_id), every customer once.
+    """
+    query = (
+        select(
+            Customer.id,
+            func.concat(Customer.country_code, PhoneCode.phone_code, Customer.phone).label('msisdn'),
+            Customer.timezone_id,
+        )
+        .join(PhoneCode, PhoneCode.id == Customer.phone_code_id)
+        .where(
+            exists()
+            .where(CustomerTag.customer_id == Customer.id)
+            .where(CustomerTag.tag_id.in_(tag_ids))
+        )
+    )
+    if phone_code_ids:
+        query = query.where(Customer.phone_code_id.in_(phone_code_ids))
+    return query
+
+
+def staged_customers():
+    """Rows of the staging table with phone codes and timezones resolved to ids.
+
+    Selects (line, country_code, phone_code_id, phone, timezone_id, tags, error), `error` is set for invalid rows.
+    An empty country code is 7, an empty timezone is not changed.
+    """
+    staged = select(
+        customers_import.c.line,
+        func.coalesce(func.nullif(func.btrim(customers_import.c.country_code, WHITESPACE), ''), '7').label('country_code'),
+        func.btrim(customers_import.c.phone_code, WHITESPACE).label('phone_code'),
+        func.btrim(customers_import.c.phone, WHITESPACE).label('phone'),
+        func.nullif(func.btrim(customers_import.c.timezone, WHITESPACE), '').label('timezone'),
+        func.string_to_array(customers_import.c.tags, TAG_SEPARATOR).label('tags'),
+    ).subquery()
+    country_code_is_valid = staged.c.country_code.regexp_match(COUNTRY_CODE_PATTERN)
+    error = case(
+        (~staged.c.phone.regexp_match(PHONE_PATTERN), 'Phone is not a string of 7 digits'),
+        (PhoneCode.id.is_(None), func.format('Phone code %L not found', staged.c.phone_code)),
+        (and_(staged.c.timezone.is_not(None), Timezone.id.is_(None)), func.format('Timezone %L not found', staged.c.timezone)),
+        (~country_code_is_valid, 'Country code is not a number of 1 to 3 digits'),
+    )
+    return (
+        select(
+            staged.c.line,
+            # cast only valid codes, the rows are filtered by `error` after the columns are computed
+            case((country_code_is_valid, cast(staged.c.country_code, Integer))).label('country_code'),
+            PhoneCode.id.label('phone_code_id'),
+            staged.c.phone,
+            Timezone.id.label('timezone_id'),
+            staged.c.tags,
+            error.label('error'),
+        )
+        .outerjoin(PhoneCode, PhoneCode.phone_code == staged.c.phone_code)
+        .outerjoin(Timezone, Timezone.timezone == staged.c.timezone)
+    )
+
+
 def check_phone(phone):
-    regex = r'^[0-9]{7}$'
-    if not re.search(regex, phone, re.I):
+    if not re.search(PHONE_PATTERN, phone, re.I):
         raise PhoneError
 
 
 class CustomerRepository(BaseRepository):
     model = Customer
+    load_plan = ('tags',)
 
     async def create(self, model_create: CustomerCreate) -> CustomerRead:
         check_phone(model_create.phone)
@@ -38,9 +124,150 @@ class CustomerRepository(BaseRepository):
 
         if not phone_code or not timezone:
             raise EntityDoesNotExist
-        else:
-            customers_total_created.inc()
-            return await self._create_not_unique(self.model, model_create)
+
+        new_item = self.model.from_orm(model_create)
+        try:
+            result, = await self._returning(
+                self.model,
+                insert(self.model).values(new_item.dict(exclude={'id'})).on_conflict_do_nothing(),
+            )
+        except EntityDoesNotExist:
+            raise EntityAlreadyExists
+        customers_total_created.inc()
+        audience_index.set_customer(
+            customer_id=result.id, phone_code_id=result.phone_code_id, timezone_id=result.timezone_id,
+        )
+        return result
+
+    async def import_batch(self, records: list[tuple]) -> tuple[int, int, list[tuple[int, str]]]:
+        """Load customers with COPY into a staging table, check them and merge with INSERT ... ON CONFLICT.
+
+        Records are (line, country_code, phone_code, phone, timezone, tags) tuples of strings as they are in the file,
+        tags are separated with TAG_SEPARATOR. Phone codes and timezones are resolved by their names, missing tags are created.
+        A phone repeated in the batch gets the timezone of its last line and the tags of all its lines.
+        Existing customers get the new timezone, if it is given, and the tags are added to theirs.
+        Returns the numbers of created and updated customers and the (line, error) of invalid rows.
+        """
+        await self.session.execute(create_customers_import)
+        await self.session.execute(text('TRUNCATE customers_import'))
+        connection = await (await self.session.connection()).get_raw_connection()
+        await connection.driver_connection.copy_records_to_table(
+            'customers_import',
+            records=records,
+            columns=[staging_column.name for staging_column in customers_import.c],
+        )
+        # temporary tables are not analyzed by autovacuum, without statistics customers would be scanned to be joined
+        await self.session.execute(text('ANALYZE customers_import'))
+
+        staged = staged_customers().subquery()
+        results = await self.session.execute(
+            select(staged.c.line, staged.c.error).where(staged.c.error.is_not(None)).order_by(staged.c.line)
+        )
+        errors = results.all()
+
+        staged_tags = (
+            select(
+                staged.c.country_code,
+                staged.c.phone_code_id,
+                staged.c.phone,
+                func.btrim(func.unnest(staged.c.tags), WHITESPACE).label('tag'),
+            )
+            .where(staged.c.error.is_(None))
+            .subquery()
+        )
+        await self.session.execute(
+            insert(Tag)
+            .from_select(['tag'], select(staged_tags.c.tag).where(staged_tags.c.tag != '').distinct())
+            .on_conflict_do_nothing(index_elements=[Tag.tag])
+        )
+
+        phone = (staged.c.country_code, staged.c.phone_code_id, staged.c.phone)
+        query = insert(self.model).from_select(
+            ['country_code', 'phone_code_id', 'phone', 'timezone_id'],
+            select(*phone, staged.c.timezone_id)
+            .where(staged.c.error.is_(None))
+            .distinct(*phone)
+            .order_by(*phone, staged.c.line.desc()),
+        )
+        query = (
+            query
+            .on_conflict_do_update(
+                constraint='uq_customers_phone',
+                set_={'timezone_id': query.excluded.timezone_id},
+                where=and_(
+                    query.excluded.timezone_id.is_not(None),
+                    self.model.timezone_id.is_distinct_from(query.excluded.timezone_id),
+                ),
+            )
+            .returning(
+                self.model.id,
+                self.model.phone_code_id,
+                self.model.timezone_id,
+                literal_column('xmax = 0').label('created'),
+            )
+        )
+        results = await self.session.execute(query)
+        customers = results.all()
+
+        results = await self.session.execute(
+            insert(CustomerTag)
+            .from_select(
+                ['customer_id', 'tag_id'],
+                select(self.model.id, Tag.id)
+                .join(
+                    staged_tags,
+                    and_(
+                        self.model.country_code == staged_tags.c.country_code,
+                        self.model.phone_code_id == staged_tags.c.phone_code_id,
+                        self.model.phone == staged_tags.c.phone,
+                    ),
+                )
+                .join(Tag, Tag.tag == staged_tags.c.tag),
+            )
+            .on_conflict_do_nothing()
+            .returning(CustomerTag.customer_id, CustomerTag.tag_id)
+        )
+        customer_tags = results.all()
+        await self.session.commit()
+
+        for customer in customers:
+            audience_index.set_customer(
+                customer_id=customer.id, phone_code_id=customer.phone_code_id, timezone_id=customer.timezone_id,
+            )
+        for customer_id, tag_id in customer_tags:
+            audience_index.add_customer_tag(customer_id=customer_id, tag_id=tag_id)
+
+        created = sum(customer.created for customer in customers)
+        customers_total_created.inc(created)
+        return created, len(customers) - created, [tuple(error) for error in errors]
+
+    def export_query(self, tag: Optional[list[str]] = None, phone_code: str | None = None) -> Select:
+        """All customers with the tags and the phone code in the format of the bulk import, ordered by id."""
+        tags = (
+            select(Tag.tag)
+            .join(CustomerTag, CustomerTag.tag_id == Tag.id)
+            .where(CustomerTag.customer_id == self.model.id)
+            .order_by(Tag.tag)
+            .scalar_subquery()
+        )
+        query = (
+            select(
+                self.model.id,
+                self.model.country_code,
+                PhoneCode.phone_code,
+                self.model.phone,
+                Timezone.timezone,
+                func.array(tags, type_=ARRAY(String)).label('tags'),
+            )
+            .outerjoin(PhoneCode, PhoneCode.id == self.model.phone_code_id)
+            .outerjoin(Timezone, Timezone.id == self.model.timezone_id)
+            .order_by(self.model.id)
+        )
+        if tag:
+            query = query.where(self.model.tags.any(Tag.tag.in_(tag)))
+        if phone_code:
+            query = query.where(PhoneCode.phone_code == phone_code)
+        return query
 
     async def list(
         self,
@@ -49,6 +276,7 @@ class CustomerRepository(BaseRepository):
         phone_code: str | None = None,
         offset: int = 0,
     ) -> list[CustomerRead]:
+        # filtered by the DB, the audience index only sees changes made through this process
         query = select(self.model).order_by(self.model.id)
         if tag:
             query = query.where(self.model.tags.any(Tag.tag.in_(tag)))
@@ -61,7 +289,7 @@ class CustomerRepository(BaseRepository):
         query = query.offset(offset).limit(limit)
 
         results = await self.session.exec(
-            query.options(selectinload(self.model.tags))
+            query.options(*self._load_options(self.model))
         )
         return results.all()
 
@@ -70,10 +298,20 @@ class CustomerRepository(BaseRepository):
 
     async def update(self, model_id: int, model_update: CustomerUpdate) -> Optional[CustomerRead]:
         check_phone(model_update.phone)
-        return await super().update(self.model, model_id, model_update)
+        result = await super().update(self.model, model_id, model_update)
+        audience_index.set_customer(
+            customer_id=model_id, phone_code_id=result.phone_code_id, timezone_id=result.timezone_id,
+        )
+        return result
+
+    async def delete(self, model, model_id: int) -> None:
+        await super().delete(model, model_id)
+        audience_index.remove_customer(model_id)
 
     async def delete_customer_tag(self, model_id: int, tag_id: int) -> Optional[CustomerRead]:
-        return await super().delete_model_tag(self.model, model_id, Tag, tag_id)
+        result = await super().delete_model_tag(self.model, model_id, Tag, tag_id)
+        audience_index.remove_customer_tag(customer_id=model_id, tag_id=tag_id)
+        return result
 
     async def delete_model_tag(self, model, model_id: int, tag_model, tag_id: int):
         raise NotImplementedError
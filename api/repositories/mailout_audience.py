@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from sqlalchemy import delete, func, literal, or_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Row
+from sqlmodel import select
+
+from repositories.base import BaseRepository
+from repositories.customers import audience_query
+from schemas.base import StatusEnum
+from schemas.mailout_audience import MailoutAudience
+from schemas.mailouts import Mailout
+
+
+class MailoutAudienceRepository(BaseRepository):
+    model = MailoutAudience
+
+    async def create_snapshot(
+        self,
+        mailout_id: int,
+        tag_ids: list[int],
+        phone_code_ids: list[int] | None = None,
+        snapshot_at: datetime | None = None,
+    ) -> int:
+        """Freeze the mailout's audience with one INSERT ... SELECT, returns the number of added customers.
+
+        Customers already in the snapshot keep their status.
+        """
+        customers = audience_query(tag_ids=tag_ids, phone_code_ids=phone_code_ids).subquery()
+        query = (
+            insert(self.model)
+            .from_select(
+                ['mailout_id', 'customer_id', 'msisdn', 'timezone_id', 'status'],
+                select(
+                    literal(mailout_id),
+                    customers.c.id,
+                    customers.c.msisdn,
+                    customers.c.timezone_id,
+                    literal(StatusEnum.pending),
+                ),
+            )
+            .on_conflict_do_nothing(index_elements=[self.model.mailout_id, self.model.customer_id])
+        )
+        results = await self.session.execute(query)
+        await self.session.execute(
+            update(Mailout)
+            .where(Mailout.id == mailout_id)
+            .values(audience_snapshot_at=snapshot_at or datetime.utcnow())
+        )
+        await self.session.commit()
+        return results.rowcount
+
+    async def reset_snapshot(self, mailout_id: int) -> None:
+        """Have the mailout's audience snapshotted again and looked through from the start.
+
+        Customers who have not been messaged yet are dropped, so the next snapshot leaves out
+        those who are not in the audience anymore. Committed by the caller with the change of the audience.
+        """
+        await self.session.execute(
+            delete(self.model)
+            .where(self.model.mailout_id == mailout_id)
+            .where(self.model.status == StatusEnum.pending)
+        )
+        await self.session.execute(
+            update(Mailout)
+            .where(Mailout.id == mailout_id)
+            .values(audience_snapshot_at=None, last_customer_id=None)
+        )
+
+    async def select_pending(
+        self,
+        mailout_id: int,
+        exclude_timezone_ids: list[int] | None = None,
+        after_customer_id: int = 0,
+        limit: int = 1000,
+    ) -> list[Row]:
+        """Customers of the snapshot who have not been messaged yet as (id, msisdn) rows ordered by id."""
+        query = (
+            select(self.model.customer_id.label('id'), self.model.msisdn)
+            .where(self.model.mailout_id == mailout_id)
+            .where(self.model.status == StatusEnum.pending)
+            .where(self.model.customer_id > after_customer_id)
+            .order_by(self.model.customer_id)
+            .limit(limit)
+        )
+        if exclude_timezone_ids:
+            query = query.where(
+                or_(self.model.timezone_id.is_(None), self.model.timezone_id.not_in(exclude_timezone_ids))
+            )
+
+        results = await self.session.execute(query)
+        return results.all()
+
+    async def get_stats(self, mailout_id: int):
+        query = (
+            select(
+                self.model.status.label('status'),
+                func.count().label('count')
+            )
+            .where(self.model.mailout_id == mailout_id)
+            .group_by(self.model.status)
+            .order_by(func.count().desc())
+        )
+        results = await self.session.execute(query)
+        return results.all()
+
+    async def delete_model_tag(self, model, model_id: int, tag_model, tag_id: int):
+        raise NotImplementedError
+
+    async def delete_model_phone_code(self, model, model_id: int, phone_code_model, phone_code_id: int):
+        raise NotImplementedError
@@ -1,14 +1,28 @@
-from datetime import datetime
+import asyncio
+from datetime import datetime, timedelta
 from typing import Optional
+import json
+import uuid
 
+from sqlalchemy import case, func, tablesample, text, update
+from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects import postgresql
 from sqlmodel import select
 
+from db.config import settings
 from db.errors import EntityDoesNotExist, WrongDatetimeError
 from repositories.base import BaseRepository
+from repositories.customers import audience_query
+from repositories.mailout_audience import MailoutAudienceRepository
+from schemas.customers import Customer
 from schemas.phone_codes import PhoneCode
 from schemas.tags import Tag
-from schemas.mailouts import Mailout, MailoutRead, MailoutCreate, MailoutUpdate
+from schemas.timezones import Timezone
+from schemas.mailouts import Mailout, MailoutAudienceEstimate, MailoutRead, MailoutCreate, MailoutUpdate
+from services.audience_index import audience_index
+from services.sender.celery_app import dispatch_mailout, revoke_mailout_start, schedule_mailout_start
 from services.sender.metrics import mailouts_total_created
+from services.sender.queues import select_queue
 
 
 def check_time(model):
@@ -21,11 +35,130 @@ def check_time(model):
 
 class MailoutRepository(BaseRepository):
     model = Mailout
+    load_plan = ('tags', 'phone_codes')
 
     async def create(self, model_create: MailoutCreate) -> MailoutRead:
         check_time(model_create)
         mailouts_total_created.inc()
-        return await self._create_not_unique(self.model, model_create)
+        start_task_id = str(uuid.uuid4())
+        result = await self._create_not_unique(self.model, model_create, start_task_id=start_task_id)
+        await asyncio.to_thread(schedule_mailout_start, result.id, result.start_at, task_id=start_task_id)
+        return result
+
+    async def get_audience_estimate(self, model_id: int, sample_size: int = 10) -> MailoutAudienceEstimate:
+        """Recipients the mailout would be sent to, without counting them in the DB.
+
+        Counts are exact when the audience index is built and customers have not changed since,
+        otherwise the count is the planner's estimate, broken down by phone code and timezone as in a sample
+        of the audience, and a stale index is rebuilt in the background.
+        The send rate is the slowest of the mailout's and the global rate limits and of the messages in flight
+        at SENDER_EXPECTED_LATENCY per request.
+        """
+        mailout = await super().get(self.model, model_id)
+        tag_ids = [tag.id for tag in mailout.tags]
+        phone_code_ids = [phone_code.id for phone_code in mailout.phone_codes] or None
+
+        if await audience_index.is_fresh(self.session):
+            customers = audience_index.select(tag_ids=tag_ids, phone_code_ids=phone_code_ids)
+            estimate = MailoutAudienceEstimate(
+                mailout_id=model_id,
+                count=len(customers),
+                exact=True,
+                phone_codes=await self._name_counts(
+                    PhoneCode.phone_code, audience_index.count_by_phone_code(customers),
+                ),
+                timezones=await self._name_counts(
+                    Timezone.timezone, audience_index.count_by_timezone(customers),
+                ),
+                sample_customer_ids=list(customers[:sample_size]),
+            )
+        else:
+            if audience_index.ready:
+                audience_index.rebuild_in_background()
+            query = audience_query(tag_ids=tag_ids, phone_code_ids=phone_code_ids)
+            results = await self.session.execute(query.with_only_columns(Customer.id).limit(sample_size))
+            count = await self._estimate_rows(query)
+            phone_code_counts, timezone_counts = await self._sample_counts(query, count)
+            estimate = MailoutAudienceEstimate(
+                mailout_id=model_id,
+                count=count,
+                exact=False,
+                phone_codes=await self._name_counts(PhoneCode.phone_code, phone_code_counts),
+                timezones=await self._name_counts(Timezone.timezone, timezone_counts),
+                sample_customer_ids=results.scalars().all(),
+            )
+
+        in_flight = mailout.max_in_flight or settings.sender_concurrency
+        estimate.send_rate = min(
+            rate for rate in (mailout.max_rate, settings.sender_rate_limit, in_flight / settings.sender_expected_latency)
+            if rate
+        )
+        estimate.projected_finish_at = (
+            max(mailout.start_at, datetime.utcnow()) + timedelta(seconds=estimate.count / estimate.send_rate)
+        )
+        estimate.finishes_in_time = estimate.projected_finish_at <= mailout.finish_at
+        return estimate
+
+    async def _name_counts(self, name_column, counts: dict[int, int]) -> dict[str, int]:
+        """Replace ids of phone codes or timezones with their names."""
+        if not counts:
+            return {}
+        model = name_column.class_
+        results = await self.session.execute(select(model.id, name_column).where(model.id.in_(counts)))
+        return {name: counts[model_id] for model_id, name in results.all()}
+
+    async def _sample_counts(self, query, count: int) -> tuple[dict[int, int], dict[int, int]]:
+        """`count` split by phone code and by timezone as the audience of the query is in a sample of customers.
+
+        About AUDIENCE_ESTIMATE_SAMPLE_ROWS customers are sampled, all of them in a smaller table.
+        """
+        table_rows = await self._estimate_rows(select(Customer.id))
+        percent = min(100.0, 100.0 * settings.audience_estimate_sample_rows / max(table_rows, 1))
+        sampled = tablesample(Customer, func.system(percent))
+        results = await self.session.execute(
+            query
+            .where(Customer.id.in_(select(sampled.c.id)))
+            .with_only_columns(Customer.phone_code_id, Customer.timezone_id, func.count())
+            .group_by(Customer.phone_code_id, Customer.timezone_id)
+        )
+        phone_code_counts: dict[int, int] = {}
+        timezone_counts: dict[int, int] = {}
+        for phone_code_id, timezone_id, customers in results.all():
+            phone_code_counts[phone_code_id] = phone_code_counts.get(phone_code_id, 0) + customers
+            if timezone_id is not None:
+                timezone_counts[timezone_id] = timezone_counts.get(timezone_id, 0) + customers
+        if not (sampled_rows := sum(phone_code_counts.values())):
+            return {}, {}
+
+        def scaled(counts: dict[int, int]) -> dict[int, int]:
+            counts = {key: round(count * customers / sampled_rows) for key, customers in counts.items()}
+            return {key: customers for key, customers in counts.items() if customers}
+
+        return scaled(phone_code_counts), scaled(timezone_counts)
+
+    async def _estimate_rows(self, query) -> int:
+        """Number of rows the planner expects the query to return, the query itself is not run."""
+        statement = query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+        plan = (await self.session.execute(text(f'EXPLAIN (FORMAT JSON) {statement}'))).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    async def select_mailout_jobs(self) -> list[Mailout]:
+        """Mailouts due now (UTC) with ids of their tags and phone codes, their messages are not loaded."""
+        _now = datetime.utcnow()
+        query = (
+            select(self.model)
+            .where(self.model.start_at <= _now)
+            .where(self.model.finish_at > _now)
+            .order_by(self.model.start_at)
+            .options(
+                selectinload(self.model.tags).load_only(Tag.id),
+                selectinload(self.model.phone_codes).load_only(PhoneCode.id),
+            )
+        )
+        results = await self.session.scalars(query)
+        return results.all()
 
     async def list(
         self,
@@ -47,22 +180,95 @@ class MailoutRepository(BaseRepository):
 
     async def update(self, model_id: int, model_update: MailoutUpdate) -> Optional[MailoutRead]:
         check_time(model_update)
-        return await super().update(self.model, model_id, model_update)
+        values = model_update.dict(exclude_unset=True, exclude={'id'})
+        if 'start_at' not in values:
+            return await super().update(self.model, model_id, model_update)
+
+        # a moved start gets a new start task, the previous one is revoked once the update is committed
+        start_task_id = str(uuid.uuid4())
+        mailouts_before = self.model.__table__.alias('mailouts_before')
+        result, previous_start_task_id = await self._update_returning(
+            self.model,
+            model_id,
+            {
+                **values,
+                'start_task_id': case(
+                    (self.model.start_at.is_distinct_from(values['start_at']), start_task_id),
+                    else_=self.model.start_task_id,
+                ),
+            },
+            previous_start_task_id=(
+                select(mailouts_before.c.start_task_id)
+                .where(mailouts_before.c.id == model_id)
+                .scalar_subquery()
+            ),
+        )
+        if result.start_task_id != start_task_id:
+            return result
+        if previous_start_task_id is not None:
+            await asyncio.to_thread(revoke_mailout_start, previous_start_task_id)
+        await asyncio.to_thread(schedule_mailout_start, result.id, result.start_at, task_id=start_task_id)
+        return result
+
+    async def delete(self, model, model_id: int) -> None:
+        mailout = await super().get(self.model, model_id)
+        if mailout.start_task_id is not None:
+            await asyncio.to_thread(revoke_mailout_start, mailout.start_task_id)
+        return await super().delete(model, model_id)
+
+    async def schedule_start(self, model_id: int, start_at: datetime) -> None:
+        """Enqueue another start of the mailout at `start_at`, it replaces the start task the mailout has."""
+        start_task_id = str(uuid.uuid4())
+        mailouts_before = self.model.__table__.alias('mailouts_before')
+        _, previous_start_task_id = await self._update_returning(
+            self.model,
+            model_id,
+            {'start_task_id': start_task_id},
+            previous_start_task_id=(
+                select(mailouts_before.c.start_task_id)
+                .where(mailouts_before.c.id == model_id)
+                .scalar_subquery()
+            ),
+        )
+        if previous_start_task_id is not None:
+            await asyncio.to_thread(revoke_mailout_start, previous_start_task_id)
+        await asyncio.to_thread(schedule_mailout_start, model_id, start_at, task_id=start_task_id)
+
+    async def start(self, model_id: int) -> Optional[MailoutRead]:
+        """Dispatch the mailout to be processed now, on the manual queue."""
+        mailout = await super().get(self.model, model_id)
+        await asyncio.to_thread(dispatch_mailout, mailout.id, select_queue(manual=True))
+        return mailout
 
     async def delete_mailout_tag(self, model_id: int, tag_id: int) -> Optional[MailoutRead]:
+        # the audience has changed, it is snapshotted again with the removal of the tag
+        await MailoutAudienceRepository(self.session).reset_snapshot(model_id)
         return await super().delete_model_tag(self.model, model_id, Tag, tag_id)
 
     async def delete_mailout_phone_code(self, model_id: int, phone_code_id: int) -> Optional[MailoutRead]:
+        await MailoutAudienceRepository(self.session).reset_snapshot(model_id)
         return await super().delete_model_phone_code(self.model, model_id, PhoneCode, phone_code_id)
 
-    async def select_mailout_jobs(self):
-        _now = datetime.now()
-        query = (
-            select(self.model)
-            .where(self.model.start_at <= _now)
-            .where(self.model.finish_at > _now)
+    async def save_checkpoint(
+        self,
+        model_id: int,
+        last_customer_id: int | None,
+        snapshot_at: datetime | None,
+    ) -> bool:
+        """Remember the last customer whose message of the mailout has been processed.
+
+        The checkpoint belongs to the audience snapshot taken at snapshot_at, it is not saved
+        once the snapshot has been reset, returns whether it is saved.
+        """
+        results = await self.session.execute(
+            update(self.model)
+            .where(self.model.id == model_id)
+            .where(self.model.audience_snapshot_at.is_not_distinct_from(snapshot_at))
+            .values(last_customer_id=last_customer_id)
+            .execution_options(synchronize_session=False)
         )
-        return await self.get_list(query)
+        await self.session.commit()
+        return bool(results.rowcount)
 
     async def delete_model_tag(self, model, model_id: int, tag_model, tag_id: int):
         raise NotImplementedError
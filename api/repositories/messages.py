@@ -1,13 +1,16 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import func
+from sqlalchemy import Integer, String, func, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import Select, column
 from sqlmodel import select
 
 from db.errors import EntityDoesNotExist
 from repositories.base import BaseRepository
 from schemas.base import StatusEnum, TimeStampModel
 from schemas.customers import Customer
+from schemas.mailout_audience import MailoutAudience
 from schemas.mailouts import Mailout
 from schemas.messages import Message, MessageCreate, MessageRead, MessageUpdate
 
@@ -32,39 +35,101 @@ class MessageRepository(BaseRepository):
         else:
             return await self._create_not_unique(self.model, model_create)
 
+    async def bulk_create_pending(self, mailout_id: int, customer_ids: list[int]) -> list[tuple[int, int]]:
+        """Insert pending messages in a single statement, returns (message id, customer id) pairs.
+
+        Customers who already have a sent or failed message of the mailout are skipped,
+        the ones whose message is still pending are returned with the existing message id.
+        Customer and mailout ids are trusted (they come from the audience query), so they are not checked.
+        """
+        if not customer_ids:
+            return []
+
+        query = insert(self.model).values([
+            {'status': StatusEnum.pending, 'mailout_id': mailout_id, 'customer_id': customer_id}
+            for customer_id in customer_ids
+        ])
+        query = (
+            query
+            .on_conflict_do_update(
+                index_elements=[self.model.mailout_id, self.model.customer_id],
+                set_={'status': query.excluded.status},
+                where=self.model.status == StatusEnum.pending,
+            )
+            .returning(self.model.id, self.model.customer_id)
+        )
+        results = await self.session.execute(query)
+        messages = results.all()
+        await self.session.commit()
+        return messages
+
+    async def bulk_update_status(self, statuses: dict[int, str]) -> int:
+        """Set statuses of many messages in a single UPDATE ... FROM (VALUES ...), returns updated row count.
+
+        The statuses are copied to the mailout audience snapshots as well.
+        """
+        if not statuses:
+            return 0
+
+        new_statuses = (
+            values(column('id', Integer), column('status', String), name='new_statuses')
+            .data(list(statuses.items()))
+        )
+        query = (
+            update(self.model)
+            .where(self.model.id == new_statuses.c.id)
+            .values(status=new_statuses.c.status, created_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        results = await self.session.execute(query)
+        await self.session.execute(
+            update(MailoutAudience)
+            .where(MailoutAudience.mailout_id == self.model.mailout_id)
+            .where(MailoutAudience.customer_id == self.model.customer_id)
+            .where(self.model.id.in_(list(statuses)))
+            .values(status=self.model.status)
+            .execution_options(synchronize_session=False)
+        )
+        await self.session.commit()
+        return results.rowcount
+
     async def list(self, limit: int = 50, offset: int = 0) -> list[MessageRead]:
         return await super().list(self.model, limit, offset)
 
+    def export_query(self, mailout_id: int | None = None, status: str | None = None) -> Select:
+        """All messages of the mailout with the status, ordered by id."""
+        query = (
+            select(
+                self.model.id,
+                self.model.created_at,
+                self.model.status,
+                self.model.mailout_id,
+                self.model.customer_id,
+            )
+            .order_by(self.model.id)
+        )
+        if mailout_id is not None:
+            query = query.where(self.model.mailout_id == mailout_id)
+        if status:
+            query = query.where(self.model.status == status)
+        return query
+
     async def get(self, model_id: int) -> Optional[MessageRead]:
         return await super().get(self.model, model_id)
 
     async def update(self, model_id: int, model_update: MessageUpdate) -> Optional[MessageRead]:
-        if item := await self._get_instance(self.model, model_id):
-            item_dict = model_update.dict(
-                exclude_unset=True,
-                exclude={'id', 'status', 'created_at'},
-            )
-            for key, value in item_dict.items():
-                setattr(item, key, value)
-
-            if not model_update.status:
-                setattr(item, 'status', StatusEnum.updated)
-            else:
-                setattr(item, 'status', model_update.status)
-            setattr(item, 'created_at', datetime.utcnow())
-
-            await self._add_to_db(item)
-            return await self._get_instance(self.model, model_id)
-        else:
-            raise EntityDoesNotExist
+        item_dict = model_update.dict(
+            exclude_unset=True,
+            exclude={'id', 'status', 'created_at'},
+        )
+        item_dict['status'] = model_update.status or StatusEnum.updated
+        item_dict['created_at'] = datetime.utcnow()
+        row = await self._update_returning(self.model, model_id, item_dict)
+        return row[0]
 
     async def delete(self, model_id: int) -> None:
-        if item := await self._get_instance(self.model, model_id):
-            setattr(item, 'status', StatusEnum.deleted)
-            await self._add_to_db(item)
-            return await self._get_instance(self.model, model_id)
-        else:
-            raise EntityDoesNotExist
+        row = await self._update_returning(self.model, model_id, {'status': StatusEnum.deleted})
+        return row[0]
 
     async def delete_model_tag(self, model, model_id: int, tag_model, tag_id: int):
         raise NotImplementedError
@@ -6,6 +6,8 @@ from sqlalchemy.orm import selectinload
 
 from db.errors import EntityDoesNotExist, PhoneCodeError
 from repositories.base import BaseRepository
+from repositories.mailout_audience import MailoutAudienceRepository
+from schemas.mailouts import Mailout
 from schemas.phone_codes import PhoneCode, PhoneCodeCreate, PhoneCodeRead, PhoneCodeUpdate
 
 
@@ -41,6 +43,8 @@ class PhoneCodeRepository(BaseRepository):
             )
             if item := model_query.first():
                 item.phone_codes.append(result)
+                if isinstance(item, Mailout):
+                    await MailoutAudienceRepository(self.session).reset_snapshot(model_id)
             else:
                 raise EntityDoesNotExist
 
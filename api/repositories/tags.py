@@ -5,6 +5,10 @@ from sqlalchemy.orm import selectinload
 
 from db.errors import EntityDoesNotExist
 from repositories.base import BaseRepository
+from repositories.mailout_audience import MailoutAudienceRepository
+from services.audience_index import audience_index
+from schemas.customers import Customer
+from schemas.mailouts import Mailout
 from schemas.tags import Tag, TagCreate, TagRead, TagUpdate
 
 
@@ -22,8 +26,12 @@ class TagRepository(BaseRepository):
             new_tag = await self._upsert(tag_query, Tag, tag_create)
             self.session.add(new_tag)
             item.tags.append(new_tag)
+            if isinstance(item, Mailout):
+                await MailoutAudienceRepository(self.session).reset_snapshot(model_id)
             await self.session.commit()
             await self.session.refresh(new_tag)
+            if isinstance(item, Customer):
+                audience_index.add_customer_tag(customer_id=model_id, tag_id=new_tag.id)
             return new_tag
         else:
             raise EntityDoesNotExist
@@ -1,12 +1,17 @@
+from datetime import time
 from typing import Optional
 import zoneinfo
 
-from sqlalchemy import select
+from sqlalchemy import Interval, String, Time, cast, func, literal_column, select
+from sqlalchemy.engine import Row
+from sqlalchemy.sql import column, table
 
 from db.errors import TimezoneError
 from repositories.base import BaseRepository
 from schemas.timezones import Timezone, TimezoneCreate, TimezoneRead, TimezoneUpdate
 
+pg_timezone_names = table('pg_timezone_names', column('name', String), column('utc_offset', Interval))
+
 
 class TimezoneRepository(BaseRepository):
     model = Timezone
@@ -19,6 +24,28 @@ class TimezoneRepository(BaseRepository):
         await self._add_to_db(result)
         return result
 
+    async def select_offset_buckets(self, available_start_at: time, available_finish_at: time) -> list[Row]:
+        """Group timezones by their current UTC offset (utc_offset, is_open, timezone_ids).
+
+        The local time is computed in SQL once per offset and is_open tells if it is within the window.
+        Timezones the database does not know are taken as UTC, their customers are not left out.
+        """
+        utc_offset = func.coalesce(pg_timezone_names.c.utc_offset, literal_column("interval '0'", Interval))
+        local_time = cast(func.timezone('UTC', func.now()) + utc_offset, Time)
+        query = (
+            select(
+                utc_offset.label('utc_offset'),
+                local_time.between(available_start_at, available_finish_at).label('is_open'),
+                func.array_agg(self.model.id).label('timezone_ids'),
+            )
+            .select_from(self.model)
+            .outerjoin(pg_timezone_names, pg_timezone_names.c.name == self.model.timezone)
+            .group_by(utc_offset)
+            .order_by(utc_offset)
+        )
+        results = await self.session.execute(query)
+        return results.all()
+
     async def list(self, limit: int = 50, offset: int = 0) -> list[TimezoneRead]:
         return await super().list(self.model, limit, offset)
 
@@ -1,15 +1,19 @@
 from typing import Optional
 
-from fastapi import APIRouter, Body, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 
-from db.errors import EntityDoesNotExist
+from db.errors import EntityAlreadyExists, EntityDoesNotExist
 from db.sessions import get_repository
 from repositories.customers import CustomerRepository
 from repositories.tags import TagRepository
 from routers.users import get_current_user
-from schemas.customers import Customer, CustomerCreate, CustomerRead, CustomerUpdate
+from schemas.base import FileFormatEnum
+from schemas.customers import Customer, CustomerCreate, CustomerImportResult, CustomerRead, CustomerUpdate
 from schemas.tags import Tag, TagCreate, TagRead, TagUpdate
 from schemas.users import User
+from services.customer_import import CustomerImporter
+from services.export import export_response
 
 router = APIRouter(prefix='/customers')
 
@@ -32,6 +36,26 @@ async def create_customer(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Phone code or timezone not found'
         )
+    except EntityAlreadyExists:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f'Customer with this phone already exists'
+        )
+
+
+@router.post(
+    '/import',
+    response_model=CustomerImportResult,
+    status_code=status.HTTP_200_OK,
+    name='import_customers',
+)
+async def import_customers(
+    request: Request,
+    file_format: FileFormatEnum = Query(default=FileFormatEnum.csv, alias='format'),
+    repository: CustomerRepository = Depends(get_repository(CustomerRepository)),
+    user: User = Depends(get_current_user),
+) -> CustomerImportResult:
+    return await CustomerImporter(repository).run(request.stream(), file_format)
 
 
 @router.get(
@@ -55,6 +79,24 @@ async def get_customers(
     )
 
 
+@router.get(
+    '/export',
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+    name='export_customers',
+)
+async def export_customers(
+    file_format: FileFormatEnum = Query(default=FileFormatEnum.csv, alias='format'),
+    tag: Optional[list[str]] = Query(default=None),
+    phone_code: str | None = Query(default=None),
+    compress: bool = Query(default=False, alias='gzip'),
+    repository: CustomerRepository = Depends(get_repository(CustomerRepository)),
+    user: User = Depends(get_current_user),
+) -> StreamingResponse:
+    query = repository.export_query(tag=tag, phone_code=phone_code)
+    return export_response(repository.session, query, 'customers', file_format, compress)
+
+
 @router.get(
     '/{customer_id}',
     response_model=CustomerRead,
@@ -88,13 +130,17 @@ async def update_customer(
     user: User = Depends(get_current_user),
 ) -> CustomerRead:
     try:
-        await repository.get(model_id=customer_id)
+        return await repository.update(model_id=customer_id, model_update=customer_update)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Customer with ID={customer_id} not found'
         )
-    return await repository.update(model_id=customer_id, model_update=customer_update)
+    except EntityAlreadyExists:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f'Customer with this phone already exists'
+        )
 
 
 @router.delete(
@@ -108,13 +154,12 @@ async def delete_customer(
     user: User = Depends(get_current_user),
 ) -> None:
     try:
-        await repository.get(model_id=customer_id)
+        return await repository.delete(model=Customer, model_id=customer_id)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Customer with ID={customer_id} not found'
         )
-    return await repository.delete(model=Customer, model_id=customer_id)
 
 
 @router.post(
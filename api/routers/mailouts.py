@@ -10,9 +10,8 @@ from repositories.mailouts import MailoutRepository
 from routers.users import get_current_user
 from schemas.phone_codes import PhoneCode, PhoneCodeCreate, PhoneCodeRead, PhoneCodeUpdate
 from schemas.tags import Tag, TagCreate, TagRead, TagUpdate
-from schemas.mailouts import Mailout, MailoutCreate, MailoutRead, MailoutUpdate
+from schemas.mailouts import Mailout, MailoutAudienceEstimate, MailoutCreate, MailoutRead, MailoutUpdate
 from schemas.users import User
-from services.sender.celery_worker import process_mailout
 from utils.logging import logger
 
 router = APIRouter(prefix='/mailouts')
@@ -73,6 +72,26 @@ async def get_mailout(
     return result
 
 
+@router.get(
+    '/{mailout_id}/audience',
+    response_model=MailoutAudienceEstimate,
+    status_code=status.HTTP_200_OK,
+    name='get_mailout_audience',
+)
+async def get_mailout_audience(
+    mailout_id: int,
+    sample_size: int = Query(default=10, ge=0, le=100),
+    repository: MailoutRepository = Depends(get_repository(MailoutRepository)),
+) -> MailoutAudienceEstimate:
+    try:
+        return await repository.get_audience_estimate(model_id=mailout_id, sample_size=sample_size)
+    except EntityDoesNotExist:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Mailout with ID={mailout_id} not found'
+        )
+
+
 @router.put(
     '/{mailout_id}',
     response_model=MailoutRead,
@@ -86,13 +105,12 @@ async def update_mailout(
     user: User = Depends(get_current_user),
 ) -> MailoutRead:
     try:
-        await repository.get(model_id=mailout_id)
+        return await repository.update(model_id=mailout_id, model_update=mailout_update)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Mailout with ID={mailout_id} not found'
         )
-    return await repository.update(model_id=mailout_id, model_update=mailout_update)
 
 
 @router.delete(
@@ -106,13 +124,12 @@ async def delete_mailout(
     user: User = Depends(get_current_user),
 ) -> None:
     try:
-        await repository.get(model_id=mailout_id)
+        return await repository.delete(model=Mailout, model_id=mailout_id)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Mailout with ID={mailout_id} not found'
         )
-    return await repository.delete(model=Mailout, model_id=mailout_id)
 
 
 @router.post(
@@ -220,8 +237,7 @@ async def start_mailout(
     user: User = Depends(get_current_user),
 ):
     try:
-        instance = await repository.get(mailout_id)
-        process_mailout.delay(instance.id)
+        instance = await repository.start(mailout_id)
         result = f'Mailout {instance.id} set to processing'
         logger.info(result)
         return result
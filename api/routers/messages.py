@@ -1,13 +1,17 @@
 from typing import Optional
 
 from fastapi import APIRouter, Body, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 
-from db.errors import EntityDoesNotExist
+from db.errors import EntityAlreadyExists, EntityDoesNotExist
 from db.sessions import get_repository
+from repositories.mailout_audience import MailoutAudienceRepository
 from repositories.messages import MessageRepository
 from routers.users import get_current_user
+from schemas.base import FileFormatEnum
 from schemas.messages import Message, MessageCreate, MessageRead, MessageUpdate
 from schemas.users import User
+from services.export import export_response
 
 router = APIRouter(prefix='/messages')
 
@@ -30,6 +34,11 @@ async def create_message(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Customer or mailout not found'
         )
+    except EntityAlreadyExists:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='Message of the mailout to the customer already exists'
+        )
 
 
 @router.get(
@@ -46,6 +55,24 @@ async def get_messages(
     return await repository.list(limit=limit, offset=offset)
 
 
+@router.get(
+    '/export',
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+    name='export_messages',
+)
+async def export_messages(
+    file_format: FileFormatEnum = Query(default=FileFormatEnum.csv, alias='format'),
+    mailout_id: int | None = Query(default=None),
+    message_status: str | None = Query(default=None, alias='status'),
+    compress: bool = Query(default=False, alias='gzip'),
+    repository: MessageRepository = Depends(get_repository(MessageRepository)),
+    user: User = Depends(get_current_user),
+) -> StreamingResponse:
+    query = repository.export_query(mailout_id=mailout_id, status=message_status)
+    return export_response(repository.session, query, 'messages', file_format, compress)
+
+
 @router.get(
     '/stats',
     status_code=status.HTTP_200_OK,
@@ -64,10 +91,22 @@ async def get_general_stats(
 )
 async def get_detailed_stats(
     mailout_id: int,
-    status: str | None = Query(default=None),
+    message_status: str | None = Query(default=None, alias='status'),
     repository: MessageRepository = Depends(get_repository(MessageRepository))
 ) -> list:
-    return await repository.get_detailed_stats(model_id=mailout_id, status=status)
+    return await repository.get_detailed_stats(model_id=mailout_id, status=message_status)
+
+
+@router.get(
+    '/stats/{mailout_id}/audience',
+    status_code=status.HTTP_200_OK,
+    name='get_audience_stats',
+)
+async def get_audience_stats(
+    mailout_id: int,
+    repository: MailoutAudienceRepository = Depends(get_repository(MailoutAudienceRepository))
+) -> list:
+    return await repository.get_stats(mailout_id=mailout_id)
 
 
 @router.get(
@@ -103,13 +142,17 @@ async def update_message(
     user: User = Depends(get_current_user),
 ) -> MessageRead:
     try:
-        await repository.get(model_id=message_id)
+        return await repository.update(model_id=message_id, model_update=message_update)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Message with ID={message_id} not found'
         )
-    return await repository.update(model_id=message_id, model_update=message_update)
+    except EntityAlreadyExists:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='Message of the mailout to the customer already exists'
+        )
 
 
 @router.delete(
@@ -124,10 +167,9 @@ async def delete_message(
     user: User = Depends(get_current_user),
 ) -> None:
     try:
-        await repository.get(model_id=message_id)
+        return await repository.delete(model_id=message_id)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Message with ID={message_id} not found'
         )
-    return await repository.delete(model_id=message_id)
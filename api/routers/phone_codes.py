@@ -76,15 +76,14 @@ async def update_phone_code(
     user: User = Depends(get_current_user),
 ) -> PhoneCodeRead:
     try:
-        await repository.get(model_id=phone_code_id)
+        return await repository.update(
+            model_id=phone_code_id, model_update=phone_code_update
+        )
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Phone code with ID={phone_code_id} not found'
         )
-    return await repository.update(
-        model_id=phone_code_id, model_update=phone_code_update
-    )
 
 
 @router.delete(
@@ -98,10 +97,9 @@ async def delete_phone_code(
     user: User = Depends(get_current_user),
 ) -> None:
     try:
-        await repository.get(model_id=phone_code_id)
+        return await repository.delete(model=PhoneCode, model_id=phone_code_id)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Phone code with ID={phone_code_id} not found'
         )
-    return await repository.delete(model=PhoneCode, model_id=phone_code_id)
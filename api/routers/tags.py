@@ -23,12 +23,11 @@ async def update_tag(
     user: User = Depends(get_current_user),
 ) -> TagRead:
     try:
-        await repository.get(model_id=tag_id)
+        return await repository.update(model_id=tag_id, model_update=tag_update)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f'Tag with ID={tag_id} not found'
         )
-    return await repository.update(model_id=tag_id, model_update=tag_update)
 
 
 @router.delete(
@@ -42,9 +41,8 @@ async def delete_tag(
     user: User = Depends(get_current_user),
 ) -> None:
     try:
-        await repository.get(model_id=tag_id)
+        return await repository.delete(model=Tag, model_id=tag_id)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f'Tag with ID={tag_id} not found'
         )
-    return await repository.delete(model=Tag, model_id=tag_id)
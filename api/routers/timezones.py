@@ -73,13 +73,12 @@ async def update_timezone(
     user: User = Depends(get_current_user),
 ) -> TimezoneRead:
     try:
-        await repository.get(model_id=timezone_id)
+        return await repository.update(model_id=timezone_id, model_update=timezone_update)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Timezone with ID={timezone_id} not found'
         )
-    return await repository.update(model_id=timezone_id, model_update=timezone_update)
 
 
 @router.delete(
@@ -93,10 +92,9 @@ async def delete_timezone(
     user: User = Depends(get_current_user),
 ) -> None:
     try:
-        await repository.get(model_id=timezone_id)
+        return await repository.delete(model=Timezone, model_id=timezone_id)
     except EntityDoesNotExist:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'Timezone with ID={timezone_id} not found'
         )
-    return await repository.delete(model=Timezone, model_id=timezone_id)
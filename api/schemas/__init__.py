@@ -5,4 +5,5 @@ import schemas.tags
 import schemas.messages
 import schemas.customers
 import schemas.mailouts
+import schemas.mailout_audience
 import schemas.users
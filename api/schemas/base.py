@@ -1,3 +1,4 @@
+import enum
 from datetime import datetime
 
 from sqlalchemy import Enum, text
@@ -14,6 +15,11 @@ class StatusEnum(str, Enum):
     timed_out = 'Timed out'
 
 
+class FileFormatEnum(str, enum.Enum):
+    csv = 'csv'
+    ndjson = 'ndjson'
+
+
 class TimeStampModel(SQLModel):
     created_at: datetime = Field(
         default_factory=datetime.utcnow,
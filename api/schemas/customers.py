@@ -1,5 +1,6 @@
 from typing import Optional, TYPE_CHECKING
 
+from sqlalchemy import UniqueConstraint
 from sqlmodel import SQLModel, Field, Relationship
 
 from .tags import TagRead
@@ -15,7 +16,7 @@ if TYPE_CHECKING:
 class CustomerBase(SQLModel):
     country_code: int = Field(default=7)
     phone_code_id: int | None = Field(default=None, foreign_key='phone_codes.id')
-    phone: str = Field(index=True)
+    phone: str
     timezone_id: int | None = Field(default=1, foreign_key='timezones.id')
 
     class Config:
@@ -31,6 +32,8 @@ class CustomerBase(SQLModel):
 
 class Customer(CustomerBase, table=True):
     __tablename__: str = 'customers'
+    # also serves lookups by phone
+    __table_args__ = (UniqueConstraint('phone', 'phone_code_id', 'country_code', name='uq_customers_phone'),)
 
     id: int | None = Field(primary_key=True, default=None)
 
@@ -54,3 +57,16 @@ class CustomerUpdate(SQLModel):
     phone_code_id: int | None = None
     phone: str | None = None
     timezone_id: int | None = None
+
+
+class CustomerImportError(SQLModel):
+    row: int
+    error: str
+
+
+class CustomerImportResult(SQLModel):
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: list[CustomerImportError] = []
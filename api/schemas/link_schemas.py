@@ -1,8 +1,10 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 
 
 class CustomerTag(SQLModel, table=True):
     __tablename__: str = 'customers_tags'
+    __table_args__ = (Index('ix_customers_tags_tag_id_customer_id', 'tag_id', 'customer_id'),)
     customer_id: int | None = Field(
         default=None, foreign_key='customers.id', primary_key=True
     )
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, ForeignKey, Integer
+from sqlmodel import SQLModel, Field
+
+from .base import StatusEnum
+
+
+class MailoutAudience(SQLModel, table=True):
+    __tablename__: str = 'mailout_audience'
+
+    # the snapshot goes away with its mailout or customer
+    mailout_id: int = Field(
+        sa_column=Column(Integer, ForeignKey('mailouts.id', ondelete='CASCADE'), primary_key=True)
+    )
+    customer_id: int = Field(
+        sa_column=Column(Integer, ForeignKey('customers.id', ondelete='CASCADE'), primary_key=True)
+    )
+    msisdn: str
+    timezone_id: int | None = Field(default=None, foreign_key='timezones.id')
+    status: StatusEnum = Field(default=StatusEnum.pending)
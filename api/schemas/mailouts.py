@@ -1,6 +1,7 @@
 from datetime import datetime, time
 from typing import TYPE_CHECKING
 
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 
 from .phone_codes import PhoneCodeRead
@@ -19,9 +20,11 @@ class MailoutBase(SQLModel):
     finish_at: datetime
     available_start_at: time | None = None
     available_finish_at: time | None = None
+    max_in_flight: int | None = Field(default=None, gt=0)
+    max_rate: float | None = Field(default=None, gt=0)
 
     def requires_processing(self) -> bool:
-        return self.start_at <= datetime.now() < self.finish_at
+        return self.start_at <= datetime.utcnow() < self.finish_at
 
     class Config:
         schema_extra = {
@@ -30,15 +33,21 @@ class MailoutBase(SQLModel):
                 "start_at": datetime(2023, 6, 30, 10, 0, 0),
                 "finish_at": datetime(2023, 6, 30, 11, 0, 0),
                 "available_start_at": time(10, 0, 0),
-                "available_finish_at": time(19, 0, 0)
+                "available_finish_at": time(19, 0, 0),
+                "max_in_flight": 50,
+                "max_rate": 100
             }
         }
 
 
 class Mailout(MailoutBase, table=True):
     __tablename__: str = 'mailouts'
+    __table_args__ = (Index('ix_mailouts_start_at_finish_at', 'start_at', 'finish_at'),)
 
     id: int | None = Field(primary_key=True, default=None)
+    last_customer_id: int | None = None
+    audience_snapshot_at: datetime | None = None
+    start_task_id: str | None = None
     tags: list['Tag'] = Relationship(back_populates='mailouts', link_model=MailoutTag)
     phone_codes: list['PhoneCode'] = Relationship(back_populates='mailouts', link_model=MailoutPhoneCode)
     messages: list['Message'] = Relationship(back_populates='mailout')
@@ -60,3 +69,17 @@ class MailoutUpdate(SQLModel):
     finish_at: datetime | None = None
     available_start_at: time | None = None
     available_finish_at: time | None = None
+    max_in_flight: int | None = Field(default=None, gt=0)
+    max_rate: float | None = Field(default=None, gt=0)
+
+
+class MailoutAudienceEstimate(SQLModel):
+    mailout_id: int
+    count: int
+    exact: bool
+    phone_codes: dict[str, int] = {}
+    timezones: dict[str, int] = {}
+    sample_customer_ids: list[int] = []
+    send_rate: float | None = None
+    projected_finish_at: datetime | None = None
+    finishes_in_time: bool | None = None
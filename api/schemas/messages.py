@@ -1,5 +1,6 @@
 from typing import Optional, TYPE_CHECKING
 
+from sqlalchemy import UniqueConstraint
 from sqlmodel import SQLModel, Field, Relationship
 
 from .base import StatusEnum, TimeStampModel
@@ -26,6 +27,7 @@ class MessageBase(SQLModel):
 
 class Message(MessageBase, TimeStampModel, table=True):
     __tablename__: str = 'messages'
+    __table_args__ = (UniqueConstraint('mailout_id', 'customer_id'),)
 
     id: int | None = Field(primary_key=True, default=None)
 
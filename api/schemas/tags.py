@@ -9,6 +9,9 @@ if TYPE_CHECKING:
     from .customers import Customer
     from .mailouts import Mailout
 
+# Separates the tags of a customer in CSV files.
+TAG_SEPARATOR = ';'
+
 
 class TagBase(SQLModel):
     tag: str
@@ -0,0 +1,192 @@
+import asyncio
+import time
+
+from pyroaring import BitMap
+from sqlalchemy import func, select
+from sqlalchemy.sql import column, table
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from db.config import settings
+from db.sessions import async_engine
+from schemas.customers import Customer
+from schemas.link_schemas import CustomerTag
+from utils.logging import logger
+
+# Rows inserted, updated and deleted since the statistics reset, counted by Postgres for every session.
+pg_stat_user_tables = table(
+    'pg_stat_user_tables',
+    column('relname'),
+    column('n_tup_ins'),
+    column('n_tup_upd'),
+    column('n_tup_del'),
+)
+
+
+class AudienceIndex:
+    """In-process compressed bitmaps of customer ids per tag, per phone code and per timezone.
+
+    The index is built at startup and then kept in sync by the repositories, so it only
+    sees changes made through this process. Until it is built, callers should query the DB.
+    `is_fresh` tells if customers or their tags have been changed in the DB since the build
+    other than through the index, every synced change counts the rows it has written.
+    """
+
+    def __init__(self):
+        self.reset()
+        self._rebuild: asyncio.Task | None = None
+        self._rebuild_requested_at: float | None = None
+
+    async def build(self, session: AsyncSession) -> None:
+        # read before the rows, so a change made during the build makes the index stale
+        version = await self._read_version(session)
+        tags: dict[int, BitMap] = {}
+        phone_codes: dict[int, BitMap] = {}
+        timezones: dict[int, BitMap] = {}
+        customers: dict[int, tuple[int | None, int | None]] = {}
+
+        results = await session.stream(select(CustomerTag.tag_id, CustomerTag.customer_id))
+        async for tag_id, customer_id in results:
+            tags.setdefault(tag_id, BitMap()).add(customer_id)
+
+        results = await session.stream(select(Customer.id, Customer.phone_code_id, Customer.timezone_id))
+        async for customer_id, phone_code_id, timezone_id in results:
+            customers[customer_id] = (phone_code_id, timezone_id)
+            if phone_code_id is not None:
+                phone_codes.setdefault(phone_code_id, BitMap()).add(customer_id)
+            if timezone_id is not None:
+                timezones.setdefault(timezone_id, BitMap()).add(customer_id)
+
+        for bitmap in (*tags.values(), *phone_codes.values(), *timezones.values()):
+            bitmap.run_optimize()
+        self._tags, self._phone_codes, self._timezones = tags, phone_codes, timezones
+        self._customers = customers
+        self._version = version
+        self._own_changes = 0
+        self.ready = True
+        logger.info(
+            f'Audience index is built: {len(customers)} customers, {len(tags)} tags, '
+            f'{len(phone_codes)} phone codes, {len(timezones)} timezones'
+        )
+
+    def reset(self) -> None:
+        self.ready = False
+        self._tags: dict[int, BitMap] = {}
+        self._phone_codes: dict[int, BitMap] = {}
+        self._timezones: dict[int, BitMap] = {}
+        self._customers: dict[int, tuple[int | None, int | None]] = {}
+        self._version: int | None = None
+        self._own_changes = 0
+
+    async def is_fresh(self, session: AsyncSession) -> bool:
+        """The index is built and customers or their tags have not been changed in the DB since, but through it.
+
+        Postgres reports the changes of a session with a delay of up to a few seconds, so the rows written
+        through the index may be counted later than it was updated: the index is fresh as long as the counted
+        changes do not exceed them. A change made by another process is noticed once it is reported on top.
+        """
+        if not self.ready:
+            return False
+        version = await self._read_version(session)
+        return self._version <= version <= self._version + self._own_changes
+
+    def rebuild_in_background(self) -> None:
+        """Build the index again with its own session, at most once per AUDIENCE_INDEX_REBUILD_INTERVAL."""
+        if self._rebuild is not None and not self._rebuild.done():
+            return
+        now = time.monotonic()
+        if (
+            self._rebuild_requested_at is not None
+            and now - self._rebuild_requested_at < settings.audience_index_rebuild_interval
+        ):
+            return
+        self._rebuild_requested_at = now
+        self._rebuild = asyncio.create_task(self._build_with_own_session())
+
+    async def _build_with_own_session(self) -> None:
+        try:
+            async with AsyncSession(async_engine) as session:
+                await self.build(session)
+        except Exception as err:
+            logger.error(f'Audience index can not be rebuilt: {str(err)}')
+
+    @staticmethod
+    async def _read_version(session: AsyncSession) -> int:
+        results = await session.execute(
+            select(func.coalesce(func.sum(
+                pg_stat_user_tables.c.n_tup_ins + pg_stat_user_tables.c.n_tup_upd + pg_stat_user_tables.c.n_tup_del
+            ), 0))
+            .where(pg_stat_user_tables.c.relname.in_([Customer.__tablename__, CustomerTag.__tablename__]))
+        )
+        return int(results.scalar())
+
+    def add_customer_tag(self, customer_id: int, tag_id: int) -> None:
+        if self.ready:
+            self._own_changes += 1
+            self._tags.setdefault(tag_id, BitMap()).add(customer_id)
+
+    def remove_customer_tag(self, customer_id: int, tag_id: int) -> None:
+        if self.ready:
+            self._own_changes += 1
+            if tag_id in self._tags:
+                self._tags[tag_id].discard(customer_id)
+
+    def set_customer(self, customer_id: int, phone_code_id: int | None, timezone_id: int | None) -> None:
+        """Customer inserted or updated in the DB."""
+        if not self.ready:
+            return
+        self._own_changes += 1
+        self._discard_customer(customer_id)
+        self._customers[customer_id] = (phone_code_id, timezone_id)
+        if phone_code_id is not None:
+            self._phone_codes.setdefault(phone_code_id, BitMap()).add(customer_id)
+        if timezone_id is not None:
+            self._timezones.setdefault(timezone_id, BitMap()).add(customer_id)
+
+    def remove_customer(self, customer_id: int) -> None:
+        """Customer deleted from the DB with their tags."""
+        if not self.ready:
+            return
+        self._own_changes += 1
+        self._discard_customer(customer_id)
+        for customers in self._tags.values():
+            if customer_id in customers:
+                self._own_changes += 1
+                customers.discard(customer_id)
+
+    def _discard_customer(self, customer_id: int) -> None:
+        phone_code_id, timezone_id = self._customers.pop(customer_id, (None, None))
+        if phone_code_id is not None:
+            self._phone_codes[phone_code_id].discard(customer_id)
+        if timezone_id is not None:
+            self._timezones[timezone_id].discard(customer_id)
+
+    def select(self, tag_ids: list[int] | None = None, phone_code_ids: list[int] | None = None) -> BitMap:
+        """Customers having any of the tags and any of the phone codes, a filter that is None is not applied."""
+        customers = None
+        if tag_ids is not None:
+            customers = BitMap.union(BitMap(), *(self._tags.get(tag_id, BitMap()) for tag_id in tag_ids))
+        if phone_code_ids is not None:
+            with_phone_codes = BitMap.union(
+                BitMap(), *(self._phone_codes.get(phone_code_id, BitMap()) for phone_code_id in phone_code_ids)
+            )
+            customers = with_phone_codes if customers is None else customers & with_phone_codes
+        if customers is None:
+            customers = BitMap(self._customers)
+        return customers
+
+    def count(self, tag_ids: list[int] | None = None, phone_code_ids: list[int] | None = None) -> int:
+        return len(self.select(tag_ids=tag_ids, phone_code_ids=phone_code_ids))
+
+    def count_by_phone_code(self, customers: BitMap) -> dict[int, int]:
+        return self._count_by(self._phone_codes, customers)
+
+    def count_by_timezone(self, customers: BitMap) -> dict[int, int]:
+        return self._count_by(self._timezones, customers)
+
+    @staticmethod
+    def _count_by(bitmaps: dict[int, BitMap], customers: BitMap) -> dict[int, int]:
+        counts = {key: customers.intersection_cardinality(bitmap) for key, bitmap in bitmaps.items()}
+        return {key: count for key, count in counts.items() if count}
+
+
+audience_index = AudienceIndex()
@@ -0,0 +1,248 @@
+"""Bulk import of customers from CSV or NDJSON.
+
+The file is read as a stream and imported in batches: every batch is loaded with COPY into a staging
+table as it is in the file, checked and resolved to ids there with SQL, then merged with
+INSERT ... ON CONFLICT, so a phone that is already there updates its customer. Invalid rows
+are reported with their line numbers and do not stop the import:
+
+    poetry run python -m services.customer_import customers.csv
+
+CSV files have a header with `phone_code` and `phone` columns, optional `country_code` (7 if empty),
+`timezone` (a timezone name) and `tags` (separated with `;`), quoted fields may span lines. NDJSON lines
+are objects with the same keys, `tags` may also be a list. Missing tags are created, unknown phone codes
+and timezones are row errors.
+
+Most of the import time is spent by the DB: foreign key checks and index updates of every inserted
+customer and customer tag. The next batch is read while the DB merges the current one.
+"""
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import time
+from typing import AsyncIterator, Iterator
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from db.config import settings
+from db.sessions import async_engine
+from repositories.customers import CustomerRepository
+from schemas.base import FileFormatEnum
+from schemas.customers import CustomerImportError, CustomerImportResult
+from schemas.tags import TAG_SEPARATOR
+from utils.logging import logger
+
+READ_SIZE = 1 << 16
+CSV_READ_ROWS = 1000
+
+
+async def read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, str]]:
+    """Non-empty lines of a UTF-8 byte stream with their line numbers."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    line_number = 0
+    tail = ''
+    async for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    tail += decoder.decode(b'', final=True)
+    if tail.strip():
+        yield line_number + 1, tail
+
+
+async def read_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, list[str] | str]]:
+    """Non-empty rows of a UTF-8 CSV byte stream with the numbers of their first lines, or their errors.
+
+    The decoded lines are fed to one csv.reader, so a quoted field may span lines. The reader runs in a thread,
+    CSV_READ_ROWS rows at a time, and waits there for the next chunk of the stream. A malformed row, such as one
+    with an unterminated quote, is an error message instead of the values and the reader goes on with the next line.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def next_chunk() -> bytes | None:
+        return await anext(chunks, None)
+
+    def lines() -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+        tail = ''
+        while (chunk := asyncio.run_coroutine_threadsafe(next_chunk(), loop).result()) is not None:
+            *complete, tail = (tail + decoder.decode(chunk)).split('\n')
+            for line in complete:
+                yield line + '\n'
+        if tail := tail + decoder.decode(b'', final=True):
+            yield tail
+
+    reader = csv.reader(lines(), strict=True)
+
+    def read_rows() -> tuple[list[tuple[int, list[str] | str]], bool]:
+        rows = []
+        while len(rows) < CSV_READ_ROWS:
+            line_number = reader.line_num + 1
+            try:
+                values = next(reader)
+            except StopIteration:
+                return rows, True
+            except csv.Error as err:
+                rows.append((line_number, f'Row is not valid CSV: {err}'))
+                continue
+            if values:
+                rows.append((line_number, values))
+        return rows, False
+
+    done = False
+    while not done:
+        rows, done = await asyncio.to_thread(read_rows)
+        for row in rows:
+            yield row
+
+
+async def read_rows(chunks: AsyncIterator[bytes], file_format: FileFormatEnum) -> AsyncIterator[tuple[int, dict | str]]:
+    """Rows of the file as dicts with their line numbers, or the error messages of the rows that can not be read."""
+    if file_format == FileFormatEnum.csv:
+        header = None
+        async for line_number, values in read_csv(chunks):
+            if isinstance(values, str):
+                yield line_number, values
+            elif header is None:
+                header = [name.strip() for name in values]
+            else:
+                yield line_number, dict(zip(header, values))
+    else:
+        async for line_number, line in read_lines(chunks):
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else 'Row is not a JSON object'
+
+
+class CustomerImporter:
+    def __init__(
+        self,
+        repository: CustomerRepository,
+        batch_size: int | None = None,
+        max_errors: int | None = None,
+    ):
+        self.repository = repository
+        self.batch_size = batch_size or settings.customer_import_batch_size
+        self.max_errors = settings.customer_import_max_errors if max_errors is None else max_errors
+        self.result = CustomerImportResult()
+        self._merge: asyncio.Task | None = None
+
+    async def run(self, chunks: AsyncIterator[bytes], file_format: FileFormatEnum) -> CustomerImportResult:
+        records, errors = [], []
+        try:
+            async for line_number, row in read_rows(chunks, file_format):
+                if isinstance(row, dict):
+                    row = self._stage(line_number, row)
+                if isinstance(row, str):
+                    errors.append((line_number, row))
+                else:
+                    records.append(row)
+                if len(records) + len(errors) >= self.batch_size:
+                    await self._import_batch(records, errors)
+                    records, errors = [], []
+            if records or errors:
+                await self._import_batch(records, errors)
+            await self._wait_merge()
+        finally:
+            if self._merge is not None:
+                self._merge.cancel()
+
+        logger.info(
+            f'Customers are imported: {self.result.rows} rows, {self.result.created} created, '
+            f'{self.result.updated} updated, {self.result.failed} failed'
+        )
+        return self.result
+
+    async def _import_batch(self, records: list[tuple], errors: list[tuple[int, str]]) -> None:
+        self.result.rows += len(records) + len(errors)
+        # the session is busy until the previous batch is merged
+        await self._wait_merge()
+        # the next batch is read while this one is checked and merged by the DB
+        self._merge = asyncio.create_task(self._merge_batch(records, errors))
+
+    async def _merge_batch(self, records: list[tuple], errors: list[tuple[int, str]]) -> tuple[int, int, list]:
+        if not records:
+            return 0, 0, errors
+        created, updated, invalid = await self.repository.import_batch(records)
+        return created, updated, sorted(errors + invalid)
+
+    async def _wait_merge(self) -> None:
+        if self._merge is not None:
+            merge, self._merge = self._merge, None
+            created, updated, errors = await merge
+            self.result.created += created
+            self.result.updated += updated
+            self._add_errors(errors)
+
+    @staticmethod
+    def _stage(line_number: int, row: dict) -> tuple | str:
+        """(line, country_code, phone_code, phone, timezone, tags) of the row or the error message.
+
+        The DB checks the values, only NUL characters, which Postgres can not store in text, are rejected here.
+        """
+        get = row.get
+        tags = get('tags') or ''
+        if isinstance(tags, list):
+            tags = TAG_SEPARATOR.join(map(str, tags))
+        values = (
+            str(get('country_code') or ''),
+            str(get('phone_code') or ''),
+            str(get('phone') or ''),
+            str(get('timezone') or ''),
+            str(tags),
+        )
+        if any('\x00' in value for value in values):
+            return 'Row contains a NUL character'
+        return line_number, *values
+
+    def _add_errors(self, errors: list[tuple[int, str]]) -> None:
+        self.result.failed += len(errors)
+        self.result.errors.extend(
+            CustomerImportError(row=line_number, error=error)
+            for line_number, error in errors[:self.max_errors - len(self.result.errors)]
+        )
+
+
+async def _read_file(path: str) -> AsyncIterator[bytes]:
+    with open(path, 'rb') as file:
+        while chunk := file.read(READ_SIZE):
+            yield chunk
+
+
+async def _import_file(path: str, file_format: FileFormatEnum, batch_size: int) -> CustomerImportResult:
+    try:
+        async with AsyncSession(async_engine) as session:
+            importer = CustomerImporter(CustomerRepository(session), batch_size=batch_size)
+            return await importer.run(_read_file(path), file_format)
+    finally:
+        await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='CSV or NDJSON file')
+    parser.add_argument(
+        '--format',
+        choices=[file_format.value for file_format in FileFormatEnum],
+        help='file format, by default ndjson for .ndjson and .jsonl files and csv otherwise',
+    )
+    parser.add_argument('--batch-size', type=int, default=settings.customer_import_batch_size)
+    args = parser.parse_args()
+
+    file_format = args.format or ('ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    started_at = time.perf_counter()
+    result = asyncio.run(_import_file(args.path, FileFormatEnum(file_format), args.batch_size))
+    elapsed = time.perf_counter() - started_at
+
+    print(result.json(indent=2))
+    print(f'{result.rows} rows in {elapsed:.1f} s, {result.rows / elapsed:.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
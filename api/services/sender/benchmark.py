@@ -0,0 +1,226 @@
+"""Throughput of the send path depending on the number of worker processes.
+
+Every process runs MailoutService on a mailout of its own against a local stub of the send API,
+so a message goes through the lease, the circuit breaker, the rate limiter, retries, the status
+buffer and the DB just as in a worker. The numbers show how the sender scales with processes
+before the provider becomes the limit. A mailout is processed by one process at a time, so the
+audience is split into one mailout per process rather than one mailout sharded across them.
+
+The benchmark customers, tags and mailouts are created in the configured DB and deleted afterwards,
+as well as the benchmark phone code if the run has created it. Run it against a development DB and Redis:
+
+    poetry run python -m services.sender.benchmark --processes 1 2 4 8 --messages 20000
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+import multiprocessing
+import time
+
+from aiohttp import web
+from sqlalchemy import ARRAY, Integer, any_, bindparam, delete, exists, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from db.config import settings
+from db.sessions import async_engine
+from repositories.customers import CustomerRepository
+from repositories.phone_codes import PhoneCodeRepository
+from schemas.base import StatusEnum
+from schemas.customers import Customer
+from schemas.link_schemas import CustomerTag, MailoutTag
+from schemas.mailouts import Mailout
+from schemas.messages import Message
+from schemas.phone_codes import PhoneCode, PhoneCodeCreate
+from schemas.tags import Tag
+from services.sender import worker_runtime
+from services.sender.client import get_client
+from services.sender.mailout import MailoutService
+
+BENCHMARK_PHONE_CODE = '000'
+BENCHMARK_TAG = 'benchmark'
+
+
+async def _accept_message(request: web.Request) -> web.Response:
+    await request.read()
+    return web.json_response({'code': 0, 'message': 'OK'})
+
+
+def _serve_stub_api(port: int) -> None:
+    app = web.Application()
+    app.router.add_post('/v1/send/{message_id}', _accept_message)
+
+    async def serve():
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port, reuse_port=True).start()
+        await asyncio.Event().wait()
+
+    worker_runtime.run(serve())
+
+
+async def _create_mailouts(processes: int, per_process: int, concurrency: int) -> tuple[list[int], bool]:
+    """One mailout per process, each with an audience of `per_process` customers of its own tag.
+
+    Returns the mailout ids and whether the benchmark phone code is created by this run.
+    """
+    async with AsyncSession(async_engine) as session:
+        phone_code_created = await session.scalar(
+            select(PhoneCode.id).where(PhoneCode.phone_code == BENCHMARK_PHONE_CODE)
+        ) is None
+        await PhoneCodeRepository(session).create(PhoneCodeCreate(phone_code=BENCHMARK_PHONE_CODE))
+        customer_repository = CustomerRepository(session)
+        tag_names = [f'{BENCHMARK_TAG}-{i}' for i in range(processes)]
+        records = [
+            (n, '7', BENCHMARK_PHONE_CODE, f'{n:07d}', '', tag_names[n % processes])
+            for n in range(per_process * processes)
+        ]
+        for first in range(0, len(records), settings.customer_import_batch_size):
+            await customer_repository.import_batch(records[first:first + settings.customer_import_batch_size])
+
+        _now = datetime.utcnow()
+        tags = (await session.scalars(select(Tag).where(Tag.tag.in_(tag_names)).order_by(Tag.tag))).all()
+        mailouts = [
+            Mailout(
+                text_message='Benchmark message',
+                start_at=_now,
+                finish_at=_now + timedelta(days=1),
+                max_in_flight=concurrency,
+                tags=[tag],
+            )
+            for tag in tags
+        ]
+        session.add_all(mailouts)
+        await session.flush()
+        mailout_ids = [mailout.id for mailout in mailouts]
+        await session.commit()
+        return mailout_ids, phone_code_created
+
+
+async def _count_sent(mailout_ids: list[int]) -> int:
+    async with AsyncSession(async_engine) as session:
+        return await session.scalar(
+            select(func.count())
+            .where(Message.mailout_id.in_(mailout_ids))
+            .where(Message.status == StatusEnum.sent)
+        )
+
+
+async def _delete_benchmark_rows(delete_phone_code: bool = False) -> None:
+    """Delete the mailouts, messages, customers and tags of this and of interrupted benchmark runs.
+
+    Only customers of the benchmark phone code having a benchmark tag are deleted, the phone code
+    itself is deleted if asked and no other customer has it.
+    """
+    async with AsyncSession(async_engine) as session:
+        benchmark_tags = select(Tag.id).where(Tag.tag.startswith(f'{BENCHMARK_TAG}-'))
+        # the ids are read before their tags are unlinked, they are passed as one array
+        customer_ids = (await session.scalars(
+            select(CustomerTag.customer_id)
+            .distinct()
+            .join(Customer, Customer.id == CustomerTag.customer_id)
+            .join(PhoneCode, PhoneCode.id == Customer.phone_code_id)
+            .where(CustomerTag.tag_id.in_(benchmark_tags))
+            .where(PhoneCode.phone_code == BENCHMARK_PHONE_CODE)
+        )).all()
+        benchmark_customers = any_(bindparam('customer_ids', customer_ids, type_=ARRAY(Integer)))
+        mailout_ids = (await session.scalars(
+            select(MailoutTag.mailout_id).where(MailoutTag.tag_id.in_(benchmark_tags))
+        )).all()
+        for statement in (
+            delete(Message).where(Message.mailout_id.in_(mailout_ids) | (Message.customer_id == benchmark_customers)),
+            delete(MailoutTag).where(MailoutTag.mailout_id.in_(mailout_ids)),
+            delete(Mailout).where(Mailout.id.in_(mailout_ids)),
+            delete(CustomerTag).where(CustomerTag.customer_id == benchmark_customers),
+            delete(Customer).where(Customer.id == benchmark_customers),
+            delete(Tag).where(Tag.id.in_(benchmark_tags)),
+        ):
+            await session.execute(statement.execution_options(synchronize_session=False))
+        if delete_phone_code:
+            await session.execute(
+                delete(PhoneCode)
+                .where(PhoneCode.phone_code == BENCHMARK_PHONE_CODE)
+                .where(~exists().where(Customer.phone_code_id == PhoneCode.id))
+                .execution_options(synchronize_session=False)
+            )
+        await session.commit()
+
+
+def _run_mailout(api_base_url: str, mailout_id: int, barrier) -> tuple[float, float]:
+    get_client().api_base_url = api_base_url
+    worker_runtime.start()
+    try:
+        # Every process starts sending at once, after its connection pools are warmed up.
+        barrier.wait()
+        started_at = time.perf_counter()
+        worker_runtime.run(MailoutService().process_mailout(mailout_id))
+        return started_at, time.perf_counter()
+    finally:
+        worker_runtime.stop()
+
+
+async def _prepare(processes: int, per_process: int, concurrency: int) -> tuple[list[int], bool]:
+    try:
+        return await _create_mailouts(processes, per_process, concurrency)
+    finally:
+        # the sender processes are forked, they must not share the connections of the parent
+        await async_engine.dispose()
+
+
+async def _clean_up(mailout_ids: list[int], delete_phone_code: bool) -> int:
+    """Delete the benchmark rows, returns the number of messages that were sent."""
+    try:
+        sent = await _count_sent(mailout_ids)
+        await _delete_benchmark_rows(delete_phone_code)
+        return sent
+    finally:
+        await async_engine.dispose()
+
+
+def run_benchmark(processes: int, messages: int, concurrency: int, api_base_url: str) -> float:
+    """Send `messages` split between `processes` mailouts processed by as many processes, return messages per second."""
+    per_process = messages // processes
+    mailout_ids, phone_code_created = asyncio.run(_prepare(processes, per_process, concurrency))
+    try:
+        with multiprocessing.Manager() as manager, multiprocessing.Pool(processes) as pool:
+            barrier = manager.Barrier(processes)
+            results = pool.starmap(_run_mailout, [(api_base_url, mailout_id, barrier) for mailout_id in mailout_ids])
+    finally:
+        sent = asyncio.run(_clean_up(mailout_ids, phone_code_created))
+    if sent != per_process * processes:
+        raise RuntimeError(f'{sent} of {per_process * processes} messages are sent')
+    started_at = min(result[0] for result in results)
+    finished_at = max(result[1] for result in results)
+    return sent / (finished_at - started_at)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=settings.sender_concurrency, help='messages in flight per mailout')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--stub-processes', type=int, default=max(multiprocessing.cpu_count() // 2, 1))
+    args = parser.parse_args()
+
+    stubs = [
+        multiprocessing.Process(target=_serve_stub_api, args=(args.port,), daemon=True)
+        for _ in range(args.stub_processes)
+    ]
+    for stub in stubs:
+        stub.start()
+    time.sleep(1)
+
+    api_base_url = f'http://127.0.0.1:{args.port}/v1/send'
+    baseline = None
+    print(f'{"processes":>10} {"messages/s":>12} {"speedup":>8}')
+    for processes in args.processes:
+        rate = run_benchmark(processes, args.messages, args.concurrency, api_base_url)
+        baseline = baseline or rate
+        print(f'{processes:>10} {rate:>12.0f} {rate / baseline:>8.2f}')
+
+    for stub in stubs:
+        stub.terminate()
+
+
+if __name__ == '__main__':
+    main()
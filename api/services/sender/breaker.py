@@ -0,0 +1,172 @@
+from enum import Enum
+import time
+
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from db.config import settings
+from services.sender.metrics import circuit_breaker_state, circuit_breaker_transitions
+from utils.logging import logger
+
+# All scripts use the Redis clock, so every worker sees the same timeline.
+# The breaker is a hash with fields: state, failures, window_start, opened_at, probe_at.
+_NOW_MS = '''
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+'''
+
+ALLOW_SCRIPT = _NOW_MS + '''
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state == 'closed' then
+    return {1, state, state}
+end
+local reset_timeout = tonumber(ARGV[1])
+if state == 'open' then
+    local opened_at = tonumber(redis.call('HGET', KEYS[1], 'opened_at')) or 0
+    if now - opened_at < reset_timeout then
+        return {0, state, state}
+    end
+    redis.call('HSET', KEYS[1], 'state', 'half_open', 'probe_at', now)
+    return {1, state, 'half_open'}
+end
+local probe_at = tonumber(redis.call('HGET', KEYS[1], 'probe_at')) or 0
+if now - probe_at >= reset_timeout then
+    redis.call('HSET', KEYS[1], 'probe_at', now)
+    return {1, state, state}
+end
+return {0, state, state}
+'''
+
+FAILURE_SCRIPT = _NOW_MS + '''
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state == 'open' then
+    return {state, state}
+end
+if state == 'closed' then
+    local threshold = tonumber(ARGV[1])
+    local window = tonumber(ARGV[2])
+    local window_start = tonumber(redis.call('HGET', KEYS[1], 'window_start')) or 0
+    local failures = 1
+    if now - window_start > window then
+        redis.call('HSET', KEYS[1], 'window_start', now, 'failures', 1)
+    else
+        failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+    end
+    if failures < threshold then
+        return {state, state}
+    end
+end
+redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', now, 'failures', 0)
+return {state, 'open'}
+'''
+
+SUCCESS_SCRIPT = _NOW_MS + '''
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state ~= 'half_open' then
+    return {state, state}
+end
+redis.call('HSET', KEYS[1], 'state', 'closed', 'failures', 0, 'window_start', now)
+return {state, 'closed'}
+'''
+
+
+class CircuitBreakerOpenError(Exception):
+    """Raised when the external API circuit breaker does not allow a request."""
+    pass
+
+
+class BreakerState(str, Enum):
+    closed = 'closed'
+    open = 'open'
+    half_open = 'half_open'
+
+
+BREAKER_STATE_VALUES = {
+    BreakerState.closed: 0,
+    BreakerState.open: 1,
+    BreakerState.half_open: 2,
+}
+
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker whose state is shared by all workers through Redis.
+
+    While the cached state is closed, successful requests cost no Redis round trips.
+    If Redis is unreachable the breaker lets requests through.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        redis: aioredis.Redis,
+        failure_threshold: int = settings.sender_breaker_failure_threshold,
+        failure_window: float = settings.sender_breaker_failure_window,
+        reset_timeout: float = settings.sender_breaker_reset_timeout,
+        state_ttl: float = settings.sender_breaker_state_ttl,
+    ):
+        self.name = name
+        self._key = f'circuit_breaker:{name}'
+        self._redis = redis
+        self._failure_threshold = failure_threshold
+        self._failure_window_ms = int(failure_window * 1000)
+        self._reset_timeout_ms = int(reset_timeout * 1000)
+        self._state_ttl = state_ttl
+        self._state = BreakerState.closed
+        self._state_checked_at = 0.0
+        self._allow_script = redis.register_script(ALLOW_SCRIPT)
+        self._failure_script = redis.register_script(FAILURE_SCRIPT)
+        self._success_script = redis.register_script(SUCCESS_SCRIPT)
+
+    @property
+    def state(self) -> BreakerState:
+        return self._state
+
+    def _set_state(self, from_state: str, to_state: str) -> None:
+        from_state, to_state = BreakerState(from_state), BreakerState(to_state)
+        if from_state != to_state:
+            logger.info(f'Circuit breaker "{self.name}" switched from {from_state.value} to {to_state.value}')
+            circuit_breaker_transitions.labels(
+                breaker=self.name, from_state=from_state.value, to_state=to_state.value,
+            ).inc()
+        self._state = to_state
+        self._state_checked_at = time.monotonic()
+        circuit_breaker_state.labels(breaker=self.name).set(BREAKER_STATE_VALUES[to_state])
+
+    async def allow_request(self) -> bool:
+        if (
+            self._state == BreakerState.closed
+            and time.monotonic() - self._state_checked_at < self._state_ttl
+        ):
+            return True
+        try:
+            allowed, from_state, to_state = await self._allow_script(
+                keys=[self._key], args=[self._reset_timeout_ms],
+            )
+        except RedisError as err:
+            logger.error(f'Circuit breaker "{self.name}" state is unavailable: {str(err)}')
+            return True
+        self._set_state(from_state, to_state)
+        return bool(allowed)
+
+    async def record_success(self) -> None:
+        if self._state == BreakerState.closed:
+            return
+        await self._record(self._success_script, [])
+
+    async def record_failure(self) -> None:
+        await self._record(
+            self._failure_script, [self._failure_threshold, self._failure_window_ms],
+        )
+
+    async def _record(self, script, args: list) -> None:
+        try:
+            from_state, to_state = await script(keys=[self._key], args=args)
+        except RedisError as err:
+            logger.error(f'Circuit breaker "{self.name}" state is unavailable: {str(err)}')
+            return
+        self._set_state(from_state, to_state)
+
+    async def reset(self) -> None:
+        await self._redis.delete(self._key)
+        self._state = BreakerState.closed
+        self._state_checked_at = 0.0
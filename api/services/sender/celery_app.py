@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+
+from datetime import datetime, timedelta
+import os
+
+from celery import Celery
+from dotenv import load_dotenv
+
+from db.config import settings
+from services.sender.queues import QUEUE_PRIORITIES, SenderQueue
+from utils.logging import logger
+
+load_dotenv()
+
+PROCESS_MAILOUTS_TASK = 'services.sender.celery_worker.process_mailouts'
+PROCESS_MAILOUT_TASK = 'services.sender.celery_worker.process_mailout'
+START_MAILOUT_TASK = 'services.sender.celery_worker.start_mailout'
+
+celery_app = Celery(
+    broker=os.environ.get('CELERY_BROKER_URL', 'redis://redis:6379'),
+    backend=os.environ.get('CELERY_RESULT_BACKEND', 'redis://redis:6379'),
+)
+
+celery_app.conf.update(
+    task_serializer='json',
+    accept_content=['application/json'],
+    result_serializer='json',
+    beat_schedule={
+        # Mailouts are started by their own ETA tasks, the scan only catches the ones whose task is lost.
+        'send-messages-scheduled-task': {
+            'task': PROCESS_MAILOUTS_TASK,
+            'schedule': settings.sender_scan_interval,
+        }
+    },
+    worker_concurrency=int(os.environ.get('CELERY_WORKER_CONCURRENCY', os.cpu_count() or 1)),
+    # Tasks are long, a process should not hold tasks another idle process could take.
+    worker_prefetch_multiplier=1,
+    # A worker consuming several queues drains them in the order given by -Q.
+    broker_transport_options={
+        'queue_order_strategy': 'priority',
+        'priority_steps': list(range(10)),
+        # A start task is held unacknowledged until its ETA, it must not be redelivered before that.
+        'visibility_timeout': settings.sender_start_horizon + settings.sender_scan_interval,
+        'socket_connect_timeout': settings.sender_broker_connect_timeout,
+    },
+    # The API schedules starts, it is not held up by a broker that is down.
+    broker_connection_timeout=settings.sender_broker_connect_timeout,
+    task_default_priority=QUEUE_PRIORITIES[SenderQueue.scheduled],
+    task_routes={
+        PROCESS_MAILOUTS_TASK: SenderQueue.scheduled.value,
+        PROCESS_MAILOUT_TASK: SenderQueue.scheduled.value,
+        START_MAILOUT_TASK: SenderQueue.scheduled.value,
+    },
+)
+
+
+def dispatch_mailout(mailout_id: int, queue: SenderQueue, countdown: float | None = None):
+    return celery_app.send_task(
+        PROCESS_MAILOUT_TASK,
+        args=[mailout_id],
+        queue=queue.value,
+        priority=QUEUE_PRIORITIES[queue],
+        countdown=countdown,
+    )
+
+
+def schedule_mailout_start(mailout_id: int, start_at: datetime, task_id: str) -> None:
+    """Enqueue the task `task_id` starting the mailout at `start_at`.
+
+    Starts further than SENDER_START_HORIZON ahead are not enqueued, as well as the ones the broker
+    could not take, these mailouts are started by the periodic scan. Blocks on the broker, call it off the event loop.
+    """
+    if start_at > datetime.utcnow() + timedelta(seconds=settings.sender_start_horizon):
+        logger.info(f'Start of mailout {mailout_id} at {start_at} is left to the scan')
+        return
+    try:
+        # the result of a start task is never read, the result backend is not touched
+        celery_app.send_task(
+            START_MAILOUT_TASK, args=[mailout_id], eta=start_at, task_id=task_id, retry=False, ignore_result=True,
+        )
+    except Exception as err:
+        logger.error(f'Start of mailout {mailout_id} can not be scheduled: {str(err)}')
+        return
+    logger.info(f'Start of mailout {mailout_id} is scheduled at {start_at}, task {task_id}')
+
+
+def revoke_mailout_start(task_id: str) -> None:
+    """Revoke a scheduled start, a start task that is not revoked in time skips itself anyway.
+
+    Blocks on the broker, call it off the event loop.
+    """
+    try:
+        celery_app.control.revoke(task_id)
+    except Exception as err:
+        logger.error(f'Start task {task_id} can not be revoked: {str(err)}')
@@ -1,43 +1,40 @@
-from __future__ import absolute_import
-
-import os
-from dotenv import load_dotenv
-
-import asyncio
-from celery import Celery
-from celery.schedules import crontab
-
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+
+from services.sender import worker_runtime
+from services.sender.celery_app import (
+    PROCESS_MAILOUT_TASK,
+    PROCESS_MAILOUTS_TASK,
+    START_MAILOUT_TASK,
+    celery_app,
+    dispatch_mailout,
+)
 from services.sender.mailout import MailoutService
 
-load_dotenv()
 
-celery_app = Celery(
-    broker=os.environ.get('CELERY_BROKER_URL', 'redis://redis:6379'),
-    backend=os.environ.get('CELERY_RESULT_BACKEND', 'redis://redis:6379'),
-)
+@worker_process_init.connect
+def start_worker_runtime(**kwargs):
+    worker_runtime.start()
 
-celery_app.conf.update(
-    task_serializer='json',
-    accept_content=['application/json'],
-    result_serializer='json',
-    beat_schedule={
-        'send-messages-scheduled-task': {
-            'task': 'services.sender.celery_worker.process_mailouts',
-            'schedule': crontab(minute='*/1')
-        }
-    },
-    task_routes={
-        'services.sender.celery_worker.process_mailouts': 'main-queue',
-        'services.sender.celery_worker.process_mailout': 'main-queue',
-    },
-)
+
+# A solo worker has no child processes, so it is closed on the worker shutdown instead.
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def stop_worker_runtime(**kwargs):
+    worker_runtime.stop()
 
 
-@celery_app.task
+@celery_app.task(name=PROCESS_MAILOUTS_TASK)
 def process_mailouts():
-    asyncio.get_event_loop().run_until_complete(MailoutService().process_mailouts())
+    worker_runtime.run(MailoutService(dispatch=dispatch_mailout).process_mailouts())
 
 
-@celery_app.task
+@celery_app.task(name=PROCESS_MAILOUT_TASK)
 def process_mailout(mailout_id: int):
-    asyncio.get_event_loop().run_until_complete(MailoutService().process_mailout(mailout_id))
+    worker_runtime.run(MailoutService(dispatch=dispatch_mailout).process_mailout(mailout_id))
+
+
+@celery_app.task(name=START_MAILOUT_TASK, bind=True)
+def start_mailout(self, mailout_id: int):
+    worker_runtime.run(
+        MailoutService(dispatch=dispatch_mailout).start_mailout(mailout_id, start_task_id=self.request.id)
+    )
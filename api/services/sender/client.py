@@ -1,7 +1,14 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, asdict
-import requests
+import asyncio
 
+import aiohttp
+from yarl import URL
+
+from db.config import settings
+from db.sessions import async_redis
+from services.sender.breaker import CircuitBreaker, CircuitBreakerOpenError
+from services.sender.rate_limiter import RateLimit, RateLimiter
 from utils.logging import logger
 
 
@@ -16,8 +23,18 @@ class MailoutMessage:
 
 
 class ClientInterface(ABC):
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def release_rate_limit(self, key: str) -> None:
+        """Forget the local state of the sub-limit `key`, its mailout is finished."""
+        pass
+
     @abstractmethod
-    def send_mailout(self, message: MailoutMessage) -> (int, str):
+    async def send_mailout(self, message: MailoutMessage, rate_limit: RateLimit | None = None) -> (int, str):
         pass
 
 
@@ -30,28 +47,126 @@ class Client(ClientInterface):
     api_auth_header_prefix = 'Bearer'
     api_auth_header = 'Authorization'
 
-    def __init__(self, *args, **kwargs):
-        session = requests.Session()
-        session.headers.update({self.api_auth_header: f'{self.api_auth_header_prefix} {self.api_token}'})
-        self._session = session
+    def __init__(
+        self,
+        *args,
+        breaker: CircuitBreaker | None = None,
+        rate_limiter: RateLimiter | None = None,
+        **kwargs,
+    ):
+        self._session: aiohttp.ClientSession | None = None
+        self.breaker = breaker or CircuitBreaker(name='send_api', redis=async_redis)
+        self.rate_limiter = rate_limiter or RateLimiter(redis=async_redis)
         super().__init__(*args, **kwargs)
 
-    def send_mailout(self, message: MailoutMessage) -> (int, str):
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=settings.sender_pool_size,
+            limit_per_host=settings.sender_pool_size,
+            ttl_dns_cache=settings.sender_dns_cache_ttl,
+            keepalive_timeout=settings.sender_keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=settings.sender_total_timeout,
+            sock_connect=settings.sender_connect_timeout,
+            sock_read=settings.sender_read_timeout,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers={self.api_auth_header: f'{self.api_auth_header_prefix} {self.api_token}'},
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    async def start(self) -> None:
+        """Open the connection pool, resolve the API host and pre-establish keep-alive connections.
+
+        Only TCP (and TLS) connections are opened, no request is sent to the API.
+        """
+        session = self.session
+        await asyncio.gather(*(
+            self._warm_up_connection(session)
+            for _ in range(settings.sender_pool_warmup)
+        ))
+        logger.info(f'Sender connection pool to "{self.api_base_url}" is warmed up')
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _warm_up_connection(self, session: aiohttp.ClientSession) -> None:
+        request = aiohttp.ClientRequest('HEAD', URL(self.api_base_url), loop=asyncio.get_running_loop())
+        try:
+            connection = await session.connector.connect(request, traces=[], timeout=session.timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError, Exception) as err:
+            logger.error(f'Warming up connection to "{self.api_base_url}" resulted in an error: {str(err)}')
+        else:
+            # back to the pool as an idle keep-alive connection
+            connection.release()
+
+    async def send_mailout(self, message: MailoutMessage, rate_limit: RateLimit | None = None) -> (int, str):
+        """Send a message within the global rate limit and the optional per-mailout one.
+
+        Raises CircuitBreakerOpenError instead if the external API is considered down.
+        """
+        if not await self.breaker.allow_request():
+            raise CircuitBreakerOpenError
+        await self.rate_limiter.acquire(rate_limit)
+        status, text = await self._post_message(message)
+        if status >= 500:
+            await self.breaker.record_failure()
+        else:
+            await self.breaker.record_success()
+        return status, text
+
+    def release_rate_limit(self, key: str) -> None:
+        self.rate_limiter.release(key)
+
+    async def _post_message(self, message: MailoutMessage) -> (int, str):
         api_url = f'{self.api_base_url}/{message.id}'
         try:
-            resp = self._session.post(api_url, json=message.as_dict())
-            return resp.status_code, resp.text
-        except (requests.ConnectionError, requests.ConnectTimeout, Exception) as err:
-            err = f'[msg {message.id}] querying url "{api_url}" resulted in an error: {str(err)}'
+            async with self.session.post(api_url, json=message.as_dict()) as resp:
+                return resp.status, await resp.text()
+        except asyncio.TimeoutError:
+            err = f'[msg {message.id}] querying url "{api_url}" timed out'
+            logger.error(err)
+            return 504, err
+        except (aiohttp.ClientError, Exception) as err:
+            err = f'[msg {message.id}] querying url "{api_url}" resulted in an error: {str(err) or repr(err)}'
             logger.error(err)
             return 500, err
 
 
-if __name__ == '__main__':
-    Client().send_mailout(
-        MailoutMessage(
-            id=1,
-            phone='79201234567',
-            text='API client testing',
+_client: Client | None = None
+
+
+def get_client() -> Client:
+    """Process-wide client, so every task of a worker reuses one connection pool."""
+    global _client
+    if _client is None:
+        _client = Client()
+    return _client
+
+
+async def _send_test_message():
+    client = Client()
+    try:
+        await client.send_mailout(
+            MailoutMessage(
+                id=1,
+                phone='79201234567',
+                text='API client testing',
+            )
         )
-    )
+    finally:
+        await client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(_send_test_message())
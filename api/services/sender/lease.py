@@ -0,0 +1,76 @@
+import asyncio
+import uuid
+
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from db.config import settings
+from utils.logging import logger
+
+# Both scripts only touch the lease if it is still held with the caller's token.
+RENEW_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+'''
+
+RELEASE_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+class Lease:
+    """Exclusive lease kept in Redis with a TTL, renewed in background while it is held.
+
+    If the holder crashes, the lease is freed once its TTL expires. If the lease is lost
+    (it has expired and may be taken by someone else), the task holding it is cancelled.
+    If Redis is unreachable, the lease is not acquired.
+    """
+
+    def __init__(self, name: str, redis: aioredis.Redis, ttl: float = settings.sender_lease_ttl):
+        self.name = name
+        self._key = f'lease:{name}'
+        self._redis = redis
+        self._ttl_ms = int(ttl * 1000)
+        self._token = uuid.uuid4().hex
+        self._heartbeat: asyncio.Task | None = None
+        self.lost = False
+        self._renew_script = redis.register_script(RENEW_SCRIPT)
+        self._release_script = redis.register_script(RELEASE_SCRIPT)
+
+    async def acquire(self) -> bool:
+        try:
+            acquired = await self._redis.set(self._key, self._token, nx=True, px=self._ttl_ms)
+        except RedisError as err:
+            logger.error(f'Lease "{self.name}" can not be acquired: {str(err)}')
+            return False
+        if acquired:
+            self._heartbeat = asyncio.create_task(self._keep_alive(holder=asyncio.current_task()))
+        return bool(acquired)
+
+    async def release(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        try:
+            await self._release_script(keys=[self._key], args=[self._token])
+        except RedisError as err:
+            logger.error(f'Lease "{self.name}" can not be released, it expires on its own: {str(err)}')
+
+    async def _keep_alive(self, holder: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(self._ttl_ms / 3000)
+            try:
+                renewed = await self._renew_script(keys=[self._key], args=[self._token, self._ttl_ms])
+            except RedisError as err:
+                logger.error(f'Lease "{self.name}" can not be renewed: {str(err)}')
+                continue
+            if not renewed:
+                logger.error(f'Lease "{self.name}" is lost, its holder is cancelled')
+                self.lost = True
+                holder.cancel()
+                return
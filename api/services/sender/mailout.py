@@ -1,31 +1,51 @@
 from abc import ABC, abstractmethod
-from datetime import datetime
-import time
+from datetime import datetime, time, timedelta
+from typing import Any, AsyncIterable, AsyncIterator, Callable
+import asyncio
 
-from sqlmodel import select
+from sqlalchemy.engine import Row
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from db.config import settings
 from db.errors import EntityDoesNotExist
-from db.sessions import async_engine
-from repositories.phone_codes import PhoneCodeRepository
+from db.sessions import async_engine, async_redis
+from repositories.mailout_audience import MailoutAudienceRepository
 from repositories.mailouts import MailoutRepository
 from repositories.messages import MessageRepository
-from schemas.link_schemas import CustomerTag
-from schemas.tags import Tag
+from repositories.timezones import TimezoneRepository
 from schemas.mailouts import Mailout
-from schemas.customers import Customer
-from schemas.messages import MessageCreate, MessageUpdate
 from schemas.base import StatusEnum
-from services.sender.client import Client, ClientInterface, MailoutMessage
-from services.sender.metrics import messages_total_sent, messages_total_failed
+from services.sender.breaker import CircuitBreakerOpenError
+from services.sender.client import ClientInterface, MailoutMessage, get_client
+from services.sender.lease import Lease
+from services.sender.metrics import (
+    mailout_send_concurrency,
+    messages_in_flight,
+    messages_total_failed,
+    messages_total_sent,
+)
+from services.sender.queues import select_queue
+from services.sender.rate_limiter import RateLimit
+from services.sender.retry import RetryPolicy
+from services.sender.status_buffer import MessageStatusBuffer, get_status_buffer
 from utils.logging import logger
 
 
 class MailoutServiceInterface(ABC):
     _fbrq_client: ClientInterface
+    _status_buffer: MessageStatusBuffer
+    _dispatch: Callable[..., Any] | None
 
-    def __init__(self):
-        self._fbrq_client = Client()
+    def __init__(
+        self,
+        client: ClientInterface | None = None,
+        status_buffer: MessageStatusBuffer | None = None,
+        dispatch: Callable[..., Any] | None = None,
+    ):
+        """`dispatch(mailout_id, queue, countdown=None)` hands a mailout over to a worker of the queue."""
+        self._fbrq_client = client or get_client()
+        self._status_buffer = status_buffer if status_buffer is not None else get_status_buffer()
+        self._dispatch = dispatch
 
     @abstractmethod
     def process_mailouts(self) -> None:
@@ -35,11 +55,19 @@ class MailoutServiceInterface(ABC):
     def process_mailout(self, mailout_id: int) -> None:
         pass
 
+    @abstractmethod
+    def start_mailout(self, mailout_id: int, start_task_id: str) -> None:
+        pass
+
 
 class MailoutService(MailoutServiceInterface):
-    _mailout_send_max_tries: int = 3
+    _retry_policy: RetryPolicy = RetryPolicy()
 
     async def process_mailouts(self) -> None:
+        """Process every mailout due now, or dispatch each of them to its queue if the service can dispatch.
+
+        Dispatching lets the mailouts be processed by different worker processes at once.
+        """
         async with AsyncSession(async_engine) as async_session:
             mailout_repository = MailoutRepository(async_session)
 
@@ -52,7 +80,36 @@ class MailoutService(MailoutServiceInterface):
                 return
 
             for job in jobs:
-                await self._process_mailout(job)
+                await self._dispatch_or_process(job)
+
+    async def start_mailout(self, mailout_id: int, start_task_id: str) -> None:
+        """Start the mailout by its scheduled task, unless the task has been replaced since it was scheduled."""
+        async with AsyncSession(async_engine) as async_session:
+            mailout_repository = MailoutRepository(async_session)
+
+            try:
+                instance = await mailout_repository.get(model_id=mailout_id)
+            except EntityDoesNotExist:
+                logger.info(f'Job {mailout_id} not found')
+                return
+
+            if instance.start_task_id != start_task_id:
+                logger.info(f'Job {mailout_id} start task {start_task_id} is outdated')
+                return
+            await self._dispatch_or_process(instance)
+
+    async def _dispatch_or_process(self, mailout: Mailout) -> None:
+        if self._dispatch is None:
+            await self._process_mailout(mailout)
+            return
+        queue = select_queue(audience_size=await self._get_audience_size(mailout))
+        self._dispatch(mailout.id, queue)
+        logger.info(f'Job {mailout.id} is dispatched to the "{queue.value}" queue')
+
+    async def _get_audience_size(self, mailout: Mailout) -> int:
+        async with AsyncSession(async_engine) as async_session:
+            estimate = await MailoutRepository(async_session).get_audience_estimate(mailout.id, sample_size=0)
+        return estimate.count
 
     async def process_mailout(self, mailout_id: int) -> None:
         async with AsyncSession(async_engine) as async_session:
@@ -67,88 +124,319 @@ class MailoutService(MailoutServiceInterface):
             await self._process_mailout(instance)
 
     async def _process_mailout(self, mailout: Mailout) -> None:
-        async with AsyncSession(async_engine) as async_session:
-            job_id = mailout.id
-            logger.info(f'Processing job (mailout) {job_id}')
+        job_id = mailout.id
+        logger.info(f'Processing job (mailout) {job_id}')
 
-            if not mailout.requires_processing():
-                logger.info(f'Job {job_id} does not need processing')
-                return
+        if not mailout.requires_processing():
+            logger.info(f'Job {job_id} does not need processing')
+            return
+
+        buckets = await self._get_delivery_buckets(mailout)
+        closed_timezone_ids = [
+            timezone_id for bucket in buckets if not bucket.is_open for timezone_id in bucket.timezone_ids
+        ]
+        if closed_timezone_ids:
+            await self._schedule_window_opening(mailout, buckets)
+        if buckets and all(not bucket.is_open for bucket in buckets):
+            logger.info(f'Job {job_id} is outside the delivery window of all its timezones')
+            return
 
-            query = (
-                select(Customer)
-                .join(CustomerTag, Customer.id == CustomerTag.customer_id)
-                .join(Tag, Tag.id == CustomerTag.tag_id)
-                .where(Tag.tag.in_([m.tag for m in mailout.tags]))
+        lease = self._get_lease(mailout)
+        if not await lease.acquire():
+            logger.info(f'Job {job_id} is already being processed')
+            return
+        try:
+            if mailout.audience_snapshot_at is None:
+                await self._create_audience_snapshot(mailout)
+            await self._process_customers(
+                mailout=mailout,
+                customer_chunks=self._read_audience(mailout, exclude_timezone_ids=closed_timezone_ids),
+                save_checkpoints=not closed_timezone_ids,
             )
+        except asyncio.CancelledError:
+            if not lease.lost:
+                raise
+            logger.error(f'Job {job_id} is stopped as its lease is lost')
+        finally:
+            await lease.release()
+            self._fbrq_client.release_rate_limit(_rate_limit_key(mailout.id))
 
-            results = await async_session.exec(query)
-            customers = results.all()
+    def _get_lease(self, mailout: Mailout) -> Lease:
+        return Lease(name=f'mailout:{mailout.id}', redis=async_redis)
 
-            job_customer_count = len(customers)
-            logger.info(f'Job {job_id} has total of {job_customer_count} customers to notify')
+    async def _get_delivery_buckets(self, mailout: Mailout) -> list[Row]:
+        """Customers' timezones grouped by UTC offset, each bucket tells if the mailout's delivery window is open."""
+        if mailout.available_start_at is None and mailout.available_finish_at is None:
+            return []
 
-            if not job_customer_count:
-                return
+        async with AsyncSession(async_engine) as async_session:
+            timezone_repository = TimezoneRepository(async_session)
+            buckets = await timezone_repository.select_offset_buckets(
+                available_start_at=mailout.available_start_at or time.min,
+                available_finish_at=mailout.available_finish_at or time.max,
+            )
 
-            job_processed_customer_count = 0
-            for customer in customers:
-                if datetime.utcnow() >= mailout.finish_at:
-                    logger.info(
-                        f"Job {job_id} has expired, total job's customers (messages) "
-                        f"processed: {job_processed_customer_count}"
-                    )
-                    return
+        open_buckets = [str(bucket.utc_offset) for bucket in buckets if bucket.is_open]
+        logger.info(
+            f'Job {mailout.id} delivery window is open for {len(open_buckets)} of {len(buckets)} '
+            f'UTC offsets: {", ".join(open_buckets)}'
+        )
+        return buckets
 
-                job_processed_customer_count += 1
-                await self._process_customer_mailout(mailout=mailout, customer=customer)
+    async def _schedule_window_opening(self, mailout: Mailout, buckets: list[Row]) -> None:
+        """Have the mailout started again once the delivery window opens for the first of its closed timezones.
 
-            logger.info(f'Job {job_id} total customers (messages) processed: {job_processed_customer_count}')
+        Customers of the closed timezones would wait for the periodic scan otherwise.
+        """
+        if self._dispatch is None:
+            return
+        _now = datetime.utcnow()
+        opens_at = min(
+            _next_window_opening(mailout.available_start_at or time.min, bucket.utc_offset, _now)
+            for bucket in buckets
+            if not bucket.is_open
+        )
+        if opens_at >= mailout.finish_at:
+            logger.info(f'Job {mailout.id} delivery window opens at {opens_at}, after the mailout finishes')
+            return
+        await self._schedule_start(mailout, opens_at)
 
-    async def _process_customer_mailout(self, mailout: Mailout, customer: Customer) -> None:
+    async def _schedule_start(self, mailout: Mailout, start_at: datetime) -> None:
         async with AsyncSession(async_engine) as async_session:
-            message_repository = MessageRepository(async_session)
-            phone_code_repository = PhoneCodeRepository(async_session)
+            mailout_repository = MailoutRepository(async_session)
+            await mailout_repository.schedule_start(model_id=mailout.id, start_at=start_at)
+
+    async def _create_audience_snapshot(self, mailout: Mailout) -> None:
+        """Freeze the mailout's audience, later runs send from the snapshot without resolving it again."""
+        snapshot_at = datetime.utcnow()
+        async with AsyncSession(async_engine) as async_session:
+            mailout_audience_repository = MailoutAudienceRepository(async_session)
+            job_customer_count = await mailout_audience_repository.create_snapshot(
+                mailout_id=mailout.id,
+                tag_ids=[tag.id for tag in mailout.tags],
+                phone_code_ids=[phone_code.id for phone_code in mailout.phone_codes],
+                snapshot_at=snapshot_at,
+            )
+        mailout.audience_snapshot_at = snapshot_at
+        logger.info(f'Job {mailout.id} audience snapshot is taken, {job_customer_count} customers added')
 
-            msg = await message_repository.create(
-                model_create=MessageCreate(
-                    status=StatusEnum.pending,
+    async def _read_audience(
+        self,
+        mailout: Mailout,
+        exclude_timezone_ids: list[int] | None = None,
+    ) -> AsyncIterator[list[Row]]:
+        """Read the customers of the mailout's audience snapshot who have not been messaged yet.
+
+        Customers are read in chunks ordered by id, each chunk by its own short query.
+        """
+        chunk_size = settings.sender_chunk_size
+        last_customer_id = mailout.last_customer_id or 0
+        if last_customer_id:
+            logger.info(f'Job {mailout.id} is resumed after customer {last_customer_id}')
+        job_customer_count = 0
+        while True:
+            async with AsyncSession(async_engine) as async_session:
+                mailout_audience_repository = MailoutAudienceRepository(async_session)
+                customers = await mailout_audience_repository.select_pending(
                     mailout_id=mailout.id,
-                    customer_id=customer.id,
+                    exclude_timezone_ids=exclude_timezone_ids,
+                    after_customer_id=last_customer_id,
+                    limit=chunk_size,
                 )
-            )
 
-            job_id = mailout.id
-            logger.info(f'Job: {job_id}, customer: {customer.id}, processing message: {msg.id}')
-            phone_code = await phone_code_repository.get(model_id=customer.phone_code_id)
-            phone = f'{customer.country_code}{phone_code.phone_code}{customer.phone}'
-            client_msg = MailoutMessage(id=msg.id, phone=phone, text=mailout.text_message)
-
-            for current_try_number in range(self._mailout_send_max_tries):
-                logger.info(f'Trying to send message {msg.id} for a try No. {current_try_number + 1}')
-                status, _ = self._fbrq_client.send_mailout(client_msg)
-                if status == 200:
-                    await message_repository.update(
-                        model_id=msg.id,
-                        model_update=MessageUpdate(
-                            status=StatusEnum.sent,
-                            mailout_id=mailout.id,
-                            customer_id=customer.id,
+            if not customers:
+                break
+            job_customer_count += len(customers)
+            logger.info(f'Job {mailout.id} read {len(customers)} customers to notify, {job_customer_count} so far')
+            yield customers
+
+            if len(customers) < chunk_size:
+                break
+            last_customer_id = customers[-1].id
+
+    async def _process_customers(
+        self,
+        mailout: Mailout,
+        customer_chunks: AsyncIterable[list[Row]],
+        save_checkpoints: bool = True,
+    ) -> int:
+        """Send the mailout to customers chunk by chunk.
+
+        Checkpoints should not be saved if a part of the audience has been left out for now.
+        """
+        job_id = mailout.id
+        max_in_flight = mailout.max_in_flight or settings.sender_concurrency
+        mailout_send_concurrency.set(max_in_flight)
+        logger.info(f'Job {job_id} is processed with up to {max_in_flight} messages in flight')
+
+        semaphore = asyncio.Semaphore(max_in_flight)
+        breaker_open = asyncio.Event()
+        in_flight = set()
+        dispatched_chunks = []
+        job_processed_customer_count = 0
+        try:
+            async for customers in customer_chunks:
+                if datetime.utcnow() >= mailout.finish_at:
+                    break
+                messages = await self._create_pending_messages(mailout=mailout, customers=customers)
+
+                chunk_tasks = set()
+                for message_id, customer in messages:
+                    await semaphore.acquire()
+                    if datetime.utcnow() >= mailout.finish_at:
+                        semaphore.release()
+                        logger.info(
+                            f"Job {job_id} has expired, total job's customers (messages) "
+                            f"processed: {job_processed_customer_count}"
+                        )
+                        return job_processed_customer_count
+                    if breaker_open.is_set():
+                        semaphore.release()
+                        logger.info(
+                            f"Job {job_id} is deferred as the external API is unavailable, total job's customers "
+                            f"(messages) processed: {job_processed_customer_count}"
+                        )
+                        return job_processed_customer_count
+
+                    job_processed_customer_count += 1
+                    task = asyncio.create_task(
+                        self._process_customer_mailout_in_flight(
+                            semaphore, breaker_open, mailout=mailout, customer=customer, message_id=message_id,
                         )
                     )
-                    logger.info(f'Message {msg.id} successfully sent on a try No. {current_try_number + 1}')
-                    messages_total_sent.inc()
-                    return
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+                    chunk_tasks.add(task)
 
-                time.sleep(0.5)
+                dispatched_chunks.append((customers[-1].id, chunk_tasks))
+                if save_checkpoints and not breaker_open.is_set():
+                    await self._save_checkpoint(mailout=mailout, dispatched_chunks=dispatched_chunks)
+                logger.info(f'Job {job_id} customers (messages) processed so far: {job_processed_customer_count}')
+        finally:
+            await asyncio.gather(*in_flight)
+            await self._status_buffer.flush()
+            if save_checkpoints and not breaker_open.is_set():
+                await self._save_checkpoint(mailout=mailout, dispatched_chunks=dispatched_chunks)
+            if breaker_open.is_set():
+                self._dispatch_retry(mailout)
 
-            logger.info(f'Failed to send message {msg.id} after {self._mailout_send_max_tries} tries')
-            await message_repository.update(
-                model_id=msg.id,
-                model_update=MessageUpdate(
-                    status=StatusEnum.failed,
-                    mailout_id=mailout.id,
-                    customer_id=customer.id,
-                )
+        logger.info(f'Job {job_id} total customers (messages) processed: {job_processed_customer_count}')
+        return job_processed_customer_count
+
+    def _dispatch_retry(self, mailout: Mailout) -> None:
+        """Process the deferred mailout again once the circuit breaker may let requests through."""
+        if self._dispatch is None:
+            return
+        self._dispatch(mailout.id, select_queue(retry=True), countdown=settings.sender_breaker_reset_timeout)
+        logger.info(f'Job {mailout.id} is dispatched to be retried in {settings.sender_breaker_reset_timeout} s')
+
+    async def _save_checkpoint(self, mailout: Mailout, dispatched_chunks: list[tuple[int, set]]) -> None:
+        """Move the mailout's checkpoint past the leading chunks whose messages are all processed.
+
+        The checkpoint stays where it is until the statuses of these messages are written back.
+        """
+        processed_chunks = 0
+        while processed_chunks < len(dispatched_chunks) and all(
+            task.done() for task in dispatched_chunks[processed_chunks][1]
+        ):
+            processed_chunks += 1
+        if not processed_chunks:
+            return
+
+        if not await self._status_buffer.flush():
+            logger.error(f'Job {mailout.id} checkpoint is not saved, statuses of its messages are not written back')
+            return
+        last_customer_id, _ = dispatched_chunks[processed_chunks - 1]
+        del dispatched_chunks[:processed_chunks]
+        if not await self._write_checkpoint(mailout=mailout, last_customer_id=last_customer_id):
+            logger.info(f'Job {mailout.id} checkpoint is not saved, its audience snapshot has been reset')
+            return
+        mailout.last_customer_id = last_customer_id
+
+    async def _write_checkpoint(self, mailout: Mailout, last_customer_id: int) -> bool:
+        async with AsyncSession(async_engine) as async_session:
+            mailout_repository = MailoutRepository(async_session)
+            return await mailout_repository.save_checkpoint(
+                model_id=mailout.id,
+                last_customer_id=last_customer_id,
+                snapshot_at=mailout.audience_snapshot_at,
+            )
+
+    async def _create_pending_messages(self, mailout: Mailout, customers: list[Row]) -> list[tuple[int, Row]]:
+        """Create pending messages for a chunk of the audience with one INSERT, returns (message id, customer) pairs."""
+        customers_by_id = {customer.id: customer for customer in customers}
+        async with AsyncSession(async_engine) as async_session:
+            message_repository = MessageRepository(async_session)
+            messages = await message_repository.bulk_create_pending(
+                mailout_id=mailout.id,
+                customer_ids=list(customers_by_id),
             )
+
+        logger.info(f'Job {mailout.id}, {len(messages)} pending messages created')
+        return [(message_id, customers_by_id[customer_id]) for message_id, customer_id in messages]
+
+    async def _process_customer_mailout_in_flight(
+        self,
+        semaphore: asyncio.Semaphore,
+        breaker_open: asyncio.Event,
+        mailout: Mailout,
+        customer: Row,
+        message_id: int,
+    ) -> None:
+        messages_in_flight.inc()
+        try:
+            await self._process_customer_mailout(mailout=mailout, customer=customer, message_id=message_id)
+        except CircuitBreakerOpenError:
+            logger.info(f'Job: {mailout.id}, customer: {customer.id}, message is left pending, circuit breaker is open')
+            breaker_open.set()
+        except Exception as err:
+            logger.error(f'Job: {mailout.id}, customer: {customer.id}, processing resulted in an error: {str(err)}')
+        finally:
+            messages_in_flight.dec()
+            semaphore.release()
+
+    async def _process_customer_mailout(self, mailout: Mailout, customer: Row, message_id: int) -> None:
+        logger.info(f'Job: {mailout.id}, customer: {customer.id}, processing message: {message_id}')
+        client_msg = MailoutMessage(id=message_id, phone=customer.msisdn, text=mailout.text_message)
+
+        if await self._send_message(mailout=mailout, client_msg=client_msg):
+            await self._status_buffer.add(message_id, StatusEnum.sent)
+            messages_total_sent.inc()
+        else:
+            await self._status_buffer.add(message_id, StatusEnum.failed)
             messages_total_failed.inc()
+
+    async def _send_message(self, mailout: Mailout, client_msg: MailoutMessage) -> bool:
+        msg_id = client_msg.id
+        rate_limit = RateLimit(key=_rate_limit_key(mailout.id), rate=mailout.max_rate) if mailout.max_rate else None
+        for current_try_number in range(self._retry_policy.max_tries):
+            logger.info(f'Trying to send message {msg_id} for a try No. {current_try_number + 1}')
+            status, _ = await self._fbrq_client.send_mailout(client_msg, rate_limit=rate_limit)
+            if status == 200:
+                logger.info(f'Message {msg_id} successfully sent on a try No. {current_try_number + 1}')
+                return True
+
+            if not self._retry_policy.is_retryable(status):
+                logger.info(f'Message {msg_id} was rejected with status {status}, it will not be retried')
+                break
+            if current_try_number + 1 == self._retry_policy.max_tries:
+                break
+            if not await self._retry_policy.wait(current_try_number, deadline=mailout.finish_at):
+                logger.info(f'Message {msg_id} can not be retried before job {mailout.id} expires')
+                break
+
+        logger.info(f'Failed to send message {msg_id} after {current_try_number + 1} tries')
+        return False
+
+
+def _rate_limit_key(mailout_id: int) -> str:
+    return f'mailout:{mailout_id}'
+
+
+def _next_window_opening(available_start_at: time, utc_offset: timedelta, now: datetime) -> datetime:
+    """UTC time after `now` when the local time of the UTC offset reaches `available_start_at`."""
+    local_now = now + utc_offset
+    opening = datetime.combine(local_now.date(), available_start_at)
+    if opening <= local_now:
+        opening += timedelta(days=1)
+    return opening - utc_offset
@@ -1,4 +1,4 @@
-from prometheus_client import Counter, Info
+from prometheus_client import Counter, Gauge, Info
 
 info = Info(name='mailing_service_metrics', documentation='')
 info.info({'version': '1.0', 'language': 'python', 'framework': 'fastapi'})
@@ -22,3 +22,28 @@ messages_total_failed = Counter(
     name='messages_total_failed',
     documentation='Total number of messages failed (after a number of retries) per mailout id',
 )
+
+circuit_breaker_state = Gauge(
+    name='circuit_breaker_state',
+    documentation='State of the external API circuit breaker: 0 - closed, 1 - open, 2 - half-open',
+    labelnames=['breaker'],
+    multiprocess_mode='livemax',
+)
+
+circuit_breaker_transitions = Counter(
+    name='circuit_breaker_transitions',
+    documentation='Total number of external API circuit breaker state transitions',
+    labelnames=['breaker', 'from_state', 'to_state'],
+)
+
+messages_in_flight = Gauge(
+    name='messages_in_flight',
+    documentation='Number of messages currently being sent to the external API',
+    multiprocess_mode='livesum',
+)
+
+mailout_send_concurrency = Gauge(
+    name='mailout_send_concurrency',
+    documentation='Maximum number of messages in flight for the mailout being processed',
+    multiprocess_mode='livemax',
+)
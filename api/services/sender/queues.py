@@ -0,0 +1,34 @@
+from enum import Enum
+
+from db.config import settings
+
+
+class SenderQueue(str, Enum):
+    interactive = 'interactive'
+    scheduled = 'scheduled'
+    bulk_send = 'bulk-send'
+    retry = 'retry'
+
+
+# Lower is taken first by a worker consuming several queues.
+QUEUE_PRIORITIES = {
+    SenderQueue.interactive: 0,
+    SenderQueue.scheduled: 3,
+    SenderQueue.retry: 6,
+    SenderQueue.bulk_send: 9,
+}
+
+
+def select_queue(audience_size: int | None = None, manual: bool = False, retry: bool = False) -> SenderQueue:
+    """Queue a mailout is processed from.
+
+    Manual starts go first, then scheduled mailouts, then deferred ones. Large scheduled
+    mailouts are kept apart, so they do not hold up small ones.
+    """
+    if manual:
+        return SenderQueue.interactive
+    if retry:
+        return SenderQueue.retry
+    if audience_size is not None and audience_size >= settings.sender_bulk_threshold:
+        return SenderQueue.bulk_send
+    return SenderQueue.scheduled
@@ -0,0 +1,118 @@
+from dataclasses import dataclass
+import asyncio
+import time
+
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from db.config import settings
+from utils.logging import logger
+
+# Takes up to ARGV[1] tokens from every bucket in KEYS at once, so a global limit and
+# a per-mailout sub-limit are always charged together. Each bucket is a hash
+# (tokens, ts) refilled by rate ARGV[2 + 2i] up to capacity ARGV[3 + 2i].
+# Returns the number of granted tokens and, if none, milliseconds until the next one.
+ACQUIRE_SCRIPT = '''
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local requested = tonumber(ARGV[1])
+local granted = requested
+local wait = 0
+local buckets = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i]) / 1000
+    local capacity = tonumber(ARGV[2 * i + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    buckets[i] = {key, tokens, rate, capacity}
+    granted = math.min(granted, math.floor(tokens))
+    if tokens < 1 then
+        wait = math.max(wait, math.ceil((1 - tokens) / rate))
+    end
+end
+for i, bucket in ipairs(buckets) do
+    redis.call('HSET', bucket[1], 'tokens', bucket[2] - granted, 'ts', now)
+    redis.call('PEXPIRE', bucket[1], math.ceil(bucket[4] / bucket[3]) + 1000)
+end
+return {granted, wait}
+'''
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    key: str
+    rate: float
+    burst: float | None = None
+
+    @property
+    def capacity(self) -> float:
+        return max(self.burst or self.rate, 1)
+
+
+class RateLimiter:
+    """Cluster-wide token bucket limiter kept in Redis.
+
+    Tokens are taken in batches and handed out locally, so a busy worker pays one
+    Redis round trip per batch rather than per message. Unused tokens of a batch
+    are dropped after a second to keep bursts bounded.
+    If Redis is unreachable, requests are let through.
+    """
+
+    reservation_ttl: float = 1
+
+    def __init__(
+        self,
+        redis: aioredis.Redis,
+        rate: float = settings.sender_rate_limit,
+        burst: float | None = settings.sender_rate_burst,
+        batch_size: int = settings.sender_rate_batch,
+    ):
+        self._redis = redis
+        self._global_limit = RateLimit(key='send_api', rate=rate, burst=burst) if rate else None
+        self._batch_size = max(batch_size, 1)
+        self._reserved: dict[tuple, tuple[int, float]] = {}
+        self._locks: dict[tuple, asyncio.Lock] = {}
+        self._acquire_script = redis.register_script(ACQUIRE_SCRIPT)
+
+    async def acquire(self, sub_limit: RateLimit | None = None) -> None:
+        """Wait until a token is available in the global bucket and in the optional sub-limit bucket."""
+        limits = tuple(limit for limit in (self._global_limit, sub_limit) if limit)
+        if not limits:
+            return
+
+        lock = self._locks.setdefault(limits, asyncio.Lock())
+        async with lock:
+            while True:
+                reserved, reserved_at = self._reserved.get(limits, (0, 0.0))
+                if reserved and time.monotonic() - reserved_at < self.reservation_ttl:
+                    self._reserved[limits] = (reserved - 1, reserved_at)
+                    return
+
+                try:
+                    granted, wait = await self._acquire_script(
+                        keys=[f'rate_limit:{limit.key}' for limit in limits],
+                        args=[self._batch_size, *[
+                            value for limit in limits for value in (limit.rate, limit.capacity)
+                        ]],
+                    )
+                except RedisError as err:
+                    logger.error(f'Rate limiter state is unavailable: {str(err)}')
+                    return
+
+                if granted:
+                    self._reserved[limits] = (granted - 1, time.monotonic())
+                    return
+                await asyncio.sleep(wait / 1000)
+
+    def release(self, key: str) -> None:
+        """Drop the local batches and locks of the sub-limit `key` once nothing waits on them.
+
+        Called when the mailout the sub-limit belongs to is finished, so the limiter does not keep
+        an entry for every mailout a worker has ever sent.
+        """
+        for limits in [limits for limits in self._locks if any(limit.key == key for limit in limits)]:
+            if not self._locks[limits].locked():
+                del self._locks[limits]
+                self._reserved.pop(limits, None)
@@ -0,0 +1,34 @@
+from dataclasses import dataclass
+from datetime import datetime
+import asyncio
+import random
+
+from db.config import settings
+
+RETRYABLE_STATUSES = frozenset({408, 425, 429})
+
+
+@dataclass
+class RetryPolicy:
+    max_tries: int = settings.sender_max_tries
+    base_delay: float = settings.sender_retry_base_delay
+    max_delay: float = settings.sender_retry_max_delay
+
+    def is_retryable(self, status: int) -> bool:
+        """Server errors, timeouts and throttling are retried, other client errors are final."""
+        return status >= 500 or status in RETRYABLE_STATUSES
+
+    def backoff(self, try_number: int) -> float:
+        """Exponential backoff with full jitter for the given (zero-based) try number."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** try_number))
+
+    async def wait(self, try_number: int, deadline: datetime) -> bool:
+        """Sleep before the next try without blocking the event loop.
+
+        Returns False without sleeping if the next try would start after the deadline.
+        """
+        delay = self.backoff(try_number)
+        if delay >= (deadline - datetime.utcnow()).total_seconds():
+            return False
+        await asyncio.sleep(delay)
+        return True
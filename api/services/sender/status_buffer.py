@@ -0,0 +1,100 @@
+import asyncio
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from db.config import settings
+from db.sessions import async_engine
+from repositories.messages import MessageRepository
+from utils.logging import logger
+
+
+class MessageStatusBuffer:
+    """Collects message status transitions and writes them back to the DB in batches.
+
+    The buffer is flushed with one UPDATE once it holds `flush_size` statuses or
+    `flush_interval` seconds after the first buffered status, whichever comes first.
+    Statuses of a failed write stay in the buffer and are written again `flush_interval` seconds later.
+    """
+
+    def __init__(
+        self,
+        flush_size: int = settings.sender_status_flush_size,
+        flush_interval: float = settings.sender_status_flush_interval,
+    ):
+        self._flush_size = max(flush_size, 1)
+        self._flush_interval = flush_interval
+        self._statuses: dict[int, str] = {}
+        self._lock = asyncio.Lock()
+        self._timer: asyncio.TimerHandle | None = None
+        self._background_flushes = set()
+        self._write_failed = False
+
+    def __len__(self) -> int:
+        return len(self._statuses)
+
+    async def add(self, message_id: int, status: str) -> None:
+        self._statuses[message_id] = status
+        # after a failed write the statuses are retried by the timer, not on every added status
+        if len(self._statuses) >= self._flush_size and not self._write_failed:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._flush_interval, self._flush_in_background)
+
+    def _flush_in_background(self) -> None:
+        self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._background_flushes.add(task)
+        task.add_done_callback(self._background_flushes.discard)
+
+    async def flush(self) -> bool:
+        """Write back the buffered statuses, after the writes that are already in progress.
+
+        Returns False if the write failed, the statuses are then kept in the buffer for the next flush.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        async with self._lock:
+            if not self._statuses:
+                return True
+            statuses, self._statuses = self._statuses, {}
+            try:
+                await self._write(statuses)
+            except Exception as err:
+                # statuses added during the write are newer
+                self._statuses = statuses | self._statuses
+                self._write_failed = True
+                logger.error(f'Writing back statuses of {len(statuses)} messages resulted in an error: {str(err)}')
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(
+                        self._flush_interval, self._flush_in_background,
+                    )
+                return False
+
+        self._write_failed = False
+        logger.info(f'Statuses of {len(statuses)} messages are written back')
+        return True
+
+    async def close(self) -> None:
+        await asyncio.gather(*self._background_flushes)
+        if not await self.flush():
+            logger.error(f'Statuses of {len(self._statuses)} messages are not written back')
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def _write(self, statuses: dict[int, str]) -> None:
+        async with AsyncSession(async_engine) as async_session:
+            await MessageRepository(async_session).bulk_update_status(statuses)
+
+
+_status_buffer: MessageStatusBuffer | None = None
+
+
+def get_status_buffer() -> MessageStatusBuffer:
+    """Process-wide buffer, so results of all tasks of a worker are written back together."""
+    global _status_buffer
+    if _status_buffer is None:
+        _status_buffer = MessageStatusBuffer()
+    return _status_buffer
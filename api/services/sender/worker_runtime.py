@@ -0,0 +1,77 @@
+import asyncio
+from typing import Any, Coroutine
+
+from sqlalchemy import text
+
+from db.config import settings
+from db.sessions import async_engine, async_redis
+from services.sender.client import get_client
+from services.sender.status_buffer import get_status_buffer
+from utils.logging import logger
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Event loop of the worker process, every task runs on it so pooled connections stay usable."""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+
+def run(coroutine: Coroutine) -> Any:
+    return get_loop().run_until_complete(coroutine)
+
+
+def start() -> None:
+    """Open the DB and send API connection pools of the worker process."""
+    run(_start())
+
+
+def stop() -> None:
+    """Write back buffered statuses, close every pool and then the event loop."""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        return
+    run(_stop())
+    _loop.run_until_complete(_loop.shutdown_asyncgens())
+    _loop.close()
+    _loop = None
+
+
+async def _start() -> None:
+    await asyncio.gather(_warm_up_db_pool(), get_client().start())
+
+
+async def _stop() -> None:
+    await get_status_buffer().close()
+    await get_client().close()
+    await async_redis.close()
+    await async_redis.connection_pool.disconnect()
+    await async_engine.dispose()
+    logger.info('Sender worker resources are closed')
+
+
+async def _warm_up_db_pool() -> None:
+    # Connections are opened at once, so the pool keeps them all after they are returned.
+    results = await asyncio.gather(
+        *(_check_db_connection() for _ in range(min(settings.db_pool_warmup, settings.db_pool_size))),
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        logger.error(f'Warming up DB connection pool resulted in an error: {str(errors[0])}')
+    else:
+        logger.info(f'DB connection pool is warmed up with {len(results)} connections')
+
+
+async def _check_db_connection() -> None:
+    async with async_engine.connect() as connection:
+        await connection.execute(text('SELECT 1'))
@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from typing import AsyncGenerator, Callable, Generator
 
 import asyncio
@@ -5,6 +6,7 @@ import pytest
 import pytest_asyncio
 from fastapi import FastAPI, Request
 from httpx import AsyncClient
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import SQLModel
@@ -45,6 +47,40 @@ async def db_session() -> AsyncSession:
             await session.rollback()
 
 
+@pytest.fixture()
+def count_queries() -> Callable:
+    """`with count_queries() as statements:` collects the SQL statements run inside the block."""
+    @contextmanager
+    def _count_queries():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+
+    return _count_queries
+
+
+@pytest.fixture()
+def unreachable_broker(monkeypatch):
+    from celery import Celery
+    from services.sender.celery_app import celery_app
+
+    # a separate app, so the connection pool of the shared one is not bound to the unreachable broker
+    monkeypatch.delenv('CELERY_BROKER_URL', raising=False)
+    app = Celery(broker='redis://127.0.0.1:1/0', backend='redis://127.0.0.1:1/0')
+    app.conf.update(
+        broker_transport_options=celery_app.conf.broker_transport_options,
+        broker_connection_timeout=celery_app.conf.broker_connection_timeout,
+    )
+    monkeypatch.setattr('services.sender.celery_app.celery_app', app)
+
+
 @pytest.fixture()
 def override_get_db(db_session: AsyncSession) -> Callable:
     async def _override_get_db():
@@ -2,7 +2,7 @@ import random
 
 import pytest
 
-from db.errors import EntityDoesNotExist
+from db.errors import EntityAlreadyExists, EntityDoesNotExist
 from repositories.phone_codes import PhoneCodeRepository
 from repositories.timezones import TimezoneRepository
 from repositories.tags import TagRepository
@@ -13,7 +13,7 @@ from schemas.tags import TagCreate
 from schemas.customers import Customer, CustomerCreate, CustomerUpdate
 
 
-async def create_customer(db_session):
+async def create_customer(db_session, phone: str = '9999999'):
     phone_code_repo = PhoneCodeRepository(db_session)
     timezone_repo = TimezoneRepository(db_session)
     tag_repo = TagRepository(db_session)
@@ -25,7 +25,7 @@ async def create_customer(db_session):
     customer = CustomerCreate(
         country_code=7,
         phone_code_id=db_phone_code.id,
-        phone='9999999',
+        phone=phone,
         timezone_id=db_timezone.id,
     )
 
@@ -105,6 +105,15 @@ async def test_update_customer(db_session):
     assert update_customer.timezone_id == new_timezone_id
 
 
+@pytest.mark.asyncio
+async def test_update_customer_to_existing_phone(db_session):
+    repository, customer, _ = await create_customer(db_session)
+    other_customer = await repository.create(CustomerCreate(**{**customer.dict(), 'phone': '1111111'}))
+
+    with pytest.raises(expected_exception=EntityAlreadyExists):
+        await repository.update(model_id=other_customer.id, model_update=CustomerUpdate(**customer.dict()))
+
+
 @pytest.mark.asyncio
 async def test_delete_customer(db_session):
     repository, _, db_customer = await create_customer(db_session)
@@ -123,3 +132,26 @@ async def test_delete_customer_tag(db_session):
     repository.delete_customer_tag(model_id=1, tag_id=1)
 
     assert len(db_customer.tags) == 1
+
+
+async def create_audience_customer(db_session, phone_code: str, phone: str, tags: list[str]):
+    phone_code_repo = PhoneCodeRepository(db_session)
+    timezone_repo = TimezoneRepository(db_session)
+    tag_repo = TagRepository(db_session)
+    customer_repo = CustomerRepository(db_session)
+
+    db_phone_code = await phone_code_repo.create(PhoneCodeCreate(phone_code=phone_code))
+    db_timezone = await timezone_repo.create(TimezoneCreate(timezone='Europe/Belgrade'))
+    db_customer = await customer_repo.create(
+        CustomerCreate(
+            country_code=7,
+            phone_code_id=db_phone_code.id,
+            phone=phone,
+            timezone_id=db_timezone.id,
+        )
+    )
+    db_tags = [
+        await tag_repo.create(model_id=db_customer.id, tag_create=TagCreate(tag=tag), parent_model=Customer)
+        for tag in tags
+    ]
+    return db_customer, db_phone_code, db_tags
@@ -0,0 +1,226 @@
+from datetime import datetime
+
+import pytest
+from sqlmodel import select
+
+from repositories.customers import CustomerRepository
+from repositories.mailout_audience import MailoutAudienceRepository
+from repositories.mailouts import MailoutRepository
+from repositories.messages import MessageRepository
+from repositories.phone_codes import PhoneCodeRepository
+from schemas.base import StatusEnum
+from schemas.customers import Customer
+from schemas.mailout_audience import MailoutAudience
+from schemas.mailouts import Mailout
+from schemas.phone_codes import PhoneCodeCreate
+from tests.test_repositories.test_customers import create_audience_customer
+from tests.test_repositories.test_mailouts import create_mailout
+
+
+async def create_snapshot(db_session):
+    _, _, db_mailout = await create_mailout(db_session)
+    first, phone_code, (tag,) = await create_audience_customer(db_session, '980', '1111111', ['Audience'])
+    second, _, _ = await create_audience_customer(db_session, '980', '2222222', ['Audience'])
+    await create_audience_customer(db_session, '980', '3333333', ['Other'])
+
+    repository = MailoutAudienceRepository(db_session)
+    added = await repository.create_snapshot(mailout_id=db_mailout.id, tag_ids=[tag.id])
+
+    return repository, db_mailout, added, [first, second], tag
+
+
+@pytest.mark.asyncio
+async def test_create_snapshot(db_session):
+    repository, db_mailout, added, (first, second), _ = await create_snapshot(db_session)
+    await db_session.refresh(db_mailout)
+
+    pending = await repository.select_pending(mailout_id=db_mailout.id)
+
+    assert added == 2
+    assert db_mailout.audience_snapshot_at is not None
+    assert [tuple(row) for row in pending] == [(first.id, '79801111111'), (second.id, '79802222222')]
+
+
+@pytest.mark.asyncio
+async def test_create_snapshot_again_keeps_statuses(db_session):
+    repository, db_mailout, _, (first, second), tag = await create_snapshot(db_session)
+    message_repository = MessageRepository(db_session)
+    [(message_id, _)] = await message_repository.bulk_create_pending(
+        mailout_id=db_mailout.id,
+        customer_ids=[first.id],
+    )
+    await message_repository.bulk_update_status({message_id: StatusEnum.sent})
+
+    added = await repository.create_snapshot(mailout_id=db_mailout.id, tag_ids=[tag.id])
+    pending = await repository.select_pending(mailout_id=db_mailout.id)
+
+    assert added == 0
+    assert [row.id for row in pending] == [second.id]
+
+
+@pytest.mark.asyncio
+async def test_select_pending_by_chunks(db_session):
+    repository, db_mailout, _, (first, second), _ = await create_snapshot(db_session)
+
+    first_chunk = await repository.select_pending(mailout_id=db_mailout.id, limit=1)
+    second_chunk = await repository.select_pending(
+        mailout_id=db_mailout.id,
+        after_customer_id=first_chunk[-1].id,
+        limit=1,
+    )
+
+    assert [row.id for row in first_chunk] == [first.id]
+    assert [row.id for row in second_chunk] == [second.id]
+
+
+@pytest.mark.asyncio
+async def test_get_audience_stats(db_session):
+    repository, db_mailout, _, (first, _), _ = await create_snapshot(db_session)
+    message_repository = MessageRepository(db_session)
+    [(message_id, _)] = await message_repository.bulk_create_pending(
+        mailout_id=db_mailout.id,
+        customer_ids=[first.id],
+    )
+    await message_repository.bulk_update_status({message_id: StatusEnum.failed})
+
+    stats = await repository.get_stats(mailout_id=db_mailout.id)
+
+    assert sorted(tuple(row) for row in stats) == [(StatusEnum.failed, 1), (StatusEnum.pending, 1)]
+
+
+async def send_to(db_session, mailout_id: int, customer_id: int) -> None:
+    message_repository = MessageRepository(db_session)
+    [(message_id, _)] = await message_repository.bulk_create_pending(mailout_id=mailout_id, customer_ids=[customer_id])
+    await message_repository.bulk_update_status({message_id: StatusEnum.sent})
+
+
+async def select_snapshot(db_session) -> list[tuple]:
+    results = await db_session.execute(
+        select(MailoutAudience.customer_id, MailoutAudience.status).order_by(MailoutAudience.customer_id)
+    )
+    return [tuple(row) for row in results.all()]
+
+
+@pytest.mark.asyncio
+async def test_create_snapshot_by_phone_codes(db_session):
+    _, _, db_mailout = await create_mailout(db_session)
+    first, phone_code_980, (tag,) = await create_audience_customer(db_session, '980', '1111111', ['Audience'])
+    await create_audience_customer(db_session, '950', '2222222', ['Audience'])
+
+    added = await MailoutAudienceRepository(db_session).create_snapshot(
+        mailout_id=db_mailout.id,
+        tag_ids=[tag.id],
+        phone_code_ids=[phone_code_980.id],
+    )
+
+    assert added == 1
+    assert await select_snapshot(db_session) == [(first.id, StatusEnum.pending)]
+
+
+@pytest.mark.asyncio
+async def test_delete_customer_in_snapshot(db_session):
+    repository, db_mailout, _, (first, second), _ = await create_snapshot(db_session)
+
+    await CustomerRepository(db_session).delete(model=Customer, model_id=first.id)
+
+    assert await select_snapshot(db_session) == [(second.id, StatusEnum.pending)]
+
+
+@pytest.mark.asyncio
+async def test_delete_mailout_with_snapshot(db_session):
+    repository, db_mailout, _, _, _ = await create_snapshot(db_session)
+
+    await MailoutRepository(db_session).delete(model=Mailout, model_id=db_mailout.id)
+
+    assert await select_snapshot(db_session) == []
+
+
+@pytest.mark.asyncio
+async def test_delete_mailout_tag_resets_snapshot(db_session):
+    repository, db_mailout, _, (first, second), _ = await create_snapshot(db_session)
+    await send_to(db_session, db_mailout.id, first.id)
+    db_mailout.last_customer_id = first.id
+    await db_session.commit()
+
+    result = await MailoutRepository(db_session).delete_mailout_tag(model_id=db_mailout.id, tag_id=db_mailout.tags[0].id)
+
+    assert result.audience_snapshot_at is None
+    assert result.last_customer_id is None
+    assert await select_snapshot(db_session) == [(first.id, StatusEnum.sent)]
+
+
+@pytest.mark.asyncio
+async def test_delete_mailout_phone_code_resets_snapshot(db_session):
+    repository, db_mailout, _, (first, second), _ = await create_snapshot(db_session)
+
+    result = await MailoutRepository(db_session).delete_mailout_phone_code(
+        model_id=db_mailout.id,
+        phone_code_id=db_mailout.phone_codes[0].id,
+    )
+
+    assert result.audience_snapshot_at is None
+    assert await select_snapshot(db_session) == []
+
+
+@pytest.mark.asyncio
+async def test_add_mailout_phone_code_resets_snapshot(db_session):
+    repository, db_mailout, _, _, _ = await create_snapshot(db_session)
+
+    await PhoneCodeRepository(db_session).create(
+        model_create=PhoneCodeCreate(phone_code='777'),
+        parent_model=Mailout,
+        model_id=db_mailout.id,
+    )
+    await db_session.refresh(db_mailout)
+
+    assert db_mailout.audience_snapshot_at is None
+    assert await select_snapshot(db_session) == []
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_of_run_is_saved_for_its_snapshot(db_session):
+    _, _, db_mailout = await create_mailout(db_session)
+    first, _, (tag,) = await create_audience_customer(db_session, '980', '1111111', ['Audience'])
+    snapshot_at = datetime.utcnow()
+    await MailoutAudienceRepository(db_session).create_snapshot(
+        mailout_id=db_mailout.id,
+        tag_ids=[tag.id],
+        snapshot_at=snapshot_at,
+    )
+
+    saved = await MailoutRepository(db_session).save_checkpoint(
+        model_id=db_mailout.id,
+        last_customer_id=first.id,
+        snapshot_at=snapshot_at,
+    )
+    await db_session.refresh(db_mailout)
+
+    assert saved
+    assert db_mailout.audience_snapshot_at == snapshot_at
+    assert db_mailout.last_customer_id == first.id
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_of_run_is_not_saved_after_snapshot_reset(db_session):
+    _, _, db_mailout = await create_mailout(db_session)
+    first, _, (tag,) = await create_audience_customer(db_session, '980', '1111111', ['Audience'])
+    snapshot_at = datetime.utcnow()
+    await MailoutAudienceRepository(db_session).create_snapshot(
+        mailout_id=db_mailout.id,
+        tag_ids=[tag.id],
+        snapshot_at=snapshot_at,
+    )
+
+    # the audience changes while the run started from the snapshot is still sending
+    await MailoutAudienceRepository(db_session).reset_snapshot(db_mailout.id)
+    await db_session.commit()
+    saved = await MailoutRepository(db_session).save_checkpoint(
+        model_id=db_mailout.id,
+        last_customer_id=first.id,
+        snapshot_at=snapshot_at,
+    )
+    await db_session.refresh(db_mailout)
+
+    assert not saved
+    assert db_mailout.audience_snapshot_at is None
+    assert db_mailout.last_customer_id is None
@@ -1,8 +1,12 @@
-from datetime import datetime, time
+import asyncio
+from datetime import datetime, time, timedelta
+from types import SimpleNamespace
 import random
 
 import pytest
+from sqlalchemy import text
 
+from db.config import settings
 from db.errors import EntityDoesNotExist, WrongDatetimeError
 from repositories.phone_codes import PhoneCodeRepository
 from repositories.tags import TagRepository
@@ -10,6 +14,9 @@ from repositories.mailouts import MailoutRepository
 from schemas.phone_codes import PhoneCodeCreate
 from schemas.tags import TagCreate
 from schemas.mailouts import Mailout, MailoutCreate, MailoutUpdate
+from services.audience_index import audience_index
+from services.sender.queues import SenderQueue
+from tests.test_repositories.test_customers import create_audience_customer
 
 
 def get_right_mailout_create():
@@ -132,6 +139,32 @@ async def test_update_mailout(db_session):
     assert update_mailout.text_message == new_text_message
 
 
+@pytest.mark.asyncio
+async def test_save_mailout_checkpoint(db_session):
+    repository, _, db_mailout = await create_mailout(db_session)
+
+    saved = await repository.save_checkpoint(model_id=db_mailout.id, last_customer_id=42, snapshot_at=None)
+    await db_session.refresh(db_mailout)
+
+    assert saved
+    assert db_mailout.last_customer_id == 42
+
+
+@pytest.mark.asyncio
+async def test_mailout_checkpoint_reset_by_new_tag(db_session):
+    repository, _, db_mailout = await create_mailout(db_session)
+    await repository.save_checkpoint(model_id=db_mailout.id, last_customer_id=42, snapshot_at=None)
+
+    await TagRepository(db_session).create(
+        model_id=db_mailout.id,
+        tag_create=TagCreate(tag='New'),
+        parent_model=Mailout,
+    )
+    await db_session.refresh(db_mailout)
+
+    assert db_mailout.last_customer_id is None
+
+
 @pytest.mark.asyncio
 async def test_delete_mailout(db_session):
     repository, _, db_mailout = await create_mailout(db_session)
@@ -159,3 +192,229 @@ async def test_delete_mailout_phone_code(db_session):
     repository.delete_mailout_phone_code(model_id=1, phone_code_id=1)
 
     assert len(db_mailout.phone_codes) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_audience_estimate_from_index(db_session):
+    first, _, _ = await create_audience_customer(db_session, '888', '1111111', ['Test'])
+    second, _, _ = await create_audience_customer(db_session, '888', '2222222', ['Test', 'VIP'])
+    await create_audience_customer(db_session, '950', '3333333', ['Test'])
+    repository, _, db_mailout = await create_mailout(db_session)
+    await audience_index.build(db_session)
+
+    try:
+        estimate = await repository.get_audience_estimate(model_id=db_mailout.id, sample_size=1)
+    finally:
+        audience_index.reset()
+
+    assert estimate.exact is True
+    assert estimate.count == 2
+    assert estimate.phone_codes == {'888': 2}
+    assert estimate.timezones == {'Europe/Belgrade': 2}
+    assert estimate.sample_customer_ids == [first.id]
+
+
+@pytest.mark.asyncio
+async def test_get_audience_estimate_from_stale_index(db_session, monkeypatch):
+    await create_audience_customer(db_session, '888', '1111111', ['Test'])
+    repository, _, db_mailout = await create_mailout(db_session)
+    await audience_index.build(db_session)
+    rebuilds = []
+    monkeypatch.setattr(audience_index, 'rebuild_in_background', lambda: rebuilds.append(True))
+
+    async def changed_version(session):
+        return audience_index._version + 1
+
+    # as if customers were changed by another process
+    monkeypatch.setattr(audience_index, '_read_version', changed_version)
+    try:
+        estimate = await repository.get_audience_estimate(model_id=db_mailout.id)
+    finally:
+        audience_index.reset()
+
+    assert estimate.exact is False
+    assert rebuilds == [True]
+
+
+@pytest.mark.asyncio
+async def test_get_audience_estimate_from_planner(db_session):
+    await create_audience_customer(db_session, '888', '1111111', ['Test'])
+    await create_audience_customer(db_session, '888', '2222222', ['Test'])
+    mailout = get_right_mailout_create()
+    mailout.max_rate = 10
+    repository, _, db_mailout = await create_mailout(db_session, mailout)
+    await db_session.execute(text('ANALYZE customers'))
+
+    estimate = await repository.get_audience_estimate(model_id=db_mailout.id, sample_size=1)
+
+    assert estimate.exact is False
+    assert estimate.count >= 0
+    assert set(estimate.phone_codes) == {'888'}
+    assert set(estimate.timezones) == {'Europe/Belgrade'}
+    assert len(estimate.sample_customer_ids) == 1
+    assert estimate.send_rate == 10
+    assert estimate.finishes_in_time is False
+
+
+@pytest.mark.asyncio
+async def test_get_audience_estimate_from_planner_without_phone_codes(db_session):
+    await create_audience_customer(db_session, '888', '1111111', ['Test'])
+    await create_audience_customer(db_session, '888', '2222222', ['Test'])
+    await create_audience_customer(db_session, '950', '3333333', ['Test'])
+    repository = MailoutRepository(db_session)
+    db_mailout = await repository.create(get_right_mailout_create())
+    await TagRepository(db_session).create(model_id=db_mailout.id, tag_create=TagCreate(tag='Test'), parent_model=Mailout)
+    await db_session.execute(text('ANALYZE customers'))
+
+    estimate = await repository.get_audience_estimate(model_id=db_mailout.id)
+
+    assert estimate.exact is False
+    assert set(estimate.phone_codes) == {'888', '950'}
+    assert estimate.phone_codes['888'] >= estimate.phone_codes['950']
+    assert abs(sum(estimate.phone_codes.values()) - estimate.count) <= 1
+    assert abs(sum(estimate.timezones.values()) - estimate.count) <= 1
+    assert estimate.send_rate == settings.sender_concurrency / settings.sender_expected_latency
+    assert estimate.projected_finish_at is not None
+
+
+@pytest.mark.asyncio
+async def test_get_audience_estimate_of_missing_mailout(db_session):
+    with pytest.raises(expected_exception=EntityDoesNotExist):
+        await MailoutRepository(db_session).get_audience_estimate(model_id=1)
+
+
+@pytest.fixture()
+def start_tasks(monkeypatch):
+    tasks = SimpleNamespace(scheduled=[], revoked=[], dispatched=[])
+
+    def schedule_mailout_start(mailout_id, start_at, task_id):
+        tasks.scheduled.append((mailout_id, start_at, task_id))
+
+    monkeypatch.setattr('repositories.mailouts.schedule_mailout_start', schedule_mailout_start)
+    monkeypatch.setattr('repositories.mailouts.revoke_mailout_start', tasks.revoked.append)
+    monkeypatch.setattr(
+        'repositories.mailouts.dispatch_mailout',
+        lambda mailout_id, queue: tasks.dispatched.append((mailout_id, queue)),
+    )
+    return tasks
+
+
+@pytest.mark.asyncio
+async def test_mailout_start_is_scheduled(db_session, start_tasks):
+    repository, mailout, db_mailout = await create_mailout(db_session)
+
+    first_task_id = db_mailout.start_task_id
+    assert start_tasks.scheduled == [(db_mailout.id, mailout.start_at, first_task_id)]
+
+    new_start_at = datetime(2023, 7, 12, 12)
+    mailout_update = MailoutUpdate(**mailout.dict(exclude={'start_at'}), start_at=new_start_at)
+    db_mailout = await repository.update(model_id=db_mailout.id, model_update=mailout_update)
+
+    assert start_tasks.revoked == [first_task_id]
+    assert start_tasks.scheduled[-1] == (db_mailout.id, new_start_at, db_mailout.start_task_id)
+    assert db_mailout.start_task_id != first_task_id
+
+    await repository.delete(model=Mailout, model_id=db_mailout.id)
+
+    assert start_tasks.revoked == [first_task_id, db_mailout.start_task_id]
+
+
+@pytest.mark.asyncio
+async def test_mailout_start_is_kept_if_not_moved(db_session, start_tasks):
+    repository, mailout, db_mailout = await create_mailout(db_session)
+    start_task_id = db_mailout.start_task_id
+
+    db_mailout = await repository.update(
+        model_id=db_mailout.id,
+        model_update=MailoutUpdate(**{**mailout.dict(), 'text_message': 'Other message'}),
+    )
+
+    assert db_mailout.start_task_id == start_task_id
+    assert start_tasks.revoked == []
+    assert len(start_tasks.scheduled) == 1
+
+
+@pytest.mark.asyncio
+async def test_mailout_start_is_scheduled_again(db_session, start_tasks):
+    repository, _, db_mailout = await create_mailout(db_session)
+    first_task_id = db_mailout.start_task_id
+    start_at = datetime(2023, 7, 12, 9)
+
+    await repository.schedule_start(model_id=db_mailout.id, start_at=start_at)
+    await db_session.refresh(db_mailout)
+
+    assert db_mailout.start_task_id != first_task_id
+    assert start_tasks.revoked == [first_task_id]
+    assert start_tasks.scheduled[-1] == (db_mailout.id, start_at, db_mailout.start_task_id)
+
+
+@pytest.mark.asyncio
+async def test_mailout_is_started_manually(db_session, start_tasks):
+    repository, _, db_mailout = await create_mailout(db_session)
+
+    result = await repository.start(db_mailout.id)
+
+    assert result.id == db_mailout.id
+    assert start_tasks.dispatched == [(db_mailout.id, SenderQueue.interactive)]
+
+
+@pytest.mark.asyncio
+async def test_start_missing_mailout(db_session, start_tasks):
+    with pytest.raises(expected_exception=EntityDoesNotExist):
+        await MailoutRepository(db_session).start(1)
+
+    assert start_tasks.dispatched == []
+
+
+@pytest.mark.asyncio
+async def test_mailout_is_created_with_unreachable_broker(db_session, unreachable_broker):
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.05)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    try:
+        _now = datetime.utcnow()
+        db_mailout = await MailoutRepository(db_session).create(
+            MailoutCreate(
+                start_at=_now + timedelta(minutes=1),
+                finish_at=_now + timedelta(hours=1),
+                available_start_at=time(0, 0, 0),
+                available_finish_at=time(23, 59, 59),
+                text_message='Test message',
+            )
+        )
+    finally:
+        ticker.cancel()
+
+    assert db_mailout.id is not None
+    # the event loop kept running while the broker was being connected to
+    assert ticks > 0
+
+
+@pytest.mark.asyncio
+async def test_select_mailout_jobs(db_session):
+    _now = datetime.utcnow()
+    due_mailout = MailoutCreate(
+        start_at=_now - timedelta(minutes=1),
+        finish_at=_now + timedelta(hours=1),
+        available_start_at=time(0, 0, 0),
+        available_finish_at=time(23, 59, 59),
+        text_message='Due message',
+    )
+    repository, _, db_mailout = await create_mailout(db_session, due_mailout)
+    await create_mailout(db_session)
+    db_session.expunge_all()
+
+    jobs = await repository.select_mailout_jobs()
+
+    assert [job.id for job in jobs] == [db_mailout.id]
+    assert [tag.id for tag in jobs[0].tags] == [tag.id for tag in db_mailout.tags]
+    assert [phone_code.id for phone_code in jobs[0].phone_codes] == [
+        phone_code.id for phone_code in db_mailout.phone_codes
+    ]
+    assert 'messages' not in jobs[0].__dict__
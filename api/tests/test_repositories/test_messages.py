@@ -2,7 +2,7 @@ import random
 
 import pytest
 
-from db.errors import EntityDoesNotExist
+from db.errors import EntityAlreadyExists, EntityDoesNotExist
 from repositories.messages import MessageRepository
 from schemas.base import StatusEnum
 from schemas.messages import Message, MessageCreate, MessageUpdate
@@ -36,6 +36,70 @@ async def test_create_message(db_session):
     assert db_message.customer_id == message.customer_id
 
 
+@pytest.mark.asyncio
+async def test_bulk_create_pending_messages(db_session):
+    _, _, db_mailout = await create_mailout(db_session)
+    _, _, db_customer = await create_customer(db_session)
+    repository = MessageRepository(db_session)
+
+    messages = await repository.bulk_create_pending(
+        mailout_id=db_mailout.id,
+        customer_ids=[db_customer.id],
+    )
+
+    assert len(messages) == 1
+    message_id, customer_id = messages[0]
+    assert customer_id == db_customer.id
+    db_message = await repository.get(model_id=message_id)
+    assert db_message.created_at is not None
+    assert db_message.status == StatusEnum.pending
+    assert db_message.mailout_id == db_mailout.id
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_pending_messages_skips_attempted_customers(db_session):
+    _, _, db_mailout = await create_mailout(db_session)
+    _, _, db_customer = await create_customer(db_session)
+    repository = MessageRepository(db_session)
+    [(message_id, _)] = await repository.bulk_create_pending(mailout_id=db_mailout.id, customer_ids=[db_customer.id])
+
+    pending_messages = await repository.bulk_create_pending(mailout_id=db_mailout.id, customer_ids=[db_customer.id])
+    await repository.bulk_update_status({message_id: StatusEnum.sent})
+    sent_messages = await repository.bulk_create_pending(mailout_id=db_mailout.id, customer_ids=[db_customer.id])
+
+    assert pending_messages == [(message_id, db_customer.id)]
+    assert sent_messages == []
+    assert (await repository.get(model_id=message_id)).status == StatusEnum.sent
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_pending_messages_empty(db_session):
+    repository = MessageRepository(db_session)
+
+    assert await repository.bulk_create_pending(mailout_id=1, customer_ids=[]) == []
+
+
+@pytest.mark.asyncio
+async def test_bulk_update_message_statuses(db_session):
+    _, _, db_mailout = await create_mailout(db_session)
+    repository = MessageRepository(db_session)
+    customer_ids = []
+    for phone in ('1111111', '2222222', '3333333'):
+        _, _, db_customer = await create_customer(db_session, phone=phone)
+        customer_ids.append(db_customer.id)
+    (sent_id, _), (failed_id, _), (pending_id, _) = await repository.bulk_create_pending(
+        mailout_id=db_mailout.id,
+        customer_ids=customer_ids,
+    )
+
+    updated = await repository.bulk_update_status({sent_id: StatusEnum.sent, failed_id: StatusEnum.failed})
+
+    assert updated == 2
+    assert (await repository.get(model_id=sent_id)).status == StatusEnum.sent
+    assert (await repository.get(model_id=failed_id)).status == StatusEnum.failed
+    assert (await repository.get(model_id=pending_id)).status == StatusEnum.pending
+
+
 @pytest.mark.asyncio
 async def test_get_messages(db_session):
     repository, message, db_message = await create_message(db_session)
@@ -86,6 +150,19 @@ async def test_update_message(db_session):
     assert update_message.customer_id == new_customer_id
 
 
+@pytest.mark.asyncio
+async def test_update_message_to_existing_one(db_session):
+    repository, message, _ = await create_message(db_session)
+    _, _, db_customer = await create_customer(db_session, phone='1111111')
+    other_message = await repository.create(MessageCreate(mailout_id=message.mailout_id, customer_id=db_customer.id))
+
+    with pytest.raises(expected_exception=EntityAlreadyExists):
+        await repository.update(
+            model_id=other_message.id,
+            model_update=MessageUpdate(mailout_id=message.mailout_id, customer_id=message.customer_id),
+        )
+
+
 @pytest.mark.asyncio
 async def test_delete_message(db_session):
     repository, _, db_message = await create_message(db_session)
@@ -1,3 +1,4 @@
+from datetime import datetime, time, timedelta
 import random
 
 import pytest
@@ -79,3 +80,56 @@ async def test_delete_timezone(db_session):
     assert delete_timezone is None
     with pytest.raises(expected_exception=EntityDoesNotExist):
         await repository.get(model_id=db_timezone.id)
+
+
+@pytest.mark.asyncio
+async def test_select_offset_buckets(db_session):
+    repository = TimezoneRepository(db_session)
+    utc = await repository.create(TimezoneCreate(timezone='UTC'))
+    etc_utc = await repository.create(TimezoneCreate(timezone='Etc/UTC'))
+    tokyo = await repository.create(TimezoneCreate(timezone='Asia/Tokyo'))
+    _now = datetime.utcnow()
+    window_start = max(_now - timedelta(minutes=1), _now.replace(hour=0, minute=0, second=0, microsecond=0))
+    window_finish = min(_now + timedelta(minutes=1), _now.replace(hour=23, minute=59, second=59, microsecond=0))
+
+    buckets = await repository.select_offset_buckets(
+        available_start_at=window_start.time(),
+        available_finish_at=window_finish.time(),
+    )
+
+    assert len(buckets) == 2
+    utc_bucket, tokyo_bucket = buckets
+    assert utc_bucket.utc_offset == timedelta(0)
+    assert sorted(utc_bucket.timezone_ids) == sorted([utc.id, etc_utc.id])
+    assert utc_bucket.is_open is True
+    assert tokyo_bucket.utc_offset == timedelta(hours=9)
+    assert tokyo_bucket.timezone_ids == [tokyo.id]
+    assert tokyo_bucket.is_open is False
+
+
+@pytest.mark.asyncio
+async def test_select_offset_buckets_with_unknown_timezone(db_session):
+    repository = TimezoneRepository(db_session)
+    utc = await repository.create(TimezoneCreate(timezone='UTC'))
+    # a timezone the database does not know, the API validates against the Python tz database
+    unknown = Timezone(timezone='Unknown/Timezone')
+    db_session.add(unknown)
+    await db_session.commit()
+
+    buckets = await repository.select_offset_buckets(available_start_at=time.min, available_finish_at=time.max)
+
+    assert len(buckets) == 1
+    assert buckets[0].utc_offset == timedelta(0)
+    assert sorted(buckets[0].timezone_ids) == sorted([utc.id, unknown.id])
+    assert buckets[0].is_open is True
+
+
+@pytest.mark.asyncio
+async def test_select_offset_buckets_whole_day_window(db_session):
+    repository = TimezoneRepository(db_session)
+    await repository.create(TimezoneCreate(timezone='UTC'))
+    await repository.create(TimezoneCreate(timezone='Asia/Tokyo'))
+
+    buckets = await repository.select_offset_buckets(available_start_at=time.min, available_finish_at=time.max)
+
+    assert all(bucket.is_open for bucket in buckets)
@@ -1,3 +1,5 @@
+import gzip
+import json
 import random
 
 import pytest
@@ -152,3 +154,141 @@ async def test_delete_customer_tag(async_client_authenticated):
     )
 
     assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.asyncio
+async def test_get_customer_queries(async_client_authenticated, async_client, count_queries):
+    _, response_create = await create_customer(async_client_authenticated)
+
+    with count_queries() as statements:
+        response = await async_client.get(f"/api/customers/{response_create.json()['id']}")
+
+    assert response.status_code == status.HTTP_200_OK
+    # the customer and its tags, messages are not loaded
+    assert len(statements) == 2
+
+
+@pytest.mark.asyncio
+async def test_update_customer_queries(async_client_authenticated, count_queries):
+    customer, response_create = await create_customer(async_client_authenticated)
+
+    with count_queries() as statements:
+        response = await async_client_authenticated.put(
+            f"/api/customers/{response_create.json()['id']}",
+            json={**customer, 'phone': '1234567'},
+        )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['phone'] == '1234567'
+    # UPDATE ... RETURNING and the customer's tags
+    assert len(statements) == 2
+
+
+@pytest.mark.asyncio
+async def test_update_missing_customer(async_client_authenticated):
+    response = await async_client_authenticated.put(
+        '/api/customers/1',
+        json={'phone': '1234567'},
+    )
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_create_duplicate_customer(async_client_authenticated):
+    customer, _ = await create_customer(async_client_authenticated)
+
+    response = await async_client_authenticated.post('/api/customers/', json=customer)
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+@pytest.mark.asyncio
+async def test_update_customer_to_existing_phone(async_client_authenticated):
+    customer, _ = await create_customer(async_client_authenticated)
+    other_phone = '1111111' if customer['phone'] != '1111111' else '2222222'
+    response_create = await async_client_authenticated.post('/api/customers/', json={**customer, 'phone': other_phone})
+
+    response = await async_client_authenticated.put(
+        f"/api/customers/{response_create.json()['id']}",
+        json=customer,
+    )
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+@pytest.mark.asyncio
+async def test_import_customers(async_client_authenticated):
+    await create_customer(async_client_authenticated)
+
+    response = await async_client_authenticated.post(
+        '/api/customers/import',
+        params={'format': 'ndjson'},
+        content=(
+            b'{"phone_code": "980", "phone": "1111111", "timezone": "Europe/Belgrade", "tags": "VIP;New"}\n'
+            b'{"phone_code": "980", "phone": "12"}\n'
+        ),
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        'rows': 2,
+        'created': 1,
+        'updated': 0,
+        'failed': 1,
+        'errors': [{'row': 2, 'error': 'Phone is not a string of 7 digits'}],
+    }
+    customers = await async_client_authenticated.get('/api/customers/', params={'tag': 'VIP'})
+    assert [customer['phone'] for customer in customers.json()] == ['1111111']
+
+
+async def import_customers(async_client_authenticated):
+    await create_customer(async_client_authenticated)
+    await async_client_authenticated.post(
+        '/api/customers/import',
+        content=(
+            b'phone_code,phone,timezone,tags\n'
+            b'980,1111111,Europe/Belgrade,VIP;New\n'
+            b'980,2222222,,New\n'
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_export_customers_csv(async_client_authenticated):
+    await import_customers(async_client_authenticated)
+
+    response = await async_client_authenticated.get('/api/customers/export', params={'tag': 'New'})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'].startswith('text/csv')
+    assert response.headers['content-disposition'] == 'attachment; filename="customers.csv"'
+    assert response.text.splitlines() == [
+        'id,country_code,phone_code,phone,timezone,tags',
+        '2,7,980,1111111,Europe/Belgrade,New;VIP',
+        '3,7,980,2222222,,New',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_export_customers_ndjson_gzip(async_client_authenticated, monkeypatch):
+    monkeypatch.setattr('services.export.settings.export_batch_size', 1)
+    await import_customers(async_client_authenticated)
+
+    response = await async_client_authenticated.get(
+        '/api/customers/export',
+        params={'format': 'ndjson', 'gzip': True, 'phone_code': '980'},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-disposition'] == 'attachment; filename="customers.ndjson.gz"'
+    rows = [json.loads(line) for line in gzip.decompress(response.content).splitlines()]
+    assert [row['phone'] for row in rows] == [rows[0]['phone'], '1111111', '2222222']
+    assert rows[1] == {
+        'id': 2,
+        'country_code': 7,
+        'phone_code': '980',
+        'phone': '1111111',
+        'timezone': 'Europe/Belgrade',
+        'tags': ['New', 'VIP'],
+    }
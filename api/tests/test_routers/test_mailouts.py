@@ -178,3 +178,43 @@ async def test_delete_mailout_phone_code(async_client_authenticated):
     )
 
     assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.asyncio
+async def test_get_mailout_audience(async_client_authenticated, async_client):
+    _, response_create = await create_mailout(async_client_authenticated)
+
+    response = await async_client.get(
+        f"/api/mailouts/{response_create.json()['id']}/audience"
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['mailout_id'] == response_create.json()['id']
+    assert response.json()['sample_customer_ids'] == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('sample_size', [-1, 101])
+async def test_get_mailout_audience_with_wrong_sample_size(async_client, sample_size):
+    response = await async_client.get('/api/mailouts/1/audience', params={'sample_size': sample_size})
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+async def test_get_missing_mailout_audience(async_client):
+    response = await async_client.get('/api/mailouts/1/audience')
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_get_mailout_queries(async_client_authenticated, async_client, count_queries):
+    _, response_create = await create_mailout(async_client_authenticated)
+
+    with count_queries() as statements:
+        response = await async_client.get(f"/api/mailouts/{response_create.json()['id']}")
+
+    assert response.status_code == status.HTTP_200_OK
+    # the mailout, its tags and its phone codes, messages are not loaded
+    assert len(statements) == 3
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 from fastapi import status
 
@@ -96,6 +98,27 @@ async def test_update_message(async_client_authenticated):
     assert response.json()['id'] == response_create.json()['id']
 
 
+@pytest.mark.asyncio
+async def test_create_message_already_exists(async_client_authenticated):
+    message, _ = await create_message(async_client_authenticated)
+
+    response = await async_client_authenticated.post('/api/messages/', json=message)
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
+@pytest.mark.asyncio
+async def test_update_message_to_existing_one(async_client_authenticated):
+    (message, _), (_, response_create) = await create_messages(async_client_authenticated, qty=2)
+
+    response = await async_client_authenticated.put(
+        f"/api/messages/{response_create.json()['id']}",
+        json=message,
+    )
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+
 @pytest.mark.asyncio
 async def test_get_message_paginated(async_client, async_client_authenticated):
     await create_messages(async_client_authenticated, qty=4)
@@ -135,3 +158,60 @@ async def test_get_detailed_stats(async_client_authenticated, async_client):
     assert response.status_code == status.HTTP_200_OK
     assert response.json()[0]['status'] == StatusEnum.created
     assert response.json()[0]['count'] == 1
+
+
+@pytest.mark.asyncio
+async def test_get_audience_stats_not_started_mailout(async_client_authenticated, async_client):
+    _, mailout_response = await create_mailout(async_client_authenticated)
+
+    response = await async_client.get(f"/api/messages/stats/{mailout_response.json()['id']}/audience")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == []
+
+
+@pytest.mark.asyncio
+async def test_get_message_queries(async_client_authenticated, async_client, count_queries):
+    _, response_create = await create_message(async_client_authenticated)
+
+    with count_queries() as statements:
+        response = await async_client.get(f"/api/messages/{response_create.json()['id']}")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert len(statements) == 1
+
+
+@pytest.mark.asyncio
+async def test_export_messages(async_client_authenticated):
+    messages = await create_messages(async_client_authenticated, qty=2)
+    message_id = messages[1][1].json()['id']
+    await async_client_authenticated.delete(f'/api/messages/{message_id}')
+
+    response = await async_client_authenticated.get(
+        '/api/messages/export',
+        params={'format': 'ndjson', 'status': StatusEnum.deleted},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [(row['id'], row['status'], row['mailout_id']) for row in rows] == [
+        (message_id, StatusEnum.deleted, messages[1][0]['mailout_id']),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_export_messages_csv(async_client_authenticated):
+    messages = await create_messages(async_client_authenticated, qty=2)
+
+    response = await async_client_authenticated.get(
+        '/api/messages/export',
+        params={'mailout_id': messages[0][0]['mailout_id']},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    lines = response.text.splitlines()
+    assert lines[0] == 'id,created_at,status,mailout_id,customer_id'
+    assert [line.split(',')[2:] for line in lines[1:]] == [
+        [StatusEnum.created, str(messages[0][0]['mailout_id']), str(messages[0][0]['customer_id'])],
+    ]
@@ -103,3 +103,15 @@ async def test_not_unique_phone_codes(async_client, async_client_authenticated):
 
     response = await async_client.get('/api/phone_codes/')
     assert len(response.json()) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_phone_code_queries(async_client_authenticated, async_client, count_queries):
+    _, response_create = await create_phone_code(async_client_authenticated)
+
+    with count_queries() as statements:
+        response = await async_client.get(f"/api/phone_codes/{response_create.json()['id']}")
+
+    assert response.status_code == status.HTTP_200_OK
+    # customers and mailouts with the phone code are not loaded
+    assert len(statements) == 1
@@ -70,3 +70,13 @@ def test_mailout_instance_message_empty():
             available_start_at=time(9, 0, 0),
             available_finish_at=time(18, 0, 0),
         )
+
+
+def test_mailout_instance_max_in_flight_not_positive():
+    with pytest.raises(expected_exception=ValidationError):
+        MailoutCreate(
+            start_at=datetime(2023, 7, 12),
+            finish_at=datetime(2023, 7, 13),
+            text_message='Test message',
+            max_in_flight=0,
+        )
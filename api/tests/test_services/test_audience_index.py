@@ -0,0 +1,131 @@
+import pytest
+import pytest_asyncio
+
+from repositories.customers import CustomerRepository
+from repositories.tags import TagRepository
+from schemas.customers import Customer
+from schemas.tags import TagCreate
+from services.audience_index import AudienceIndex, audience_index
+from tests.test_repositories.test_customers import create_audience_customer
+
+
+@pytest_asyncio.fixture()
+async def indexed_db_session(db_session):
+    await audience_index.build(db_session)
+    yield db_session
+    audience_index.reset()
+
+
+@pytest.mark.asyncio
+async def test_audience_index_build(db_session):
+    first, phone_code_980, (vip, new) = await create_audience_customer(db_session, '980', '1111111', ['VIP', 'New'])
+    second, phone_code_950, _ = await create_audience_customer(db_session, '950', '2222222', ['New'])
+    index = AudienceIndex()
+
+    await index.build(db_session)
+
+    assert index.ready is True
+    assert list(index.select(tag_ids=[vip.id])) == [first.id]
+    assert list(index.select(tag_ids=[vip.id, new.id])) == [first.id, second.id]
+    assert list(index.select(tag_ids=[new.id], phone_code_ids=[phone_code_950.id])) == [second.id]
+    assert list(index.select(phone_code_ids=[phone_code_980.id])) == [first.id]
+    assert index.count() == 2
+    assert index.count(tag_ids=[-1]) == 0
+
+
+def test_audience_index_incremental_updates():
+    index = AudienceIndex()
+    index.ready = True
+
+    index.set_customer(customer_id=1, phone_code_id=10, timezone_id=1)
+    index.set_customer(customer_id=2, phone_code_id=10, timezone_id=2)
+    index.add_customer_tag(customer_id=1, tag_id=100)
+    index.add_customer_tag(customer_id=2, tag_id=100)
+    index.remove_customer_tag(customer_id=2, tag_id=100)
+    index.set_customer(customer_id=1, phone_code_id=20, timezone_id=2)
+
+    assert list(index.select(tag_ids=[100])) == [1]
+    assert list(index.select(phone_code_ids=[10])) == [2]
+    assert list(index.select(phone_code_ids=[20])) == [1]
+    assert index.count_by_phone_code(index.select()) == {10: 1, 20: 1}
+    assert index.count_by_timezone(index.select()) == {2: 2}
+
+    index.remove_customer(1)
+
+    assert index.count(tag_ids=[100]) == 0
+    assert index.count() == 1
+
+
+def test_audience_index_ignores_updates_until_built():
+    index = AudienceIndex()
+
+    index.add_customer_tag(customer_id=1, tag_id=100)
+
+    assert index.count(tag_ids=[100]) == 0
+
+
+@pytest.mark.asyncio
+async def test_audience_index_is_fresh_until_customers_change(db_session):
+    index = AudienceIndex()
+    assert not await index.is_fresh(db_session)
+
+    await index.build(db_session)
+    assert await index.is_fresh(db_session)
+
+    index._version -= 1
+    assert not await index.is_fresh(db_session)
+
+
+@pytest.mark.asyncio
+async def test_audience_index_is_fresh_after_own_changes(indexed_db_session, monkeypatch):
+    customer, _, _ = await create_audience_customer(indexed_db_session, '980', '1111111', ['VIP'])
+    await audience_index.build(indexed_db_session)
+    version = await audience_index._read_version(indexed_db_session)
+    reported_changes = 0
+
+    async def reported_version(session):
+        return version + reported_changes
+
+    monkeypatch.setattr(audience_index, '_read_version', reported_version)
+    await TagRepository(indexed_db_session).create(
+        model_id=customer.id, tag_create=TagCreate(tag='New'), parent_model=Customer,
+    )
+
+    assert await audience_index.is_fresh(indexed_db_session)
+    # the new customer tag is reported by Postgres
+    reported_changes = 1
+    assert await audience_index.is_fresh(indexed_db_session)
+    # and a change made by another process
+    reported_changes = 2
+    assert not await audience_index.is_fresh(indexed_db_session)
+
+
+@pytest.mark.asyncio
+async def test_audience_index_follows_repositories(indexed_db_session):
+    first, _, (vip,) = await create_audience_customer(indexed_db_session, '980', '1111111', ['VIP'])
+    second, _, _ = await create_audience_customer(indexed_db_session, '980', '2222222', [])
+
+    await TagRepository(indexed_db_session).create(
+        model_id=second.id,
+        tag_create=TagCreate(tag='VIP'),
+        parent_model=Customer,
+    )
+    assert list(audience_index.select(tag_ids=[vip.id])) == [first.id, second.id]
+
+    await CustomerRepository(indexed_db_session).delete_customer_tag(model_id=first.id, tag_id=vip.id)
+    assert list(audience_index.select(tag_ids=[vip.id])) == [second.id]
+
+
+@pytest.mark.asyncio
+async def test_list_customers_does_not_depend_on_audience_index(indexed_db_session):
+    repository = CustomerRepository(indexed_db_session)
+    first, _, _ = await create_audience_customer(indexed_db_session, '980', '1111111', ['VIP'])
+    second, _, _ = await create_audience_customer(indexed_db_session, '950', '2222222', ['VIP', 'New'])
+    third, _, _ = await create_audience_customer(indexed_db_session, '980', '3333333', ['New'])
+    # as if the customer was changed by another process
+    audience_index.remove_customer(first.id)
+
+    assert [c.id for c in await repository.list(tag=['VIP'])] == [first.id, second.id]
+    assert [c.id for c in await repository.list(tag=['VIP', 'New'], offset=1)] == [second.id, third.id]
+    assert [c.id for c in await repository.list(tag=['New'], phone_code='980')] == [third.id]
+    assert [c.id for c in await repository.list(phone_code='980')] == [first.id, third.id]
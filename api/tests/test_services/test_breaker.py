@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from db.sessions import async_redis
+from services.sender.breaker import BreakerState, CircuitBreaker
+
+
+@pytest_asyncio.fixture()
+async def breaker():
+    breaker = CircuitBreaker(
+        name='test_breaker',
+        redis=async_redis,
+        failure_threshold=3,
+        failure_window=60,
+        reset_timeout=0.2,
+        state_ttl=0,
+    )
+    await breaker.reset()
+    yield breaker
+    await breaker.reset()
+
+
+@pytest.mark.asyncio
+async def test_breaker_closed_allows_requests(breaker):
+    assert await breaker.allow_request() is True
+    assert breaker.state == BreakerState.closed
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_after_failures(breaker):
+    for _ in range(3):
+        await breaker.record_failure()
+
+    assert breaker.state == BreakerState.open
+    assert await breaker.allow_request() is False
+
+
+@pytest.mark.asyncio
+async def test_breaker_state_is_shared(breaker):
+    other_worker_breaker = CircuitBreaker(
+        name='test_breaker', redis=async_redis, reset_timeout=0.2, state_ttl=0,
+    )
+
+    for _ in range(3):
+        await breaker.record_failure()
+
+    assert await other_worker_breaker.allow_request() is False
+    assert other_worker_breaker.state == BreakerState.open
+
+
+@pytest.mark.asyncio
+async def test_breaker_half_open_allows_single_probe(breaker):
+    for _ in range(3):
+        await breaker.record_failure()
+    await asyncio.sleep(0.3)
+
+    assert await breaker.allow_request() is True
+    assert breaker.state == BreakerState.half_open
+    assert await breaker.allow_request() is False
+
+
+@pytest.mark.asyncio
+async def test_breaker_closes_after_successful_probe(breaker):
+    for _ in range(3):
+        await breaker.record_failure()
+    await asyncio.sleep(0.3)
+    await breaker.allow_request()
+
+    await breaker.record_success()
+
+    assert breaker.state == BreakerState.closed
+    assert await breaker.allow_request() is True
+
+
+@pytest.mark.asyncio
+async def test_breaker_reopens_after_failed_probe(breaker):
+    for _ in range(3):
+        await breaker.record_failure()
+    await asyncio.sleep(0.3)
+    await breaker.allow_request()
+
+    await breaker.record_failure()
+
+    assert breaker.state == BreakerState.open
+    assert await breaker.allow_request() is False
@@ -0,0 +1,32 @@
+import time
+from datetime import datetime, timedelta
+
+from db.config import settings
+from services.sender.celery_app import celery_app, revoke_mailout_start, schedule_mailout_start
+
+
+def test_schedule_mailout_start_with_unreachable_broker(unreachable_broker):
+    started_at = time.monotonic()
+
+    schedule_mailout_start(1, datetime.utcnow(), task_id='start-task')
+
+    assert time.monotonic() - started_at < 5
+
+
+def test_revoke_mailout_start_with_unreachable_broker(unreachable_broker):
+    started_at = time.monotonic()
+
+    revoke_mailout_start('start-task')
+
+    assert time.monotonic() - started_at < 5
+
+
+def test_distant_mailout_start_is_left_to_the_scan(monkeypatch):
+    sent = []
+    monkeypatch.setattr(celery_app, 'send_task', lambda *args, **kwargs: sent.append(args))
+
+    schedule_mailout_start(1, datetime.utcnow() + timedelta(seconds=settings.sender_start_horizon + 60), 'start-task')
+    assert sent == []
+
+    schedule_mailout_start(1, datetime.utcnow() + timedelta(minutes=1), 'start-task')
+    assert len(sent) == 1
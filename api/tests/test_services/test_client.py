@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from db.sessions import async_redis
+from services.sender.breaker import CircuitBreaker, CircuitBreakerOpenError
+from services.sender.client import Client, MailoutMessage
+
+
+async def send_handler(request):
+    request.app['requests'] += 1
+    await asyncio.sleep(request.app['latency'])
+    body = await request.json()
+    status = 200 if body['phone'] != 'fail' else 400
+    return web.json_response({'code': 0, 'message': 'OK'}, status=status)
+
+
+@pytest_asyncio.fixture()
+async def provider():
+    app = web.Application()
+    app['latency'] = 0.2
+    app['requests'] = 0
+    app.router.add_post('/v1/send/{message_id}', send_handler)
+    server = TestServer(app)
+    await server.start_server()
+    yield server
+    await server.close()
+
+
+@pytest_asyncio.fixture()
+async def breaker():
+    breaker = CircuitBreaker(name='test_client', redis=async_redis, failure_threshold=2, state_ttl=0)
+    await breaker.reset()
+    yield breaker
+    await breaker.reset()
+
+
+@pytest_asyncio.fixture()
+async def client(provider, breaker):
+    client = Client(breaker=breaker)
+    client.api_base_url = str(provider.make_url('/v1/send'))
+    await client.start()
+    yield client
+    await client.close()
+
+
+def make_message(message_id: int = 1, phone: str = '79201234567') -> MailoutMessage:
+    return MailoutMessage(id=message_id, phone=phone, text='Test message')
+
+
+@pytest.mark.asyncio
+async def test_start_sends_no_requests(provider, client):
+    await client.start()
+
+    assert provider.app['requests'] == 0
+
+    await client.send_mailout(make_message())
+
+    assert provider.app['requests'] == 1
+
+
+@pytest.mark.asyncio
+async def test_send_mailout(client):
+    status, text = await client.send_mailout(make_message())
+
+    assert status == 200
+    assert 'OK' in text
+
+
+@pytest.mark.asyncio
+async def test_send_mailout_client_error(client):
+    status, _ = await client.send_mailout(make_message(phone='fail'))
+
+    assert status == 400
+
+
+@pytest.mark.asyncio
+async def test_send_mailout_connection_error(breaker):
+    client = Client(breaker=breaker)
+    client.api_base_url = 'http://127.0.0.1:1/v1/send'
+
+    status, text = await client.send_mailout(make_message())
+    await client.close()
+
+    assert status == 500
+    assert 'resulted in an error' in text
+
+
+@pytest.mark.asyncio
+async def test_send_mailout_does_not_block_event_loop(client):
+    started_at = time.monotonic()
+    results = await asyncio.gather(*(
+        client.send_mailout(make_message(message_id=i))
+        for i in range(20)
+    ))
+
+    assert all(status == 200 for status, _ in results)
+    assert time.monotonic() - started_at < 1
+
+
+@pytest.mark.asyncio
+async def test_send_mailout_fails_fast_when_breaker_is_open(breaker):
+    client = Client(breaker=breaker)
+    client.api_base_url = 'http://127.0.0.1:1/v1/send'
+
+    for _ in range(2):
+        await client.send_mailout(make_message())
+
+    with pytest.raises(expected_exception=CircuitBreakerOpenError):
+        await client.send_mailout(make_message())
+    await client.close()
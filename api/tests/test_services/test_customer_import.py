@@ -0,0 +1,180 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+
+from repositories.customers import CustomerRepository
+from repositories.phone_codes import PhoneCodeRepository
+from repositories.timezones import TimezoneRepository
+from schemas.base import FileFormatEnum
+from schemas.customers import Customer, CustomerCreate
+from schemas.link_schemas import CustomerTag
+from schemas.phone_codes import PhoneCodeCreate
+from schemas.tags import Tag
+from schemas.timezones import TimezoneCreate
+from services.audience_index import audience_index
+from services.customer_import import CustomerImporter, read_csv, read_lines
+
+
+async def stream(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest_asyncio.fixture()
+async def repository(db_session):
+    await PhoneCodeRepository(db_session).create(PhoneCodeCreate(phone_code='980'))
+    await PhoneCodeRepository(db_session).create(PhoneCodeCreate(phone_code='950'))
+    await TimezoneRepository(db_session).create(TimezoneCreate(timezone='Europe/Belgrade'))
+    await TimezoneRepository(db_session).create(TimezoneCreate(timezone='Europe/Moscow'))
+    return CustomerRepository(db_session)
+
+
+async def select_customers(db_session):
+    results = await db_session.execute(
+        select(Customer.phone, Customer.phone_code_id, Customer.timezone_id).order_by(Customer.phone)
+    )
+    return results.all()
+
+
+async def select_customer_tags(db_session):
+    results = await db_session.execute(
+        select(Customer.phone, Tag.tag)
+        .join(CustomerTag, CustomerTag.customer_id == Customer.id)
+        .join(Tag, Tag.id == CustomerTag.tag_id)
+        .order_by(Customer.phone, Tag.tag)
+    )
+    return results.all()
+
+
+@pytest.mark.asyncio
+async def test_read_lines():
+    lines = [line async for line in read_lines(stream(b'\xef\xbb\xbfa,b\r\n1,', b'2\n\n3,4'))]
+
+    assert lines == [(1, 'a,b\r'), (2, '1,2'), (4, '3,4')]
+
+
+@pytest.mark.asyncio
+async def test_read_csv_quoted_line_breaks():
+    rows = [row async for row in read_csv(stream(b'a,b\r\n1,"x\n', b'\ny"\r\n\n', b'2,"z"'))]
+
+    assert rows == [(1, ['a', 'b']), (2, ['1', 'x\n\ny']), (6, ['2', 'z'])]
+
+
+@pytest.mark.asyncio
+async def test_read_csv_stray_quote_is_part_of_the_field():
+    rows = [row async for row in read_csv(stream(b'a,b\nab"c,1\n', b'd,2\n'))]
+
+    assert rows == [(1, ['a', 'b']), (2, ['ab"c', '1']), (3, ['d', '2'])]
+
+
+@pytest.mark.asyncio
+async def test_read_csv_reports_malformed_rows():
+    rows = [row async for row in read_csv(stream(b'a,b\n"x"y,1\n2,z\n3,"unterminated\n4,w\n'))]
+
+    assert rows == [
+        (1, ['a', 'b']),
+        (2, 'Row is not valid CSV: \',\' expected after \'"\''),
+        (3, ['2', 'z']),
+        (4, 'Row is not valid CSV: unexpected end of data'),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_import_csv(db_session, repository):
+    data = (
+        b'phone_code,phone,timezone,tags\n'
+        b'980,1111111,Europe/Belgrade,VIP;New\n'
+        b'980,123,Europe/Belgrade,\n'
+        b'999,2222222,,\n'
+        b'950,3333333,Mars/Olympus,\n'
+        b'950,2222222,,New\n'
+        b'950,2222222,Europe/Moscow,Other\n'
+    )
+
+    result = await CustomerImporter(repository, batch_size=2).run(stream(data[:50], data[50:]), FileFormatEnum.csv)
+
+    assert (result.rows, result.created, result.updated, result.failed) == (6, 2, 0, 3)
+    assert [(error.row, error.error) for error in result.errors] == [
+        (3, 'Phone is not a string of 7 digits'),
+        (4, "Phone code '999' not found"),
+        (5, "Timezone 'Mars/Olympus' not found"),
+    ]
+    assert await select_customers(db_session) == [('1111111', 1, 1), ('2222222', 2, 2)]
+    assert await select_customer_tags(db_session) == [
+        ('1111111', 'New'), ('1111111', 'VIP'), ('2222222', 'New'), ('2222222', 'Other'),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_import_csv_with_quoted_line_breaks(db_session, repository):
+    data = b'phone,phone_code,tags\n"1111111",980,"VIP;\nNew"\n2222222,950,\n'
+
+    result = await CustomerImporter(repository).run(stream(data), FileFormatEnum.csv)
+
+    assert (result.rows, result.created, result.failed) == (2, 2, 0)
+    assert await select_customer_tags(db_session) == [('1111111', 'New'), ('1111111', 'VIP')]
+
+
+@pytest.mark.asyncio
+async def test_import_rejects_nul_characters(db_session, repository):
+    data = b'phone_code,phone,tags\n980,1111111,V\x00IP\n950,2222222,\n'
+
+    result = await CustomerImporter(repository).run(stream(data), FileFormatEnum.csv)
+
+    assert (result.rows, result.created, result.failed) == (2, 1, 1)
+    assert [(error.row, error.error) for error in result.errors] == [(2, 'Row contains a NUL character')]
+    assert await select_customers(db_session) == [('2222222', 2, None)]
+
+
+@pytest.mark.asyncio
+async def test_import_ndjson_updates_existing_customers(db_session, repository):
+    await repository.create(CustomerCreate(country_code=7, phone_code_id=1, phone='1111111', timezone_id=1))
+    data = (
+        b'{"phone_code": "980", "phone": "1111111", "timezone": "Europe/Moscow", "tags": ["VIP"]}\n'
+        b'{"phone_code": 950, "phone": 2222222}\n'
+        b'not json\n'
+        b'["980", "3333333"]\n'
+    )
+
+    result = await CustomerImporter(repository).run(stream(data), FileFormatEnum.ndjson)
+
+    assert (result.rows, result.created, result.updated, result.failed) == (4, 1, 1, 2)
+    assert [error.row for error in result.errors] == [3, 4]
+    assert await select_customers(db_session) == [('1111111', 1, 2), ('2222222', 2, None)]
+    assert await select_customer_tags(db_session) == [('1111111', 'VIP')]
+
+
+@pytest.mark.asyncio
+async def test_import_keeps_timezone_if_not_given(db_session, repository):
+    await repository.create(CustomerCreate(country_code=7, phone_code_id=1, phone='1111111', timezone_id=2))
+
+    result = await CustomerImporter(repository).run(
+        stream(b'phone_code,phone\n980,1111111\n'), FileFormatEnum.csv,
+    )
+
+    assert (result.created, result.updated) == (0, 0)
+    assert await select_customers(db_session) == [('1111111', 1, 2)]
+
+
+@pytest.mark.asyncio
+async def test_import_reports_limited_errors(repository):
+    data = b'phone_code,phone\n' + b'980,1\n' * 5
+
+    result = await CustomerImporter(repository, max_errors=2).run(stream(data), FileFormatEnum.csv)
+
+    assert result.failed == 5
+    assert [error.row for error in result.errors] == [2, 3]
+
+
+@pytest.mark.asyncio
+async def test_import_updates_audience_index(db_session, repository):
+    await audience_index.build(db_session)
+    try:
+        await CustomerImporter(repository).run(
+            stream(b'phone_code,phone,timezone,tags\n980,1111111,Europe/Belgrade,VIP\n'), FileFormatEnum.csv,
+        )
+        vip_id = await db_session.scalar(select(Tag.id).where(Tag.tag == 'VIP'))
+
+        assert audience_index.count(tag_ids=[vip_id], phone_code_ids=[1]) == 1
+    finally:
+        audience_index.reset()
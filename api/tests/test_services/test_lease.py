@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from db.sessions import async_redis
+from services.sender.lease import Lease
+
+
+@pytest_asyncio.fixture()
+async def lease_name():
+    await async_redis.delete('lease:test_lease')
+    yield 'test_lease'
+    await async_redis.delete('lease:test_lease')
+
+
+@pytest.mark.asyncio
+async def test_lease_is_exclusive(lease_name):
+    lease = Lease(name=lease_name, redis=async_redis, ttl=10)
+    other_lease = Lease(name=lease_name, redis=async_redis, ttl=10)
+
+    assert await lease.acquire() is True
+    assert await other_lease.acquire() is False
+
+    await lease.release()
+    assert await other_lease.acquire() is True
+    await other_lease.release()
+
+
+@pytest.mark.asyncio
+async def test_lease_release_keeps_other_holders_lease(lease_name):
+    lease = Lease(name=lease_name, redis=async_redis, ttl=10)
+    other_lease = Lease(name=lease_name, redis=async_redis, ttl=10)
+    await lease.acquire()
+
+    await other_lease.release()
+
+    assert await async_redis.exists('lease:test_lease') == 1
+    await lease.release()
+
+
+@pytest.mark.asyncio
+async def test_lease_is_renewed_while_held(lease_name):
+    lease = Lease(name=lease_name, redis=async_redis, ttl=0.3)
+    await lease.acquire()
+
+    await asyncio.sleep(0.6)
+
+    assert await async_redis.exists('lease:test_lease') == 1
+    assert lease.lost is False
+    await lease.release()
+
+
+@pytest.mark.asyncio
+async def test_crashed_holders_lease_expires(lease_name):
+    lease = Lease(name=lease_name, redis=async_redis, ttl=0.2)
+    await lease.acquire()
+    lease._heartbeat.cancel()
+
+    await asyncio.sleep(0.3)
+
+    assert await Lease(name=lease_name, redis=async_redis, ttl=10).acquire() is True
+
+
+@pytest.mark.asyncio
+async def test_lost_lease_cancels_its_holder(lease_name):
+    lease = Lease(name=lease_name, redis=async_redis, ttl=0.3)
+
+    async def hold():
+        await lease.acquire()
+        await async_redis.delete('lease:test_lease')
+        await asyncio.sleep(10)
+
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(asyncio.create_task(hold()), timeout=1)
+    assert lease.lost is True
@@ -0,0 +1,450 @@
+import asyncio
+from datetime import datetime, time, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from db.config import settings
+from schemas.base import StatusEnum
+from repositories.mailouts import MailoutRepository
+from schemas.mailouts import Mailout
+from services.sender.breaker import CircuitBreakerOpenError
+from services.sender.client import ClientInterface, MailoutMessage
+from services.sender.mailout import MailoutService
+from services.sender.queues import SenderQueue
+from services.sender.rate_limiter import RateLimit
+from services.sender.retry import RetryPolicy
+from tests.test_services.test_status_buffer import FailingStatusBuffer, FakeStatusBuffer
+
+
+class FakeClient(ClientInterface):
+    def __init__(self, statuses: list[int] | None = None):
+        self.statuses = statuses or []
+        self.sent = []
+        self.released_rate_limits = []
+
+    def release_rate_limit(self, key: str) -> None:
+        self.released_rate_limits.append(key)
+
+    async def send_mailout(self, message: MailoutMessage, rate_limit: RateLimit | None = None) -> (int, str):
+        self.sent.append(message.id)
+        return (self.statuses.pop(0) if self.statuses else 200), ''
+
+
+class FakeMailoutService(MailoutService):
+    def __init__(self, latency: float = 0.05):
+        self.dispatched = []
+        super().__init__(client=FakeClient(), status_buffer=FakeStatusBuffer(), dispatch=self._record_dispatch)
+        self.latency = latency
+        self.processed = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.unavailable_for = set()
+        self.created_chunks = []
+        self.checkpoints = []
+        self.buckets = []
+        self.audience_size = 0
+        self.excluded_timezone_ids = None
+        self.snapshots = 0
+        self.scheduled_starts = []
+
+    def _record_dispatch(self, mailout_id, queue, countdown=None) -> None:
+        self.dispatched.append((mailout_id, queue))
+
+    async def _get_audience_size(self, mailout) -> int:
+        return self.audience_size
+
+    async def _create_pending_messages(self, mailout, customers) -> list:
+        self.created_chunks.append([customer.id for customer in customers])
+        return [(customer.id, customer) for customer in customers]
+
+    async def _get_delivery_buckets(self, mailout) -> list:
+        return self.buckets
+
+    async def _schedule_start(self, mailout, start_at) -> None:
+        self.scheduled_starts.append((mailout.id, start_at))
+
+    async def _create_audience_snapshot(self, mailout) -> None:
+        self.snapshots += 1
+        mailout.audience_snapshot_at = datetime.utcnow()
+
+    async def _read_audience(self, mailout, exclude_timezone_ids=None):
+        self.excluded_timezone_ids = exclude_timezone_ids
+        async for customers in make_customer_chunks(self.audience_size):
+            yield customers
+
+    async def _write_checkpoint(self, mailout, last_customer_id) -> bool:
+        self.checkpoints.append(last_customer_id)
+        return True
+
+    async def _process_customer_mailout(self, mailout, customer, message_id) -> None:
+        if customer.id in self.unavailable_for:
+            raise CircuitBreakerOpenError
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.latency)
+        self.in_flight -= 1
+        self.processed.append(customer.id)
+        await self._status_buffer.add(message_id, StatusEnum.sent)
+
+
+def make_mailout(max_in_flight: int | None = None, finish_in: timedelta = timedelta(hours=1)) -> Mailout:
+    _now = datetime.utcnow()
+    return Mailout(
+        id=1,
+        text_message='Test message',
+        start_at=_now,
+        finish_at=_now + finish_in,
+        max_in_flight=max_in_flight,
+    )
+
+
+async def make_customer_chunks(qty: int, chunk_size: int = 1000):
+    for start in range(1, qty + 1, chunk_size):
+        yield [SimpleNamespace(id=i) for i in range(start, min(start + chunk_size, qty + 1))]
+
+
+@pytest.mark.asyncio
+async def test_process_customers_bounded_concurrency():
+    service = FakeMailoutService()
+
+    processed = await service._process_customers(
+        mailout=make_mailout(max_in_flight=5),
+        customer_chunks=make_customer_chunks(20),
+    )
+
+    assert processed == 20
+    assert sorted(service.processed) == list(range(1, 21))
+    assert service.max_in_flight == 5
+
+
+@pytest.mark.asyncio
+async def test_process_customers_creates_pending_messages_by_chunks():
+    service = FakeMailoutService(latency=0)
+
+    processed = await service._process_customers(
+        mailout=make_mailout(),
+        customer_chunks=make_customer_chunks(10, chunk_size=4),
+    )
+
+    assert processed == 10
+    assert service.created_chunks == [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]]
+
+
+@pytest.mark.asyncio
+async def test_process_customers_saves_checkpoint_after_processed_chunks():
+    service = FakeMailoutService(latency=0)
+    mailout = make_mailout()
+
+    await service._process_customers(
+        mailout=mailout,
+        customer_chunks=make_customer_chunks(10, chunk_size=4),
+    )
+
+    assert service.checkpoints[-1] == 10
+    assert service.checkpoints == sorted(service.checkpoints)
+    assert mailout.last_customer_id == 10
+
+
+@pytest.mark.asyncio
+async def test_process_customers_keeps_checkpoint_when_snapshot_is_reset():
+    class ResetSnapshotMailoutService(FakeMailoutService):
+        async def _write_checkpoint(self, mailout, last_customer_id) -> bool:
+            self.checkpoints.append(last_customer_id)
+            return False
+
+    service = ResetSnapshotMailoutService(latency=0)
+    mailout = make_mailout()
+
+    await service._process_customers(
+        mailout=mailout,
+        customer_chunks=make_customer_chunks(10, chunk_size=4),
+    )
+
+    assert service.checkpoints
+    assert mailout.last_customer_id is None
+
+
+@pytest.mark.asyncio
+async def test_process_customers_skips_checkpoint_when_statuses_are_not_written():
+    service = FakeMailoutService(latency=0)
+    service._status_buffer = FailingStatusBuffer(failures=100)
+    mailout = make_mailout()
+
+    await service._process_customers(
+        mailout=mailout,
+        customer_chunks=make_customer_chunks(10, chunk_size=4),
+    )
+
+    assert service.checkpoints == []
+    assert mailout.last_customer_id is None
+    await service._status_buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_process_customers_flushes_statuses_on_finish():
+    service = FakeMailoutService(latency=0)
+
+    await service._process_customers(
+        mailout=make_mailout(),
+        customer_chunks=make_customer_chunks(3),
+    )
+
+    assert service._status_buffer.writes == [{1: StatusEnum.sent, 2: StatusEnum.sent, 3: StatusEnum.sent}]
+
+
+@pytest.mark.asyncio
+async def test_process_customers_runs_sends_concurrently():
+    service = FakeMailoutService(latency=0.2)
+    started_at = asyncio.get_running_loop().time()
+
+    await service._process_customers(
+        mailout=make_mailout(max_in_flight=50),
+        customer_chunks=make_customer_chunks(50),
+    )
+
+    assert asyncio.get_running_loop().time() - started_at < 1
+
+
+@pytest.mark.asyncio
+async def test_process_customers_expired_mailout():
+    service = FakeMailoutService()
+
+    processed = await service._process_customers(
+        mailout=make_mailout(finish_in=timedelta(seconds=-1)),
+        customer_chunks=make_customer_chunks(5),
+    )
+
+    assert processed == 0
+    assert service.processed == []
+
+
+@pytest.mark.asyncio
+async def test_process_customers_deferred_when_breaker_is_open():
+    service = FakeMailoutService()
+    service.unavailable_for = {3}
+
+    processed = await service._process_customers(
+        mailout=make_mailout(max_in_flight=1),
+        customer_chunks=make_customer_chunks(10),
+    )
+
+    assert processed == 3
+    assert service.processed == [1, 2]
+    assert service.checkpoints == []
+    assert service.dispatched == [(1, SenderQueue.retry)]
+
+
+@pytest.mark.asyncio
+async def test_process_mailouts_dispatches_jobs(monkeypatch):
+    async def select_mailout_jobs(self):
+        return [make_mailout()]
+
+    monkeypatch.setattr(MailoutRepository, 'select_mailout_jobs', select_mailout_jobs)
+    service = FakeMailoutService(latency=0)
+    service.audience_size = 10
+
+    await service.process_mailouts()
+
+    assert service.dispatched == [(1, SenderQueue.scheduled)]
+    assert service.created_chunks == []
+
+
+@pytest.mark.asyncio
+async def test_process_mailouts_dispatches_large_jobs_to_bulk_send(monkeypatch):
+    async def select_mailout_jobs(self):
+        return [make_mailout()]
+
+    monkeypatch.setattr(MailoutRepository, 'select_mailout_jobs', select_mailout_jobs)
+    monkeypatch.setattr(settings, 'sender_bulk_threshold', 10)
+    service = FakeMailoutService(latency=0)
+    service.audience_size = 10
+
+    await service.process_mailouts()
+
+    assert service.dispatched == [(1, SenderQueue.bulk_send)]
+
+
+@pytest.mark.asyncio
+async def test_start_mailout_skips_outdated_start_task(monkeypatch):
+    mailout = make_mailout()
+    mailout.start_task_id = 'start-2'
+
+    async def get(self, model_id):
+        return mailout
+
+    monkeypatch.setattr(MailoutRepository, 'get', get)
+    service = FakeMailoutService(latency=0)
+
+    await service.start_mailout(mailout.id, start_task_id='start-1')
+    assert service.dispatched == []
+
+    await service.start_mailout(mailout.id, start_task_id='start-2')
+    assert service.dispatched == [(mailout.id, SenderQueue.scheduled)]
+
+
+@pytest.mark.asyncio
+async def test_process_mailout_skipped_while_leased():
+    service = FakeMailoutService(latency=0)
+    mailout = make_mailout()
+    lease = service._get_lease(mailout)
+    await lease.acquire()
+
+    try:
+        await service._process_mailout(mailout)
+    finally:
+        await lease.release()
+
+    assert service.created_chunks == []
+
+
+@pytest.mark.asyncio
+async def test_process_mailout_skips_closed_delivery_windows():
+    service = FakeMailoutService(latency=0)
+    service.audience_size = 3
+    service.buckets = [
+        SimpleNamespace(utc_offset=timedelta(0), is_open=False, timezone_ids=[1, 2]),
+        SimpleNamespace(utc_offset=timedelta(hours=3), is_open=True, timezone_ids=[3]),
+    ]
+
+    await service._process_mailout(make_mailout())
+
+    assert service.excluded_timezone_ids == [1, 2]
+    assert service.processed == [1, 2, 3]
+    assert service.checkpoints == []
+
+
+@pytest.mark.asyncio
+async def test_process_mailout_is_started_again_when_window_opens():
+    service = FakeMailoutService(latency=0)
+    service.buckets = [
+        SimpleNamespace(utc_offset=timedelta(hours=3), is_open=False, timezone_ids=[1]),
+        SimpleNamespace(utc_offset=timedelta(hours=-3), is_open=False, timezone_ids=[2]),
+    ]
+    mailout = make_mailout(finish_in=timedelta(days=2))
+    mailout.available_start_at = time(9, 0, 0)
+    _now = datetime.utcnow()
+
+    await service._process_mailout(mailout)
+
+    # 09:00 at UTC+3 is 06:00 UTC, at UTC-3 it is 12:00 UTC
+    opens_at = min(
+        datetime.combine(_now.date() + timedelta(days=days), time(hour)) for days in (0, 1) for hour in (6, 12)
+        if datetime.combine(_now.date() + timedelta(days=days), time(hour)) > _now
+    )
+    assert service.scheduled_starts == [(mailout.id, opens_at)]
+    assert service.processed == []
+
+
+@pytest.mark.asyncio
+async def test_process_mailout_is_not_started_again_after_finish():
+    service = FakeMailoutService(latency=0)
+    service.buckets = [SimpleNamespace(utc_offset=timedelta(0), is_open=False, timezone_ids=[1])]
+    mailout = make_mailout(finish_in=timedelta(seconds=1))
+    mailout.available_start_at = time.min
+
+    await service._process_mailout(mailout)
+
+    assert service.scheduled_starts == []
+
+
+@pytest.mark.asyncio
+async def test_process_mailout_in_open_windows_is_not_started_again():
+    service = FakeMailoutService(latency=0)
+    service.audience_size = 1
+    service.buckets = [SimpleNamespace(utc_offset=timedelta(0), is_open=True, timezone_ids=[1])]
+
+    await service._process_mailout(make_mailout())
+
+    assert service.scheduled_starts == []
+
+
+@pytest.mark.asyncio
+async def test_process_mailout_snapshots_audience_once():
+    service = FakeMailoutService(latency=0)
+    service.audience_size = 3
+    mailout = make_mailout()
+
+    await service._process_mailout(mailout)
+    await service._process_mailout(mailout)
+
+    assert service.snapshots == 1
+    assert service._fbrq_client.released_rate_limits == [f'mailout:{mailout.id}'] * 2
+
+
+@pytest.mark.asyncio
+async def test_process_mailout_outside_all_delivery_windows():
+    service = FakeMailoutService(latency=0)
+    service.audience_size = 3
+    service.buckets = [SimpleNamespace(utc_offset=timedelta(0), is_open=False, timezone_ids=[1])]
+
+    await service._process_mailout(make_mailout())
+
+    assert service.processed == []
+
+
+@pytest.mark.asyncio
+async def test_process_customer_mailout_sends_to_msisdn():
+    class RecordingClient(FakeClient):
+        async def send_mailout(self, message: MailoutMessage, rate_limit: RateLimit | None = None) -> (int, str):
+            self.sent.append(message)
+            return 200, ''
+
+    client = RecordingClient()
+    status_buffer = FakeStatusBuffer()
+    service = MailoutService(client=client, status_buffer=status_buffer)
+
+    await service._process_customer_mailout(
+        mailout=make_mailout(),
+        customer=SimpleNamespace(id=1, msisdn='79801234567'),
+        message_id=10,
+    )
+    await status_buffer.flush()
+
+    assert client.sent == [MailoutMessage(id=10, phone='79801234567', text='Test message')]
+    assert status_buffer.writes == [{10: StatusEnum.sent}]
+
+
+@pytest.mark.asyncio
+async def test_send_message_retries_server_errors():
+    client = FakeClient(statuses=[500, 503, 200])
+    service = MailoutService(client=client, status_buffer=FakeStatusBuffer())
+    service._retry_policy = RetryPolicy(max_tries=3, base_delay=0.01, max_delay=0.01)
+
+    sent = await service._send_message(
+        mailout=make_mailout(),
+        client_msg=MailoutMessage(id=1, phone='79801234567', text='Test message'),
+    )
+
+    assert sent is True
+    assert len(client.sent) == 3
+
+
+@pytest.mark.asyncio
+async def test_send_message_does_not_retry_client_errors():
+    client = FakeClient(statuses=[400, 200])
+    service = MailoutService(client=client, status_buffer=FakeStatusBuffer())
+    service._retry_policy = RetryPolicy(max_tries=3, base_delay=0.01, max_delay=0.01)
+
+    sent = await service._send_message(
+        mailout=make_mailout(),
+        client_msg=MailoutMessage(id=1, phone='79801234567', text='Test message'),
+    )
+
+    assert sent is False
+    assert len(client.sent) == 1
+
+
+@pytest.mark.asyncio
+async def test_send_message_stops_retrying_at_finish_time():
+    client = FakeClient(statuses=[500, 500, 500])
+    service = MailoutService(client=client, status_buffer=FakeStatusBuffer())
+    service._retry_policy = RetryPolicy(max_tries=3, base_delay=3600, max_delay=3600)
+
+    sent = await service._send_message(
+        mailout=make_mailout(finish_in=timedelta(0)),
+        client_msg=MailoutMessage(id=1, phone='79801234567', text='Test message'),
+    )
+
+    assert sent is False
+    assert len(client.sent) == 1
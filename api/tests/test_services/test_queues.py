@@ -0,0 +1,10 @@
+from db.config import settings
+from services.sender.queues import SenderQueue, select_queue
+
+
+def test_select_queue():
+    assert select_queue(audience_size=settings.sender_bulk_threshold, manual=True) == SenderQueue.interactive
+    assert select_queue(retry=True) == SenderQueue.retry
+    assert select_queue(audience_size=settings.sender_bulk_threshold) == SenderQueue.bulk_send
+    assert select_queue(audience_size=1) == SenderQueue.scheduled
+    assert select_queue() == SenderQueue.scheduled
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from db.sessions import async_redis
+from services.sender.rate_limiter import RateLimit, RateLimiter
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def clean_buckets():
+    keys = await async_redis.keys('rate_limit:*')
+    if keys:
+        await async_redis.delete(*keys)
+    yield
+
+
+async def acquire_many(limiter: RateLimiter, qty: int, sub_limit: RateLimit | None = None) -> float:
+    loop = asyncio.get_running_loop()
+    started_at = loop.time()
+    for _ in range(qty):
+        await limiter.acquire(sub_limit)
+    return loop.time() - started_at
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_unlimited():
+    limiter = RateLimiter(redis=async_redis, rate=0)
+
+    assert await acquire_many(limiter, 1000) < 0.5
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_global_rate():
+    limiter = RateLimiter(redis=async_redis, rate=20, burst=5, batch_size=5)
+
+    elapsed = await acquire_many(limiter, 25)
+
+    assert 0.8 < elapsed < 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_is_shared_between_workers():
+    limiters = [RateLimiter(redis=async_redis, rate=20, burst=5, batch_size=1) for _ in range(2)]
+
+    started_at = asyncio.get_running_loop().time()
+    await asyncio.gather(*(acquire_many(limiter, 13) for limiter in limiters))
+
+    assert asyncio.get_running_loop().time() - started_at > 0.8
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_sub_limit():
+    limiter = RateLimiter(redis=async_redis, rate=1000, batch_size=10)
+    sub_limit = RateLimit(key='mailout:1', rate=10, burst=1)
+
+    elapsed = await acquire_many(limiter, 6, sub_limit)
+
+    assert elapsed > 0.4
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_releases_sub_limit():
+    limiter = RateLimiter(redis=async_redis, rate=1000, batch_size=10)
+    finished = RateLimit(key='mailout:1', rate=10)
+    running = RateLimit(key='mailout:2', rate=10)
+    await limiter.acquire(finished)
+    await limiter.acquire(running)
+
+    limiter.release(finished.key)
+
+    assert [limits[-1] for limits in limiter._locks] == [running]
+    assert [limits[-1] for limits in limiter._reserved] == [running]
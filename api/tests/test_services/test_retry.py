@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.sender.retry import RetryPolicy
+
+
+@pytest.mark.parametrize('status', [500, 502, 503, 504, 408, 429])
+def test_retry_policy_retryable_status(status):
+    assert RetryPolicy().is_retryable(status) is True
+
+
+@pytest.mark.parametrize('status', [400, 401, 403, 404, 422])
+def test_retry_policy_not_retryable_status(status):
+    assert RetryPolicy().is_retryable(status) is False
+
+
+def test_retry_policy_backoff_is_capped():
+    policy = RetryPolicy(base_delay=1, max_delay=5)
+
+    delays = [policy.backoff(try_number) for try_number in range(10) for _ in range(20)]
+
+    assert all(0 <= delay <= 5 for delay in delays)
+    assert max(policy.backoff(0) for _ in range(100)) <= 1
+
+
+@pytest.mark.asyncio
+async def test_retry_policy_wait_before_deadline():
+    policy = RetryPolicy(base_delay=0.01, max_delay=0.01)
+
+    assert await policy.wait(0, deadline=datetime.utcnow() + timedelta(hours=1)) is True
+
+
+@pytest.mark.asyncio
+async def test_retry_policy_wait_after_deadline():
+    policy = RetryPolicy(base_delay=10, max_delay=10)
+
+    assert await policy.wait(5, deadline=datetime.utcnow() - timedelta(seconds=1)) is False
+
+
+@pytest.mark.asyncio
+async def test_retry_policy_wait_does_not_block_event_loop():
+    policy = RetryPolicy(base_delay=0.3, max_delay=0.3)
+    deadline = datetime.utcnow() + timedelta(hours=1)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    await asyncio.gather(policy.wait(10, deadline=deadline), tick())
+
+    assert ticks == 5
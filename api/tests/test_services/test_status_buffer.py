@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from schemas.base import StatusEnum
+from services.sender.status_buffer import MessageStatusBuffer
+
+
+class FakeStatusBuffer(MessageStatusBuffer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writes = []
+
+    async def _write(self, statuses: dict[int, str]) -> None:
+        self.writes.append(statuses)
+
+
+@pytest.mark.asyncio
+async def test_status_buffer_flushes_by_size():
+    buffer = FakeStatusBuffer(flush_size=3, flush_interval=3600)
+
+    for message_id in range(1, 8):
+        await buffer.add(message_id, StatusEnum.sent)
+
+    assert buffer.writes == [
+        {1: StatusEnum.sent, 2: StatusEnum.sent, 3: StatusEnum.sent},
+        {4: StatusEnum.sent, 5: StatusEnum.sent, 6: StatusEnum.sent},
+    ]
+    assert len(buffer) == 1
+
+    await buffer.close()
+    assert buffer.writes[-1] == {7: StatusEnum.sent}
+
+
+@pytest.mark.asyncio
+async def test_status_buffer_flushes_by_interval():
+    buffer = FakeStatusBuffer(flush_size=100, flush_interval=0.05)
+
+    await buffer.add(1, StatusEnum.sent)
+    await buffer.add(2, StatusEnum.failed)
+    assert buffer.writes == []
+
+    await asyncio.sleep(0.1)
+
+    assert buffer.writes == [{1: StatusEnum.sent, 2: StatusEnum.failed}]
+    assert len(buffer) == 0
+
+
+class FailingStatusBuffer(FakeStatusBuffer):
+    def __init__(self, *args, failures: int = 1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failures = failures
+
+    async def _write(self, statuses: dict[int, str]) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('DB is unavailable')
+        await super()._write(statuses)
+
+
+@pytest.mark.asyncio
+async def test_status_buffer_keeps_statuses_after_write_error():
+    buffer = FailingStatusBuffer(flush_size=1, flush_interval=3600)
+
+    await buffer.add(1, StatusEnum.sent)
+
+    assert len(buffer) == 1
+    await buffer.add(1, StatusEnum.failed)
+    assert buffer.writes == []
+
+    assert await buffer.flush()
+    assert buffer.writes == [{1: StatusEnum.failed}]
+    assert len(buffer) == 0
+
+
+@pytest.mark.asyncio
+async def test_status_buffer_retries_failed_write_by_interval():
+    buffer = FailingStatusBuffer(flush_size=1, flush_interval=0.05)
+
+    await buffer.add(1, StatusEnum.sent)
+    await asyncio.sleep(0.1)
+
+    assert buffer.writes == [{1: StatusEnum.sent}]
+
+
+@pytest.mark.asyncio
+async def test_status_buffer_flush_waits_for_background_flush():
+    class SlowStatusBuffer(FakeStatusBuffer):
+        async def _write(self, statuses: dict[int, str]) -> None:
+            await asyncio.sleep(0.05)
+            await super()._write(statuses)
+
+    buffer = SlowStatusBuffer(flush_size=100, flush_interval=0)
+    await buffer.add(1, StatusEnum.sent)
+    await asyncio.sleep(0.01)
+    assert len(buffer) == 0
+
+    assert await buffer.flush()
+
+    assert buffer.writes == [{1: StatusEnum.sent}]
@@ -0,0 +1,18 @@
+from services.sender import worker_runtime
+
+
+async def answer():
+    return 42
+
+
+def test_worker_runtime_reuses_event_loop():
+    loop = worker_runtime.get_loop()
+
+    assert worker_runtime.run(answer()) == 42
+    assert worker_runtime.get_loop() is loop
+    if worker_runtime.uvloop is not None:
+        assert isinstance(loop, worker_runtime.uvloop.Loop)
+
+    loop.close()
+    assert worker_runtime.get_loop() is not loop
+    worker_runtime.get_loop().close()
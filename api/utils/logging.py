@@ -5,7 +5,7 @@ import logging
 from logging.handlers import TimedRotatingFileHandler
 import os
 
-import celery
+import celery.signals
 from fastapi import Request
 
 
@@ -18,6 +18,7 @@ class LoggerConfig:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.logfile = os.path.join('utils/logs/log_file.log')
+        os.makedirs(os.path.dirname(self.logfile), exist_ok=True)
 
         self.handler_cmdline = logging.StreamHandler()
         self.handler_file = TimedRotatingFileHandler(